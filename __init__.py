@@ -13,18 +13,41 @@ bl_info = {
 
 if "bpy" in locals():
     import importlib
+    importlib.reload(tracking)
     importlib.reload(properties)
+    importlib.reload(bulk)
+    importlib.reload(jobs)
+    importlib.reload(compositing)
     importlib.reload(operators)
     importlib.reload(panels)
     importlib.reload(shaders)
+    importlib.reload(geometry)
+    importlib.reload(noise)
+    importlib.reload(spectrum)
     importlib.reload(ogl)
+    importlib.reload(cpu)
+    importlib.reload(cache)
+    importlib.reload(writers)
+    importlib.reload(farm)
+    importlib.reload(profiling)
+    importlib.reload(preview)
 else:
+    from . import tracking
     from . import properties
+    from . import jobs
+    from . import compositing
     from . import operators
+    from . import bulk
     from . import panels
+    from . import shaders
+    from . import ogl
+    from . import cache
+    from . import spectrum
+    from . import preview
 
 import bpy
 import bpy.utils.previews
+from bpy.app.handlers import persistent
 
 _classes = [
     # properties
@@ -33,6 +56,7 @@ _classes = [
     properties.CameraProperties,
     properties.ResolutionProperties,
     properties.PositionProperties,
+    properties.AnimationProperties,
     properties.MasterProperties,
     # panels
     panels.GhostsUiList,
@@ -40,6 +64,7 @@ _classes = [
     panels.MainSettingsPanel,
     panels.PositionPanel,
     panels.ResolutionPanel,
+    panels.AnimationPanel,
     panels.FlareSettingsPanel,
     panels.GhostsPanel,
     panels.CameraOverridePanel,
@@ -53,9 +78,30 @@ _classes = [
     operators.OGLRenderOperator,
     operators.LoadDefaultSpectrumImageOperator,
     operators.RenderAnimationOperator,
+    operators.RenderAnimationFarmOperator,
 ]
 
 
+@persistent
+def _clear_jobs(*args):
+    """
+    Modal jobs are killed on file load, so none of them is running in loaded file
+    """
+    jobs.Jobs.clear()
+
+
+@persistent
+def _tag_images(scene, depsgraph=None):
+    """
+    Painted, reloaded and edited images are reported by depsgraph, baked spectrum of them is rebaked
+    """
+    if depsgraph is None:
+        return
+    for update in depsgraph.updates:
+        if isinstance(update.id, bpy.types.Image):
+            spectrum.tag_image(update.id.original.name_full)
+
+
 def register():
     for cls in _classes:
         bpy.utils.register_class(cls)
@@ -64,11 +110,36 @@ def register():
     coll = bpy.utils.previews.new()
     panels.previews['ghosts'] = coll
 
+    preview.Preview.register()
+    compositing.DirectComposite.register()
+    if _clear_jobs not in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.append(_clear_jobs)
+    if _tag_images not in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.append(_tag_images)
+
 
 def unregister():
+    preview.Preview.unregister()
+    compositing.DirectComposite.unregister()
+    if _clear_jobs in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(_clear_jobs)
+    if _tag_images in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(_tag_images)
+    jobs.Jobs.clear()
+    shaders.clear_cache()
+    ogl.UniformBinder.free_all()
+    ogl.ReadbackBuffer.free()
+    ogl.NoiseTexture.free_all()
+    ogl.SpectrumTexture.free_all()
+    spectrum.clear_cache()
+    ogl.LayerCache.free_all()
+    ogl.OffScreenPool.free_all()
+    cache.ResultCache.clear()
+
     for coll in panels.previews.values():
         bpy.utils.previews.remove(coll)
     panels.previews.clear()
+    panels.icon_colors.clear()
 
     for cls in _classes:
         bpy.utils.unregister_class(cls)
@@ -0,0 +1,429 @@
+"""
+Performance benchmark of lens flare rendering
+
+Blender, CPU backend in background, GPU backend needs Blender with UI for its GL context:
+    blender -b --factory-startup --python benchmark.py -- --output results.json
+    blender --factory-startup --python benchmark.py -- --backend gpu --output results.json
+Pure Python (CPU renderer only, Blender is not needed):
+    python benchmark.py --output results.json
+
+Results can be compared to stored results with `--baseline baseline.json`,
+exit code is 1 when any case is slower than the baseline by more than the threshold.
+"""
+import argparse
+import importlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+import types
+from typing import List
+
+# one axis is swept at a time, other settings stay at base values
+BASE_CASE = {
+    "resolution": (1280, 720),
+    "ghosts": 8,
+    "samples": 16,
+    "positions": 1,
+    "anamorphic": False,
+}
+
+SWEEPS = {
+    "resolution": [(1280, 720), (1920, 1080), (3840, 2160), (7680, 4320)],
+    "ghosts": [1, 10, 25, 50, 100],
+    "samples": [1, 16, 64, 256, 1024],
+    "positions": [1, 2, 4, 8],
+    "anamorphic": [False, True],
+}
+
+# smaller sweep for quick checks and the slow pure Python mode
+QUICK_SWEEPS = {
+    "resolution": [(640, 360), (1280, 720)],
+    "ghosts": [1, 10],
+    "samples": [1, 16],
+    "positions": [1, 2],
+    "anamorphic": [False, True],
+}
+
+
+def benchmark_cases(sweeps: dict, axes: List[str]) -> List[dict]:
+    """
+    :returns unique cases of all sweeps, base case included
+    """
+    cases = []
+    names = set()
+
+    for axis in axes:
+        for value in sweeps[axis]:
+            case = dict(BASE_CASE)
+            case[axis] = value
+            name = case_name(case)
+            if name not in names:
+                names.add(name)
+                cases.append(case)
+
+    return cases
+
+
+def case_name(case: dict) -> str:
+    width, height = case["resolution"]
+    anamorphic = "_anamorphic" if case["anamorphic"] else ""
+    return f"{width}x{height}_g{case['ghosts']}_s{case['samples']}_p{case['positions']}{anamorphic}"
+
+
+def ghost_settings(count: int) -> List[dict]:
+    """
+    Deterministic ghosts spread along flare axis, every other ghost is dispersed
+    """
+    ghosts = []
+
+    for index in range(count):
+        fraction = index / max(count - 1, 1)
+        ghosts.append({
+            "offset": -1.5 + 2.5 * fraction,
+            "perpendicular_offset": 0.0,
+            "size": 3.0 + 12.0 * ((index * 7) % 5) / 4,
+            "ratio": 1.0,
+            "intensity": 0.5,
+            "center_transparency": (index % 3) * 0.5,
+            "dispersion": 0.0 if index % 2 == 0 else 0.3,
+            "distortion": 0.1 if index % 4 == 3 else 0.0,
+            "dispersion_center": 'image' if index % 3 else 'ghost',
+        })
+
+    return ghosts
+
+
+def position_settings(count: int) -> List[tuple]:
+    """
+    :returns positions in normalized image coordinates spread around image center
+    """
+    return [(0.2 + 0.6 * (index + 0.5) / count, 0.65 - 0.3 * (index % 2)) for index in range(count)]
+
+
+class BlenderRunner:
+    """
+    Renders cases in Blender with the same operator as the UI
+    """
+    def __init__(self, package, backend: str):
+        import bpy
+
+        self.bpy = bpy
+        self.package = package
+        self.backend = backend
+
+        if not hasattr(bpy.types.Scene, 'lens_flare_props'):
+            package.register()
+
+        self.scene = bpy.context.scene
+        self.image = bpy.data.images.new("LensFlareBenchmark", 64, 64, float_buffer=True)
+
+    def mode(self) -> str:
+        return self.backend
+
+    def setup(self, case: dict):
+        props = self.scene.lens_flare_props
+
+        props.image = self.image
+        props.backend = self.backend
+        props.use_cache = False
+        props.use_incremental = False
+        props.use_profiling = True
+        props.profile_path = ''
+        props.debug_pos = False
+        props.camera.use_override = True
+        props.resolution.override_scene_resolution = True
+        props.resolution.resolution_x, props.resolution.resolution_y = case["resolution"]
+        props.dispersion_samples = case["samples"]
+        props.flare.anamorphic = case["anamorphic"]
+
+        props.ghosts.clear()
+        for settings in ghost_settings(case["ghosts"]):
+            ghost = props.ghosts.add()
+            for name, value in settings.items():
+                setattr(ghost, name, value)
+
+        props.positions.clear()
+        for x, y in position_settings(case["positions"]):
+            position = props.positions.add()
+            position.variant = 'manual'
+            position.manual_x = x
+            position.manual_y = y
+
+    def run(self) -> dict:
+        self.bpy.ops.render.lens_flare_ogl_render()
+
+        report = self.package.profiling.last_report()
+        pool_stats = self.package.ogl.OffScreenPool.stats()
+
+        return {
+            "stages": report["stages"],
+            "draw_calls": report["counters"].get("draw_calls", 0),
+            "gpu_memory": pool_stats["memory"] if self.backend == 'gpu' else 0,
+        }
+
+
+def compare_backends(runner: BlenderRunner, case: dict) -> float:
+    """
+    Renders case with GPU and CPU backend
+    :returns largest difference of pixel values
+    """
+    import numpy
+
+    images = []
+    for backend in ('gpu', 'cpu'):
+        runner.backend = backend
+        runner.setup(case)
+        runner.run()
+
+        pixels = numpy.empty(len(runner.image.pixels), dtype=numpy.float32)
+        runner.image.pixels.foreach_get(pixels)
+        images.append(pixels)
+
+    return float(numpy.abs(images[0] - images[1]).max())
+
+
+class PythonRunner:
+    """
+    Renders cases with CPU renderer without Blender, settings are plain objects
+    """
+    def __init__(self, package, tile_size: int, workers: int):
+        self.cpu = importlib.import_module(package.__name__ + '.cpu')
+        self.spectrum = importlib.import_module(package.__name__ + '.spectrum')
+        self.profiling = importlib.import_module(package.__name__ + '.profiling')
+        self.tile_size = tile_size
+        self.workers = workers
+        self.props = None
+        self.flare_positions = None
+
+    def mode(self) -> str:
+        return 'python'
+
+    def setup(self, case: dict):
+        ns = types.SimpleNamespace
+        width, height = case["resolution"]
+
+        self.props = ns(
+            resolution=ns(resolution_x=width, resolution_y=height),
+            camera=ns(blades=0, rotation=0.0),
+            flare=ns(color=(0.9, 0.9, 0.9), size=10.0, intensity=1.0, rays_intensity=1.0,
+                     anamorphic=case["anamorphic"]),
+            ghosts=[ns(color=(0.9, 0.9, 0.9), **settings) for settings in ghost_settings(case["ghosts"])],
+            master_intensity=1.0,
+            dispersion_samples=case["samples"],
+            use_adaptive_samples=False,
+            use_jitter=True,
+            noise_resolution='256',
+            noise_seed=0,
+            noise_type='white',
+        )
+        self.flare_positions = position_settings(case["positions"])
+
+    def run(self) -> dict:
+        self.profiling.begin_frame(True, use_gpu=False)
+        profiler = self.profiling.active()
+
+        with profiler.stage('collect'):
+            table = self.spectrum.bake_table(synthetic_spectrum())
+            params = self.cpu.collect_params(self.props, self.flare_positions, table)
+        with profiler.stage('render'):
+            self.cpu.render(params, self.tile_size, self.workers)
+
+        report = self.profiling.end_frame()
+        width = self.props.resolution.resolution_x
+        height = self.props.resolution.resolution_y
+
+        return {
+            "stages": report["stages"],
+            "draw_calls": len(self.cpu.tiles(width, height, self.tile_size)),
+            "gpu_memory": 0,
+        }
+
+
+def synthetic_spectrum():
+    """
+    Rainbow with the same layout as spectral.png, so pure Python mode doesn't need an image decoder
+    """
+    import numpy
+
+    x = (numpy.arange(256) + 0.5) / 256
+    spectrum = numpy.ones((1, 256, 4), dtype=numpy.float32)
+    spectrum[0, :, 0] = numpy.clip(1.5 - numpy.abs(x - 0.15) * 4.0, 0.0, 1.0)
+    spectrum[0, :, 1] = numpy.clip(1.5 - numpy.abs(x - 0.5) * 4.0, 0.0, 1.0)
+    spectrum[0, :, 2] = numpy.clip(1.5 - numpy.abs(x - 0.85) * 4.0, 0.0, 1.0)
+
+    return spectrum
+
+
+def run_case(runner, case: dict, repeats: int) -> dict:
+    """
+    Renders case once to warm up caches, then measures it `repeats` times
+    :returns result with median wall time and stages of the median run
+    """
+    runner.setup(case)
+    runner.run()
+
+    runs = []
+    for _ in range(repeats):
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = runner.run()
+        result["wall"] = time.perf_counter() - start
+        result["peak_memory"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        runs.append(result)
+
+    runs.sort(key=lambda run: run["wall"])
+    median = runs[len(runs) // 2]
+
+    return {
+        "name": case_name(case),
+        "case": case,
+        "wall": median["wall"],
+        "times": [run["wall"] for run in runs],
+        "stages": median["stages"],
+        "draw_calls": median["draw_calls"],
+        "peak_memory": max(run["peak_memory"] for run in runs),
+        "gpu_memory": median["gpu_memory"],
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float, min_delta: float) -> List[dict]:
+    """
+    :param threshold allowed relative slowdown
+    :param min_delta slowdowns shorter than this many seconds are ignored as noise
+    :returns regressions of cases present in both results
+    """
+    if results["mode"] != baseline.get("mode"):
+        print(f"Warning: comparing {results['mode']} results with {baseline.get('mode')} baseline")
+
+    baseline_cases = {case["name"]: case for case in baseline["cases"]}
+    regressions = []
+
+    for case in results["cases"]:
+        base = baseline_cases.get(case["name"])
+        if base is None:
+            continue
+
+        delta = case["wall"] - base["wall"]
+        if delta > min_delta and case["wall"] > base["wall"] * (1.0 + threshold):
+            regressions.append({
+                "name": case["name"],
+                "wall": case["wall"],
+                "baseline": base["wall"],
+                "ratio": case["wall"] / base["wall"],
+            })
+
+    return regressions
+
+
+def load_package(use_blender: bool):
+    """
+    Imports this add-on as package. Without Blender, package `__init__` is skipped, because it imports bpy.
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+
+    if use_blender:
+        sys.path.insert(0, os.path.dirname(directory))
+        return importlib.import_module(os.path.basename(directory))
+
+    package = types.ModuleType('lens_flare_benchmark')
+    package.__path__ = [directory]
+    sys.modules[package.__name__] = package
+    return package
+
+
+def parse_args(argv: List[str]):
+    parser = argparse.ArgumentParser(description="Lens flare performance benchmark")
+    parser.add_argument('--backend', choices=['gpu', 'cpu'],
+                        help="backend used inside Blender, gpu with UI and cpu in background by default")
+    parser.add_argument('--quick', action='store_true', help="use smaller sweep")
+    parser.add_argument('--axes', nargs='+', choices=list(SWEEPS.keys()), default=list(SWEEPS.keys()),
+                        help="swept settings")
+    parser.add_argument('--repeats', type=int, default=3, help="measured renders of every case")
+    parser.add_argument('--tile-size', type=int, default=256, help="tile size of pure Python mode")
+    parser.add_argument('--workers', type=int, default=0, help="workers of pure Python mode, 0 uses all cores")
+    parser.add_argument('--output', help="JSON file to write results to")
+    parser.add_argument('--baseline', help="JSON results to compare with")
+    parser.add_argument('--threshold', type=float, default=0.1, help="allowed relative slowdown")
+    parser.add_argument('--min-delta', type=float, default=0.002, help="ignored slowdown in seconds")
+    parser.add_argument('--check-backends', action='store_true',
+                        help="only compare GPU and CPU render of one flare position, needs Blender with UI")
+    parser.add_argument('--tolerance', type=float, default=0.02, help="allowed pixel difference of backends")
+    return parser.parse_args(argv)
+
+
+def main():
+    try:
+        import bpy
+    except ImportError:
+        bpy = None
+
+    if bpy is not None:
+        # Blender passes script arguments after `--`
+        argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    else:
+        argv = sys.argv[1:]
+
+    args = parse_args(argv)
+    package = load_package(bpy is not None)
+
+    # background Blender has no GL context
+    background = bpy is not None and bpy.app.background
+    if args.backend is None:
+        args.backend = 'cpu' if background else 'gpu'
+    if background and (args.backend == 'gpu' or args.check_backends):
+        sys.exit("GPU backend needs Blender with UI, run without `-b`")
+
+    if args.check_backends:
+        if bpy is None:
+            sys.exit("Backend check needs Blender")
+
+        # flare only, ghosts are dispersed with jitter, which differs between backends
+        case = dict(BASE_CASE, resolution=(640, 360), ghosts=0)
+        difference = compare_backends(BlenderRunner(package, 'gpu'), case)
+        print(f"Largest difference of GPU and CPU render: {difference:.4f}")
+        if difference > args.tolerance:
+            sys.exit(1)
+        return
+
+    if bpy is not None:
+        runner = BlenderRunner(package, args.backend)
+    else:
+        runner = PythonRunner(package, args.tile_size, args.workers)
+
+    cases = benchmark_cases(QUICK_SWEEPS if args.quick else SWEEPS, args.axes)
+
+    results = {
+        "mode": runner.mode(),
+        "blender": bpy.app.version_string if bpy is not None else None,
+        "python": sys.version.split()[0],
+        "cases": [],
+    }
+
+    for case in cases:
+        result = run_case(runner, case, max(args.repeats, 1))
+        results["cases"].append(result)
+        print(f"{result['name']}: {result['wall'] * 1000:.2f} ms, draw calls {result['draw_calls']}, "
+              f"peak memory {result['peak_memory'] / 1024 / 1024:.1f} MB", flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+
+        regressions = compare(results, baseline, args.threshold, args.min_delta)
+        for regression in regressions:
+            print(f"Regression {regression['name']}: {regression['wall'] * 1000:.2f} ms, "
+                  f"baseline {regression['baseline'] * 1000:.2f} ms ({regression['ratio']:.2f}x)")
+
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+from typing import Dict, Iterable, Sequence
+
+import bpy
+import numpy
+
+from . import tracking
+from .panels import tag_redraw
+
+# numeric ghost properties and number of their components
+ARRAY_FIELDS = {
+    "offset": 1,
+    "perpendicular_offset": 1,
+    "color": 3,
+    "size": 1,
+    "center_transparency": 1,
+    "intensity": 1,
+    "dispersion": 1,
+    "ratio": 1,
+    "distortion": 1,
+}
+# ghost properties without raw access, they are copied item by item
+ITEM_FIELDS = ("name", "dispersion_center")
+
+FIELDS = tuple(ARRAY_FIELDS) + ITEM_FIELDS
+
+
+def get_ghosts(props, fields: Iterable[str] = FIELDS) -> Dict[str, numpy.ndarray]:
+    """
+    Reads properties of all ghosts.
+    Array fields have no Python getters or setters, so foreach_get and foreach_set copy them in one call,
+    a Python callback on any of them would be called once per ghost.
+    :param fields names of properties from FIELDS
+    :returns float32 arrays with shape (count,) or (count, components), string arrays for item fields
+    """
+    ghosts = props.ghosts
+    count = len(ghosts)
+    values = {}
+
+    for field in fields:
+        if field in ARRAY_FIELDS:
+            components = ARRAY_FIELDS[field]
+            array = numpy.empty(count * components, dtype=numpy.float32)
+            ghosts.foreach_get(field, array)
+            values[field] = array.reshape((count, components)) if components > 1 else array
+        elif field in ITEM_FIELDS:
+            values[field] = numpy.array([getattr(ghost, field) for ghost in ghosts], dtype=object)
+        else:
+            raise KeyError(f"Unknown ghost property: {field}")
+
+    return values
+
+
+def set_ghosts(props, values: Dict[str, Sequence], start: int = 0):
+    """
+    Writes properties of ghosts starting at index `start`, arrays are as long as the number of written ghosts
+    """
+    with tracking.batch():
+        count = _write(props, values, start)
+        for index in range(start, start + count):
+            tracking.mark('ghosts', index)
+
+    _refresh()
+
+
+def create_ghosts(props, count: int, values: Dict[str, Sequence] = None) -> range:
+    """
+    Adds ghosts to the end of collection
+    :param values properties of new ghosts, missing properties keep defaults
+    :returns indices of new ghosts
+    """
+    start = len(props.ghosts)
+
+    with tracking.batch():
+        for _ in range(count):
+            props.ghosts.add()
+        if values:
+            _write(props, values, start)
+        tracking.mark_structure('ghosts')
+
+    _refresh()
+
+    return range(start, start + count)
+
+
+def duplicate_ghosts(props, indices: Iterable[int]) -> range:
+    """
+    Copies ghosts to the end of collection
+    :returns indices of copies
+    """
+    indices = list(indices)
+    values = {field: array[indices] for field, array in get_ghosts(props).items()}
+
+    return create_ghosts(props, len(indices), values)
+
+
+def reorder_ghosts(props, order: Sequence[int]):
+    """
+    Moves ghosts, so ghost at index `order[i]` ends at index `i`
+    :param order permutation of all ghost indices
+    """
+    order = numpy.asarray(order, dtype=numpy.int64)
+    if sorted(order.tolist()) != list(range(len(props.ghosts))):
+        raise ValueError("Order has to contain every ghost index once")
+
+    values = {field: array[order] for field, array in get_ghosts(props).items()}
+
+    with tracking.batch():
+        _write(props, values, 0)
+        tracking.mark_structure('ghosts')
+
+    # selection follows selected ghost, invalid selection is left unchanged
+    if 0 <= props.selected_ghost < len(order):
+        props.selected_ghost = int(numpy.flatnonzero(order == props.selected_ghost)[0])
+
+    _refresh()
+
+
+def delete_ghosts(props, indices: Iterable[int]):
+    """
+    Removes ghosts, remaining ghosts are moved forward and only the tail of collection is removed
+    """
+    count = len(props.ghosts)
+    keep = numpy.ones(count, dtype=bool)
+    keep[list(indices)] = False
+    kept = numpy.flatnonzero(keep)
+
+    values = {field: array[kept] for field, array in get_ghosts(props).items()}
+
+    with tracking.batch():
+        _write(props, values, 0)
+        for index in range(count - 1, len(kept) - 1, -1):
+            props.ghosts.remove(index)
+        tracking.mark_structure('ghosts')
+
+    props.selected_ghost = min(props.selected_ghost, max(len(kept) - 1, 0))
+
+    _refresh()
+
+
+def _write(props, values: Dict[str, Sequence], start: int) -> int:
+    """
+    Writes values without tracking
+    :returns number of written ghosts
+    """
+    ghosts = props.ghosts
+    total = len(ghosts)
+    written = 0
+
+    for field, items in values.items():
+        if field in ARRAY_FIELDS:
+            components = ARRAY_FIELDS[field]
+            items = numpy.asarray(items, dtype=numpy.float32).reshape(-1)
+            written = max(written, len(items) // components)
+
+            if start == 0 and len(items) == total * components:
+                ghosts.foreach_set(field, items)
+                continue
+
+            # foreach_set writes whole collection, so unchanged ghosts are written back
+            array = numpy.empty(total * components, dtype=numpy.float32)
+            ghosts.foreach_get(field, array)
+            array[start * components:start * components + len(items)] = items
+            ghosts.foreach_set(field, array)
+        elif field in ITEM_FIELDS:
+            written = max(written, len(items))
+            for index, item in enumerate(items, start):
+                setattr(ghosts[index], field, item)
+        else:
+            raise KeyError(f"Unknown ghost property: {field}")
+
+    return written
+
+
+def _refresh():
+    if bpy.context.window_manager is not None:
+        tag_redraw(bpy.context)
+
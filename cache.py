@@ -0,0 +1,219 @@
+import hashlib
+import os
+from collections import OrderedDict
+from typing import List, Optional
+
+import bpy
+import numpy
+
+from . import shaders
+from .spectrum import table_hash
+
+# properties, which don't change rendered image
+IGNORED_PROPERTIES = {
+    'rna_type',
+    # names of ghosts and positions
+    'name',
+    'image',
+    'active_object',
+    'selected_ghost',
+    'offscreen_budget',
+    'cpu_workers',
+    'cpu_pool',
+    'use_cache',
+    'cache_memory',
+    'cache_directory',
+    'animation',
+    'use_incremental',
+    'use_profiling',
+    'profile_path',
+    'frame_budget',
+    'show_preview',
+    'preview_scale',
+}
+
+
+def render_key(context, props) -> str:
+    """
+    Computes stable hash of everything which affects rendered image
+    :returns hex digest
+    """
+    hasher = hashlib.sha1()
+
+    hasher.update(repr(property_values(props)).encode())
+
+    # objects can move, so projected positions are part of the key
+    for position in props.positions:
+        hasher.update(repr(tuple(position.screen_position(context.scene))).encode())
+
+    hasher.update(spectrum_hash(props.spectrum_image).encode())
+
+    return hasher.hexdigest()
+
+
+def position_signatures(context, props) -> List[str]:
+    """
+    Computes hash of everything which affects rendered layer of every position
+    :returns hex digest for every position
+    """
+    shared = hashlib.sha1()
+
+    shared.update(repr([value for value in property_values(props) if value[0] != 'positions']).encode())
+    shared.update(spectrum_hash(props.spectrum_image).encode())
+
+    signatures = []
+    for position in props.positions:
+        hasher = shared.copy()
+        hasher.update(repr(property_values(position)).encode())
+        hasher.update(repr(tuple(position.screen_position(context.scene))).encode())
+        signatures.append(hasher.hexdigest())
+
+    return signatures
+
+
+def property_values(group) -> list:
+    """
+    Walks all properties of property group, nested groups and collections included
+    :returns list of name and value pairs
+    """
+    values = []
+
+    for prop in group.bl_rna.properties:
+        name = prop.identifier
+        if name in IGNORED_PROPERTIES:
+            continue
+
+        value = getattr(group, name)
+
+        if prop.type == 'POINTER':
+            if isinstance(value, bpy.types.ID):
+                value = value.name_full
+            elif value is not None:
+                value = property_values(value)
+        elif prop.type == 'COLLECTION':
+            value = [property_values(item) for item in value]
+        elif getattr(prop, 'is_array', False):
+            value = tuple(value)
+
+        values.append((name, value))
+
+    return values
+
+
+def spectrum_hash(image) -> str:
+    """
+    :returns hash of baked spectrum, it changes when image is edited
+    """
+    if image is None:
+        return ''
+
+    return table_hash(image)
+
+
+def disk_key(key: str) -> str:
+    """
+    :returns key of file on disk, files rendered by other add-on version or with other shaders are not used
+    """
+    from . import bl_info
+
+    version = '.'.join(str(part) for part in bl_info['version'])
+    return hashlib.sha1(f"{key}|{version}|{shaders.sources_hash()}".encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Content addressed cache of rendered buffers.
+    Recently used buffers are kept in memory, optionally all buffers are also stored on disk.
+    """
+    __entries = OrderedDict()
+    __budget = 256 * 1024 * 1024
+    __directory = ''
+    __stats = {
+        "hits": 0,
+        "misses": 0,
+    }
+
+    @classmethod
+    def configure(cls, megabytes: int, directory: str):
+        cls.__budget = megabytes * 1024 * 1024
+        cls.__directory = bpy.path.abspath(directory) if directory else ''
+        cls.__evict()
+
+    @classmethod
+    def get(cls, key: str) -> Optional[numpy.ndarray]:
+        """
+        :returns cached buffer or None, buffer must not be modified
+        """
+        if key in cls.__entries:
+            cls.__entries.move_to_end(key)
+            cls.__stats["hits"] += 1
+            return cls.__entries[key]
+
+        path = cls.__path(key)
+        if path is not None and os.path.isfile(path):
+            try:
+                buffer = numpy.load(path)
+            except (OSError, ValueError, EOFError):
+                # truncated or corrupted file is a miss, it is written again after render
+                buffer = None
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+            if buffer is not None:
+                cls.__store(key, buffer)
+                cls.__stats["hits"] += 1
+                return buffer
+
+        cls.__stats["misses"] += 1
+        return None
+
+    @classmethod
+    def put(cls, key: str, buffer: numpy.ndarray):
+        """
+        Stores copy of buffer, half float buffers stay half float
+        """
+        buffer = numpy.array(buffer)
+        cls.__store(key, buffer)
+
+        path = cls.__path(key)
+        if path is not None:
+            os.makedirs(cls.__directory, exist_ok=True)
+            numpy.save(path, buffer)
+
+    @classmethod
+    def stats(cls) -> dict:
+        """
+        :returns hit and miss counts and memory usage in bytes
+        """
+        stats = dict(cls.__stats)
+        stats["memory"] = sum(buffer.nbytes for buffer in cls.__entries.values())
+        return stats
+
+    @classmethod
+    def clear(cls):
+        """
+        Drops in-memory tier, files on disk are kept
+        """
+        cls.__entries.clear()
+
+    @classmethod
+    def __store(cls, key: str, buffer: numpy.ndarray):
+        buffer.setflags(write=False)
+        cls.__entries[key] = buffer
+        cls.__entries.move_to_end(key)
+        cls.__evict()
+
+    @classmethod
+    def __path(cls, key: str) -> Optional[str]:
+        if not cls.__directory:
+            return None
+        return os.path.join(cls.__directory, f"{disk_key(key)}.npy")
+
+    @classmethod
+    def __evict(cls):
+        memory = sum(buffer.nbytes for buffer in cls.__entries.values())
+        while memory > cls.__budget and len(cls.__entries) > 0:
+            _, buffer = cls.__entries.popitem(last=False)
+            memory -= buffer.nbytes
@@ -0,0 +1,128 @@
+import os
+import tempfile
+from typing import List
+
+import bpy
+import numpy
+from bpy.app.handlers import persistent
+
+
+def refresh_image_users(scene, image):
+    """
+    Reloads image buffer and runs update of compositor image nodes using it, so compositor shows new pixels.
+    Node update tags whole node tree, so compositor executes all nodes again, Python API can't tag single nodes.
+    """
+    image.update()
+
+    tree = scene.node_tree
+    if tree is None or not scene.use_nodes:
+        return
+
+    for node in image_nodes(tree, image):
+        # assigning the same image runs update of node
+        node.image = image
+
+
+def image_nodes(tree, image) -> List[bpy.types.Node]:
+    """
+    :returns image nodes of tree and its node groups using given image
+    """
+    nodes = []
+
+    for node in tree.nodes:
+        if node.type == 'IMAGE' and node.image == image:
+            nodes.append(node)
+        elif node.type == 'GROUP' and node.node_tree is not None:
+            nodes.extend(image_nodes(node.node_tree, image))
+
+    return nodes
+
+
+class DirectComposite:
+    """
+    Adds effect to rendered scene without compositor.
+    Render Result pixels are not accessible from Python, so rendered image is saved to temporary file,
+    effect is added to its pixels and result is written to output path.
+    """
+    # output path and effect pixels waiting for next render
+    __target = None
+    __errors = []
+
+    @classmethod
+    def register(cls):
+        if cls.handler not in bpy.app.handlers.render_post:
+            bpy.app.handlers.render_post.append(cls.handler)
+
+    @classmethod
+    def unregister(cls):
+        if cls.handler in bpy.app.handlers.render_post:
+            bpy.app.handlers.render_post.remove(cls.handler)
+        cls.__target = None
+
+    @classmethod
+    def queue(cls, path: str, buffer: numpy.ndarray, width: int, height: int):
+        """
+        Sets effect, which is added to result of next render
+        :param buffer RGBA effect pixels, same layout as Image.pixels
+        """
+        cls.__target = (path, buffer, width, height)
+
+    @classmethod
+    def take_errors(cls) -> List[str]:
+        errors = list(cls.__errors)
+        cls.__errors.clear()
+        return errors
+
+    @staticmethod
+    @persistent
+    def handler(scene, *args):
+        target = DirectComposite.__target
+        DirectComposite.__target = None
+        if target is None:
+            return
+
+        path, buffer, width, height = target
+        result = bpy.data.images.get('Render Result')
+        if result is None:
+            DirectComposite.__errors.append(f"No render result for {path}")
+            return
+
+        with tempfile.TemporaryDirectory() as directory:
+            temp_path = os.path.join(directory, 'render.exr')
+            save_linear(result, scene, temp_path)
+
+            image = bpy.data.images.load(temp_path)
+            try:
+                if tuple(image.size) != (width, height):
+                    DirectComposite.__errors.append(
+                        f"Render resolution {tuple(image.size)} differs from effect resolution {(width, height)}")
+                    return
+
+                pixels = numpy.empty(width * height * 4, dtype=numpy.float32)
+                image.pixels.foreach_get(pixels)
+                # alpha of render is kept
+                pixels = pixels.reshape((-1, 4))
+                pixels[:, :3] += numpy.asarray(buffer, dtype=numpy.float32).reshape((-1, 4))[:, :3]
+                image.pixels.foreach_set(pixels.reshape(-1))
+
+                # color management and file format of scene are applied like on normal render
+                image.save_render(path, scene=scene)
+            finally:
+                bpy.data.images.remove(image)
+
+
+def save_linear(image, scene, path: str):
+    """
+    Saves image to float OpenEXR file without view transform, output settings of scene are restored
+    """
+    settings = scene.render.image_settings
+    file_format = settings.file_format
+    color_depth = settings.color_depth
+
+    settings.file_format = 'OPEN_EXR'
+    settings.color_depth = '32'
+    try:
+        image.save_render(path, scene=scene)
+    finally:
+        settings.file_format = file_format
+        settings.color_depth = color_depth
@@ -0,0 +1,543 @@
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Generator, List, NamedTuple, Tuple
+
+import numpy
+
+from .geometry import ghost_copy_bounds, ghost_position, ghost_sample_count
+from .jobs import Progress, run_steps
+from .noise import generate_noise
+from .spectrum import sample_weights, spectrum_table, table_mean
+
+# same constants as in common.shader
+E = 2.71828
+PI = 3.14159
+
+
+class GhostParams(NamedTuple):
+    # ghost center in normalized device coordinates
+    x: float
+    y: float
+    scale: float
+    ratio: float
+    color: Tuple[float, float, float]
+    center_transparency: float
+    intensity: float
+    dispersion: float
+    distortion: float
+    disperse_from_ghost: bool
+    # number of dispersion samples, one sample uses mean spectrum color
+    samples: int
+    # pixel rectangle which can be affected by ghost
+    bounds: Tuple[int, int, int, int]
+
+
+class PositionParams(NamedTuple):
+    # effect position in normalized image coordinates
+    x: float
+    y: float
+    ghosts: List[GhostParams]
+
+
+class FlareParams(NamedTuple):
+    """
+    Plain copy of everything needed for rendering, so renderer doesn't need to touch Blender data
+    """
+    width: int
+    height: int
+    ghost_blades: int
+    flare_blades: int
+    rotation: float
+    master_intensity: float
+    flare_color: Tuple[float, float, float]
+    flare_size: float
+    flare_intensity: float
+    rays_intensity: float
+    anamorphic: bool
+    use_jitter: bool
+    noise: numpy.ndarray
+    # spectrum weights of dispersion samples for every used sample count
+    spectral_weights: Dict[int, numpy.ndarray]
+    spectral_mean: Tuple[float, float, float]
+    positions: List[PositionParams]
+
+
+class _Vec2(NamedTuple):
+    x: float
+    y: float
+
+
+def render_lens_flare(context, props) -> (numpy.ndarray, int):
+    """
+    Renders lens flare effect to buffer on CPU
+    :returns buffer with effect and number of rendered tiles
+    """
+    return run_steps(render_lens_flare_steps(context, props))
+
+
+def render_lens_flare_steps(context, props) -> Generator[Progress, None, Tuple[numpy.ndarray, int]]:
+    """
+    Same as `render_lens_flare`, but yields after every finished tile
+    """
+    params = collect_params(props, screen_positions(context, props), spectrum_table(props.spectrum_image))
+    buffer = yield from render_steps(params, props.cpu_tile_size, props.cpu_workers, props.cpu_pool == 'process')
+
+    return buffer, len(tiles(params.width, params.height, props.cpu_tile_size))
+
+
+def render_debug_cross(context, props) -> (numpy.ndarray, int):
+    """
+    Renders debug cross on CPU
+    :returns buffer with image and number of rendered tiles
+    """
+    width = props.resolution.resolution_x
+    height = props.resolution.resolution_y
+    tile_list = tiles(width, height, props.cpu_tile_size)
+
+    positions = screen_positions(context, props)
+
+    image = numpy.zeros((height, width, 4), dtype=numpy.float32)
+    image[..., 3] = 1.0
+
+    for tile_x, tile_y, tile_w, tile_h in tile_list:
+        u, v = _uv_grid(width, height, tile_x, tile_y, tile_w, tile_h)
+        color = image[tile_y:tile_y + tile_h, tile_x:tile_x + tile_w, :3]
+
+        for pos_x, pos_y in positions:
+            cross_x = numpy.maximum(1.0 - numpy.abs((u - pos_x) * (width / height) * 80.0), 0.0)
+            cross_y = numpy.maximum(1.0 - numpy.abs((v - pos_y) * 80.0), 0.0)
+            cross = numpy.stack((cross_y, cross_x, numpy.zeros_like(u)), axis=-1)
+            color[...] = _blend(color, cross, 1.0)
+
+    return image.ravel(), len(tile_list)
+
+
+def screen_positions(context, props) -> List[Tuple[float, float]]:
+    """
+    :returns effect positions in normalized image coordinates
+    """
+    return [tuple(position.screen_position(context.scene).xy) for position in props.positions]
+
+
+def collect_params(props, flare_positions, table: numpy.ndarray) -> FlareParams:
+    """
+    Copies render settings out of properties
+    :param props MasterProperties or any object with the same attributes
+    :param flare_positions effect positions in normalized image coordinates
+    :param table spectrum baked by `spectrum.bake_table`
+    """
+    width = props.resolution.resolution_x
+    height = props.resolution.resolution_y
+    aspect_ratio = width / height
+
+    positions = []
+
+    for pos_x, pos_y in flare_positions:
+        flare_position = _Vec2(pos_x, pos_y)
+        flare_vector = _normalized(pos_x - 0.5, pos_y - 0.5)
+
+        ghosts = []
+
+        for ghost in props.ghosts:
+            if ghost.size <= 0.0:
+                continue
+
+            ghost_x, ghost_y = ghost_position(ghost, flare_position, flare_vector)
+            bounds = ghost_copy_bounds(ghost, ghost_x, ghost_y, aspect_ratio, width, height)
+            if bounds[2] == 0 or bounds[3] == 0:
+                continue
+
+            ghosts.append(GhostParams(
+                x=ghost_x,
+                y=ghost_y,
+                scale=ghost.size / 100,
+                ratio=ghost.ratio,
+                color=tuple(ghost.color[0:3]),
+                center_transparency=ghost.center_transparency,
+                intensity=ghost.intensity,
+                dispersion=ghost.dispersion,
+                distortion=ghost.distortion,
+                disperse_from_ghost=ghost.dispersion_center == 'ghost',
+                samples=ghost_sample_count(props, ghost, ghost_x, ghost_y),
+                bounds=bounds,
+            ))
+
+        positions.append(PositionParams(pos_x, pos_y, ghosts))
+
+    sample_counts = {ghost.samples for position in positions for ghost in position.ghosts}
+
+    blades = props.camera.blades
+
+    return FlareParams(
+        width=width,
+        height=height,
+        # render kinda circles
+        ghost_blades=blades if blades != 0 else 256,
+        flare_blades=blades if blades != 0 else 64,
+        rotation=props.camera.rotation,
+        master_intensity=props.master_intensity,
+        flare_color=tuple(props.flare.color[0:3]),
+        flare_size=props.flare.size,
+        flare_intensity=props.flare.intensity,
+        rays_intensity=props.flare.rays_intensity,
+        anamorphic=props.flare.anamorphic,
+        use_jitter=props.use_jitter,
+        noise=generate_noise(int(props.noise_resolution), props.noise_seed, props.noise_type),
+        spectral_weights={samples: sample_weights(table, samples) for samples in sample_counts},
+        spectral_mean=table_mean(table),
+        positions=positions,
+    )
+
+
+def tiles(width: int, height: int, tile_size: int) -> List[Tuple[int, int, int, int]]:
+    """
+    Splits image to tiles
+    :returns list of x, y, width and height of tiles
+    """
+    return [
+        (x, y, min(tile_size, width - x), min(tile_size, height - y))
+        for y in range(0, height, tile_size)
+        for x in range(0, width, tile_size)
+    ]
+
+
+def render(params: FlareParams, tile_size: int = 256, workers: int = 1, use_processes: bool = False) -> numpy.ndarray:
+    """
+    Renders whole image tile by tile, so memory usage depends only on tile size.
+    Tiles don't depend on worker count, so result is identical for any number of workers.
+    :param workers number of parallel workers, 0 uses all CPU cores
+    :param use_processes render in forked processes instead of threads
+    :returns flat float32 RGBA buffer with rows from bottom to top, same as GPU readback
+    """
+    return run_steps(render_steps(params, tile_size, workers, use_processes))
+
+
+def render_steps(params: FlareParams, tile_size: int = 256, workers: int = 1, use_processes: bool = False) \
+        -> Generator[Progress, None, numpy.ndarray]:
+    """
+    Same as `render`, but yields after every finished tile, closing the generator cancels tiles not yet started
+    """
+    image = numpy.empty((params.height, params.width, 4), dtype=numpy.float32)
+    tile_list = tiles(params.width, params.height, tile_size)
+
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(tile_list))
+
+    if workers <= 1:
+        for index, tile in enumerate(tile_list):
+            _copy_tile(image, tile, render_tile(params, *tile))
+            yield index + 1, len(tile_list)
+    else:
+        executor = _create_executor(params, workers, use_processes)
+        futures = [executor.submit(_render_worker_tile, tile) for tile in tile_list]
+        try:
+            for index, (tile, future) in enumerate(zip(tile_list, futures)):
+                _copy_tile(image, tile, future.result())
+                yield index + 1, len(tile_list)
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown()
+
+    return image.ravel()
+
+
+def _copy_tile(image, tile, result):
+    tile_x, tile_y, tile_w, tile_h = tile
+    image[tile_y:tile_y + tile_h, tile_x:tile_x + tile_w] = result
+
+
+# parameters shared by all tiles rendered in worker
+_worker_params = None
+
+
+def _init_worker(params: FlareParams):
+    global _worker_params
+    _worker_params = params
+
+
+def _render_worker_tile(tile) -> numpy.ndarray:
+    return render_tile(_worker_params, *tile)
+
+
+def _create_executor(params: FlareParams, workers: int, use_processes: bool):
+    """
+    Creates worker pool, parameters are handed to every worker only once
+    """
+    # spawned processes would have to import Blender add-on again, so only forking is supported
+    if use_processes and 'fork' in multiprocessing.get_all_start_methods():
+        return ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context('fork'),
+            initializer=_init_worker,
+            initargs=(params,),
+        )
+
+    # NumPy releases GIL in array operations, so threads render in parallel too
+    _init_worker(params)
+    return ThreadPoolExecutor(workers)
+
+
+def render_tile(params: FlareParams, tile_x: int, tile_y: int, tile_w: int, tile_h: int) -> numpy.ndarray:
+    """
+    Renders one tile of image, every pixel is computed independently, so result doesn't depend on tiling
+    :returns float32 RGBA array with shape (tile_h, tile_w, 4)
+    """
+    u, v = _uv_grid(params.width, params.height, tile_x, tile_y, tile_w, tile_h)
+
+    noise_size = params.noise.shape[0]
+    pixel_noise = sample_texture(params.noise, u * (params.width / noise_size), v * (params.height / noise_size))
+
+    color = numpy.zeros((tile_h, tile_w, 3))
+
+    with numpy.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        for position in params.positions:
+            # ghosts first
+            for ghost in position.ghosts:
+                rect = _intersect_rect(ghost.bounds, (tile_x, tile_y, tile_w, tile_h))
+                if rect is None:
+                    continue
+
+                rows = slice(rect[1] - tile_y, rect[1] - tile_y + rect[3])
+                cols = slice(rect[0] - tile_x, rect[0] - tile_x + rect[2])
+
+                ghost_color = copy_ghost(params, ghost, u[rows, cols], v[rows, cols], pixel_noise[rows, cols])
+                color[rows, cols] = _blend(color[rows, cols], ghost_color, 1.0)
+
+            # finally flare on top
+            flare_color, flare_alpha = render_flare(params, position, u, v, pixel_noise)
+            color = _blend(color, flare_color, flare_alpha)
+
+    rgba = numpy.ones((tile_h, tile_w, 4), dtype=numpy.float32)
+    rgba[..., :3] = color
+
+    return rgba
+
+
+def render_flare(params: FlareParams, position: PositionParams, u, v, pixel_noise) -> (numpy.ndarray, numpy.ndarray):
+    """
+    Vectorized flare.frag
+    :returns color and alpha of flare
+    """
+    blades = params.flare_blades
+    size = params.flare_size
+
+    flare_base_x = (u - position.x) * (params.width / params.height)
+    flare_base_y = v - position.y
+
+    dist = numpy.hypot(flare_base_x, flare_base_y)
+    angle = numpy.arctan2(flare_base_y, flare_base_x)
+
+    # normalize
+    angle = angle + PI / 2.0
+    angle = (angle + params.rotation) / (2.0 * PI)
+
+    rad_noise = _radial_noise(params.noise, dist, angle)
+
+    noise_ring_extrusion = _mix(numpy.cos(angle * 2.0 * PI * blades + PI), 1.0, 0.95)
+
+    blade_count_to_ray_intensity = min(max((-blades + 18.0) / 12.0, 0.0), 1.0)
+
+    noise_ring_intensity = gauss(dist * noise_ring_extrusion / (size / 10.0), 0.21, 0.01)
+    noise_ring = rad_noise * noise_ring_intensity
+
+    if params.anamorphic:
+        anam_ring = noise_ring * 0.2
+        anam_flare = ((gauss(dist, 0.0, size / 200.0) + anam_ring) + gauss(dist, 0.0, size / 2000.0)) * params.flare_intensity
+
+        ray_distort = 1.0 - anam_flare * 0.2
+        ray_fade = numpy.maximum(1.0 - numpy.abs(0.4 * flare_base_x), 0.0)
+
+        anam_ray_base = flare_base_y * ray_distort / ray_fade
+        anam_ray = numpy.clip(1.0 - 80.0 * (numpy.abs(anam_ray_base) - 0.01), 0.0, 1.0) * params.rays_intensity
+
+        value = numpy.maximum(anam_flare + anam_ray, anam_ray) * gauss(flare_base_x, 0.0, 0.5)
+    else:
+        flare = gauss(dist, 0.0, size / 100.0)
+
+        rays_value = _mix(noise_ring, _rays(dist, angle, blades) * rad_noise, blade_count_to_ray_intensity)
+
+        ray_center = 2.0 * gauss(dist, 0.0, 0.02)
+
+        value = (flare * params.flare_intensity) + ((rays_value + ray_center) * params.rays_intensity)
+
+    value = numpy.nan_to_num(value)
+    dither = pixel_noise / 255.0
+
+    color = value[..., numpy.newaxis] * numpy.array(params.flare_color) * params.master_intensity + dither[..., numpy.newaxis]
+    # same as flare.frag, where alpha of flare color is 1.0
+    alpha = params.master_intensity + dither
+
+    return color, alpha
+
+
+def copy_ghost(params: FlareParams, ghost: GhostParams, u, v, pixel_noise) -> numpy.ndarray:
+    """
+    Vectorized dispersion_copy.frag, ghost is evaluated analytically instead of sampling ghost framebuffer
+    :returns color of dispersed ghost
+    """
+    moved_u = u - 0.5
+    moved_v = v - 0.5
+    moved_length = moved_u ** 2 + moved_v ** 2
+
+    distorted_u = u + moved_length * moved_u * -ghost.distortion
+    distorted_v = v + moved_length * moved_v * -ghost.distortion
+
+    if ghost.disperse_from_ghost:
+        center_u, center_v = ghost.x / 2.0 + 0.5, ghost.y / 2.0 + 0.5
+    else:
+        center_u, center_v = 0.5, 0.5
+
+    if ghost.samples == 1 and ghost.dispersion == 0.0:
+        # dispersion is not visible, so all samples would fetch the same value
+        color = ghost_value(params, ghost, distorted_u, distorted_v) * numpy.array(params.spectral_mean)
+        return color * ghost.intensity * params.master_intensity
+
+    jitter = pixel_noise * float(params.use_jitter)
+    weights = params.spectral_weights[ghost.samples]
+
+    color = numpy.zeros(u.shape + (3,))
+
+    for i in range(ghost.samples):
+        x = (i + jitter) / ghost.samples
+
+        sample_dispersion = (x - 0.5) * 2.0 * ghost.dispersion + 1.0
+        sample_u = (distorted_u - center_u) * sample_dispersion + center_u
+        sample_v = (distorted_v - center_v) * sample_dispersion + center_v
+
+        # weight is average spectrum color of sample interval divided by sample count
+        color += ghost_value(params, ghost, sample_u, sample_v) * weights[i]
+
+    return color * ghost.intensity * params.master_intensity
+
+
+def ghost_value(params: FlareParams, ghost: GhostParams, u, v) -> numpy.ndarray:
+    """
+    Vectorized ghost.vert and ghost.frag, computes value of ghost framebuffer at given positions
+    :returns ghost color
+    """
+    inside_image = (u >= 0.0) & (u <= 1.0) & (v >= 0.0) & (v <= 1.0)
+
+    # inverse of ghost.vert transformation
+    local_x = (u * 2.0 - 1.0 - ghost.x) / ghost.scale * ghost.ratio
+    local_y = (v * 2.0 - 1.0 - ghost.y) / ghost.scale / (params.width / params.height)
+
+    cos_rot = math.cos(params.rotation)
+    sin_rot = math.sin(params.rotation)
+    pos_x = cos_rot * local_x - sin_rot * local_y
+    pos_y = sin_rot * local_x + cos_rot * local_y
+
+    # interpolated vertex color of triangle fan is distance to polygon edge
+    center = numpy.hypot(pos_x, pos_y)
+    angle = numpy.arctan2(pos_y, pos_x)
+    sector = 2.0 * PI / params.ghost_blades
+    sector_center = (numpy.floor(angle / sector) + 0.5) * sector
+    edge_distance = center * numpy.cos(angle - sector_center) / math.cos(sector / 2.0)
+
+    empty = ghost.center_transparency
+    if empty < 1.0:
+        edge = 1.0 - edge_distance ** 40.0 - gauss(center, 0.0, 0.3) * empty
+    else:
+        edge = 1.0 - edge_distance ** 40.0 - gauss(center ** empty, 0.0, 0.3)
+
+    edge = numpy.where(inside_image & (edge_distance < 1.0), numpy.clip(edge, 0.0, 1.0), 0.0)
+
+    return edge[..., numpy.newaxis] * numpy.clip(ghost.color, 0.0, 1.0)
+
+
+def sample_texture(texture: numpy.ndarray, s, t) -> numpy.ndarray:
+    """
+    Bilinear texture lookup with repeat wrapping, same as GPU texture fetch
+    :param texture array with shape (height, width) or (height, width, channels)
+    """
+    height, width = texture.shape[:2]
+
+    x = numpy.asarray(s) * width - 0.5
+    y = numpy.asarray(t) * height - 0.5
+    x_floor = numpy.floor(x)
+    y_floor = numpy.floor(y)
+    fract_x = x - x_floor
+    fract_y = y - y_floor
+
+    x0 = x_floor.astype(numpy.int64) % width
+    y0 = y_floor.astype(numpy.int64) % height
+    x1 = (x0 + 1) % width
+    y1 = (y0 + 1) % height
+
+    if texture.ndim == 3:
+        fract_x = fract_x[..., numpy.newaxis]
+        fract_y = fract_y[..., numpy.newaxis]
+
+    bottom = texture[y0, x0] * (1.0 - fract_x) + texture[y0, x1] * fract_x
+    top = texture[y1, x0] * (1.0 - fract_x) + texture[y1, x1] * fract_x
+
+    return bottom * (1.0 - fract_y) + top * fract_y
+
+
+def gauss(x, center, std_dev):
+    return numpy.power(E, -((x - center) ** 2 / std_dev))
+
+
+def _rays(distance, norm_angle, blades):
+    angle = norm_angle * 2.0 * PI * blades + PI
+    distance_limit = numpy.maximum(1.0 - distance, 0.0)
+
+    return numpy.maximum(numpy.cos(angle), 0.0) ** 8.0 * distance_limit
+
+
+def _radial_noise(noise, dist, angle):
+    rot = 0.1
+
+    # row vector multiplied by matrix with columns (-cos, sin) and (-sin, cos)
+    s = (dist * 0.001 * -math.cos(rot) + angle * math.sin(rot)) * 5.0
+    t = (dist * 0.001 * -math.sin(rot) + angle * math.cos(rot)) * 5.0
+
+    return sample_texture(noise, s, t)
+
+
+def _mix(x, y, a):
+    return x * (1.0 - a) + y * a
+
+
+def _blend(destination, source, alpha):
+    """
+    Additive blending with source alpha into 8 bit framebuffer
+    """
+    alpha = numpy.clip(numpy.nan_to_num(alpha), 0.0, 1.0)
+    if numpy.ndim(alpha) > 0:
+        alpha = alpha[..., numpy.newaxis]
+
+    return numpy.clip(destination + numpy.clip(numpy.nan_to_num(source), 0.0, 1.0) * alpha, 0.0, 1.0)
+
+
+def _uv_grid(width, height, tile_x, tile_y, tile_w, tile_h):
+    """
+    :returns UV coordinates of pixel centers in tile
+    """
+    u = (numpy.arange(tile_x, tile_x + tile_w) + 0.5) / width
+    v = (numpy.arange(tile_y, tile_y + tile_h) + 0.5) / height
+
+    return numpy.meshgrid(u, v)
+
+
+def _intersect_rect(first, second):
+    min_x = max(first[0], second[0])
+    min_y = max(first[1], second[1])
+    max_x = min(first[0] + first[2], second[0] + second[2])
+    max_y = min(first[1] + first[3], second[1] + second[3])
+
+    if max_x <= min_x or max_y <= min_y:
+        return None
+
+    return min_x, min_y, max_x - min_x, max_y - min_y
+
+
+def _normalized(x, y) -> _Vec2:
+    length = math.hypot(x, y)
+    if length == 0.0:
+        return _Vec2(0.0, 0.0)
+
+    return _Vec2(x / length, y / length)
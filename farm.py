@@ -0,0 +1,174 @@
+import re
+import subprocess
+import threading
+import time
+from collections import deque
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+# line printed by animation operator after every finished frame
+FRAME_FINISHED_PATTERN = re.compile(r"^Lens flare frame (-?\d+) finished")
+
+
+class FrameChunk(NamedTuple):
+    start: int
+    end: int
+    attempt: int
+
+
+class _Worker:
+    """
+    One background Blender process rendering one chunk
+    """
+    def __init__(self, chunk: FrameChunk, command: List[str]):
+        self.chunk = chunk
+        self.finished_frames = set()
+        self.output = deque(maxlen=20)
+        self.process = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True,
+        )
+        self.__reader = threading.Thread(target=self.__read_output, daemon=True)
+        self.__reader.start()
+
+    def __read_output(self):
+        for line in self.process.stdout:
+            self.output.append(line.rstrip())
+            match = FRAME_FINISHED_PATTERN.match(line)
+            if match is not None:
+                self.finished_frames.add(int(match.group(1)))
+
+    def poll(self) -> Optional[int]:
+        """
+        :returns exit code or None if worker is still running
+        """
+        code = self.process.poll()
+        if code is not None:
+            # make sure all output was processed
+            self.__reader.join()
+        return code
+
+    def kill(self):
+        self.process.kill()
+        self.process.wait()
+
+
+class FrameScheduler:
+    """
+    Splits frame range to chunks and renders them in background Blender processes.
+    Failed chunks are retried, chunks failing repeatedly are reported as failures.
+    """
+    def __init__(self, blender: str, blend_file: str, module: str, frames: range, chunk_size: int,
+                 max_workers: int, retries: int):
+        """
+        :param blender path to Blender executable
+        :param blend_file saved scene to render
+        :param module name of this add-on, it is enabled in workers
+        """
+        self.blender = blender
+        self.blend_file = blend_file
+        self.module = module
+        self.step = frames.step
+        self.max_workers = max(max_workers, 1)
+        self.retries = retries
+
+        self.total_frames = len(frames)
+        self.finished_frames = set()
+        self.failures = []
+
+        self.__queue = deque()
+        self.__workers = []
+
+        frame_list = list(frames)
+        for index in range(0, len(frame_list), max(chunk_size, 1)):
+            chunk_frames = frame_list[index:index + chunk_size]
+            self.__queue.append(FrameChunk(chunk_frames[0], chunk_frames[-1], 0))
+
+    def command(self, chunk: FrameChunk) -> List[str]:
+        """
+        :returns command line of worker rendering given chunk
+        """
+        # background Blender has no GL context, so GPU backend can't be used
+        script = (
+            "import bpy, addon_utils; "
+            f"addon_utils.enable({self.module!r}, default_set=False); "
+            "bpy.context.scene.lens_flare_props.backend = 'cpu'; "
+            f"bpy.ops.render.lens_flare_anim(frame_start={chunk.start}, frame_end={chunk.end})"
+        )
+        return [self.blender, '-b', self.blend_file, '--python-exit-code', '1', '--python-expr', script]
+
+    def update(self) -> bool:
+        """
+        Checks running workers and starts new ones
+        :returns True when all chunks are done
+        """
+        for worker in list(self.__workers):
+            code = worker.poll()
+            if code is None:
+                continue
+
+            self.__workers.remove(worker)
+            self.finished_frames.update(worker.finished_frames)
+
+            chunk = worker.chunk
+            expected = set(range(chunk.start, chunk.end + 1, self.step))
+            if code == 0 and expected <= worker.finished_frames:
+                continue
+
+            if chunk.attempt < self.retries:
+                # render only frames which are still missing, finished frames between them are skipped
+                missing = sorted(expected - worker.finished_frames) or sorted(expected)
+                for start, end in self.runs(missing):
+                    self.__queue.append(FrameChunk(start, end, chunk.attempt + 1))
+            else:
+                self.failures.append((chunk, code, list(worker.output)))
+
+        while self.__queue and len(self.__workers) < self.max_workers:
+            chunk = self.__queue.popleft()
+            self.__workers.append(_Worker(chunk, self.command(chunk)))
+
+        return len(self.__queue) == 0 and len(self.__workers) == 0
+
+    def runs(self, frames: List[int]) -> List[Tuple[int, int]]:
+        """
+        Splits sorted frames to runs of consecutive frames
+        :returns first and last frame of every run
+        """
+        runs = []
+        for frame in frames:
+            if runs and frame == runs[-1][1] + self.step:
+                runs[-1] = (runs[-1][0], frame)
+            else:
+                runs.append((frame, frame))
+        return runs
+
+    def progress(self) -> float:
+        """
+        :returns fraction of finished frames, running workers included
+        """
+        finished = set(self.finished_frames)
+        for worker in self.__workers:
+            finished.update(worker.finished_frames)
+
+        if self.total_frames == 0:
+            return 1.0
+        return len(finished) / self.total_frames
+
+    def run(self, on_progress: Callable[[float], None] = None, interval: float = 0.5):
+        """
+        Blocks until all chunks are rendered or failed
+        """
+        while not self.update():
+            if on_progress is not None:
+                on_progress(self.progress())
+            time.sleep(interval)
+
+        if on_progress is not None:
+            on_progress(self.progress())
+
+    def cancel(self):
+        for worker in self.__workers:
+            worker.kill()
+        self.__workers.clear()
+        self.__queue.clear()
@@ -0,0 +1,229 @@
+import math
+
+# pixels added around ghost bounds, covers rasterization and linear texture filtering
+BOUNDS_MARGIN = 2
+
+_EMPTY = (1.0, 1.0, 0.0, 0.0)
+
+
+def ghost_position(ghost, flare_position, flare_vector) -> (float, float):
+    """
+    Computes ghost center in normalized device coordinates
+    """
+    ghost_x = ((flare_position.x - 0.5) * 2.0) * ghost.offset
+    ghost_y = ((flare_position.y - 0.5) * 2.0) * ghost.offset
+    # add perpendicular offset
+    ghost_x += flare_vector.y * ghost.perpendicular_offset
+    ghost_y += -flare_vector.x * ghost.perpendicular_offset
+
+    return ghost_x, ghost_y
+
+
+def ghost_bounds(ghost_x, ghost_y, scale, ratio, aspect_ratio) -> (float, float, float, float):
+    """
+    Computes bounding box of ghost polygon in UV coordinates
+    :returns min x, min y, max x, max y
+    """
+    # polygon is inscribed in unit circle, so any rotation fits into scaled unit square
+    half_x = scale / ratio / 2.0
+    half_y = scale * aspect_ratio / 2.0
+    center_x = ghost_x / 2.0 + 0.5
+    center_y = ghost_y / 2.0 + 0.5
+
+    return center_x - half_x, center_y - half_y, center_x + half_x, center_y + half_y
+
+
+def ghost_copy_bounds(ghost, ghost_x, ghost_y, aspect_ratio, width, height) -> (int, int, int, int):
+    """
+    Computes conservative pixel rectangle, which can be affected by dispersion copy of ghost.
+    Pixels outside of this rectangle would only sample empty parts of ghost framebuffer.
+    :returns x, y, width and height of rectangle in pixels
+    """
+    bounds = ghost_bounds(ghost_x, ghost_y, ghost.size / 100, ghost.ratio, aspect_ratio)
+    margin_x = BOUNDS_MARGIN / width
+    margin_y = BOUNDS_MARGIN / height
+    bounds = (bounds[0] - margin_x, bounds[1] - margin_y, bounds[2] + margin_x, bounds[3] + margin_y)
+
+    # clamp to border returns black, so only visible part of ghost matters
+    bounds = _intersect(bounds, (0.0, 0.0, 1.0, 1.0))
+    if bounds is None:
+        return 0, 0, 0, 0
+
+    bounds = _undisperse_bounds(bounds, ghost, ghost_x, ghost_y)
+    if bounds is not None:
+        bounds = _undistort_bounds(bounds, ghost.distortion)
+    if bounds is None:
+        bounds = (0.0, 0.0, 1.0, 1.0)
+
+    bounds = _intersect(bounds, (0.0, 0.0, 1.0, 1.0))
+    if bounds is None:
+        return 0, 0, 0, 0
+
+    min_x = max(math.floor(bounds[0] * width), 0)
+    min_y = max(math.floor(bounds[1] * height), 0)
+    max_x = min(math.ceil(bounds[2] * width), width)
+    max_y = min(math.ceil(bounds[3] * height), height)
+
+    return min_x, min_y, max(max_x - min_x, 0), max(max_y - min_y, 0)
+
+
+def ghost_sample_count(props, ghost, ghost_x, ghost_y, width: int = None, height: int = None,
+                       max_samples: int = None) -> int:
+    """
+    :param props MasterProperties or any object with the same attributes
+    :param width width of ghost buffer, output resolution is used by default
+    :param height height of ghost buffer, output resolution is used by default
+    :param max_samples quality ceiling, dispersion samples setting is used by default
+    :returns dispersion sample count of ghost for current quality settings
+    """
+    samples = props.dispersion_samples if max_samples is None else max_samples
+    if not props.use_adaptive_samples:
+        return samples
+
+    width = props.resolution.resolution_x if width is None else width
+    height = props.resolution.resolution_y if height is None else height
+
+    return dispersion_sample_count(ghost, ghost_x, ghost_y, width / height, width, height, samples)
+
+
+def dispersion_sample_count(ghost, ghost_x, ghost_y, aspect_ratio, width, height, max_samples) -> int:
+    """
+    Picks number of dispersion samples, so copies of the ghost made by neighbouring samples are about one pixel apart
+    :param max_samples quality ceiling
+    :returns sample count in range <1, max_samples>, one means dispersion is not visible
+    """
+    dispersion = min(abs(ghost.dispersion), 0.999)
+    if dispersion == 0.0:
+        return 1
+
+    # only visible part of ghost is dispersed
+    bounds = ghost_bounds(ghost_x, ghost_y, ghost.size / 100, ghost.ratio, aspect_ratio)
+    bounds = _intersect(bounds, (0.0, 0.0, 1.0, 1.0))
+    if bounds is None:
+        return 1
+
+    if ghost.dispersion_center == 'image':
+        center_x, center_y = 0.5, 0.5
+    else:
+        center_x, center_y = ghost_x / 2.0 + 0.5, ghost_y / 2.0 + 0.5
+
+    # farthest point of ghost from center of dispersion in pixels
+    radius_x = max(abs(bounds[0] - center_x), abs(bounds[2] - center_x)) * width
+    radius_y = max(abs(bounds[1] - center_y), abs(bounds[3] - center_y)) * height
+    radius = math.hypot(radius_x, radius_y)
+
+    # point at distance r is copied to distances from r / (1 + dispersion) to r / (1 - dispersion)
+    spread = radius * 2.0 * dispersion / (1.0 - dispersion * dispersion)
+
+    return max(1, min(max_samples, math.ceil(spread) + 1))
+
+
+def _intersect(first, second):
+    bounds = (max(first[0], second[0]), max(first[1], second[1]), min(first[2], second[2]), min(first[3], second[3]))
+
+    if bounds[0] > bounds[2] or bounds[1] > bounds[3]:
+        return None
+
+    return bounds
+
+
+def _undisperse_bounds(bounds, ghost, ghost_x, ghost_y):
+    """
+    Finds all positions, which sample given bounds with any of dispersion scales
+    :returns bounds or None if whole image can be affected
+    """
+    if ghost.dispersion == 0.0:
+        return bounds
+
+    # sample scales are in range <1 - |dispersion|, 1 + |dispersion|>
+    min_scale = 1.0 - abs(ghost.dispersion)
+    max_scale = 1.0 + abs(ghost.dispersion)
+    if min_scale < 1e-3:
+        return None
+
+    if ghost.dispersion_center == 'image':
+        center_x, center_y = 0.5, 0.5
+    else:
+        center_x, center_y = ghost_x / 2.0 + 0.5, ghost_y / 2.0 + 0.5
+
+    # box edges move linearly with inverse scale, so extreme scales are enough
+    xs = []
+    ys = []
+    for scale in (min_scale, max_scale):
+        xs.extend([center_x + (bounds[0] - center_x) / scale, center_x + (bounds[2] - center_x) / scale])
+        ys.extend([center_y + (bounds[1] - center_y) / scale, center_y + (bounds[3] - center_y) / scale])
+
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _undistort_bounds(bounds, distortion):
+    """
+    Finds all positions, which are distorted into given bounds.
+    Distortion moves positions radially towards image center, distance r is mapped to r * (1 - distortion * r^2).
+    :returns bounds or None if whole image can be affected
+    """
+    if distortion == 0.0:
+        return bounds
+
+    def distort(r):
+        return r * (1.0 - distortion * r * r)
+
+    # bounds relative to image center
+    rel = (bounds[0] - 0.5, bounds[1] - 0.5, bounds[2] - 0.5, bounds[3] - 0.5)
+    corners = [(rel[0], rel[1]), (rel[2], rel[1]), (rel[0], rel[3]), (rel[2], rel[3])]
+
+    nearest_x = min(max(0.0, rel[0]), rel[2])
+    nearest_y = min(max(0.0, rel[1]), rel[3])
+    min_dist = math.hypot(nearest_x, nearest_y)
+    max_dist = max(math.hypot(x, y) for x, y in corners)
+
+    # largest distance of pixel inside of image from its center
+    max_radius = math.sqrt(0.5)
+
+    # distorted distance is never larger than original one
+    min_radius = min_dist
+
+    # distortion function rises until its peak, then falls until image corner
+    peak = min(1.0 / math.sqrt(3.0 * distortion), max_radius)
+    if distort(max_radius) > max_dist:
+        # positions past the peak can't reach the box, find the limit on rising part
+        low, high = 0.0, peak
+        for _ in range(32):
+            mid = (low + high) / 2.0
+            if distort(mid) <= max_dist:
+                low = mid
+            else:
+                high = mid
+        max_radius = high
+
+    if min_radius > max_radius:
+        return _EMPTY
+
+    if min_dist == 0.0:
+        # box contains image center, every direction is possible
+        return 0.5 - max_radius, 0.5 - max_radius, 0.5 + max_radius, 0.5 + max_radius
+
+    # angular span of box seen from image center, box without center spans less than half turn
+    box_angle = math.atan2((rel[1] + rel[3]) / 2.0, (rel[0] + rel[2]) / 2.0)
+    offsets = [_wrap_angle(math.atan2(y, x) - box_angle) for x, y in corners]
+    min_angle = box_angle + min(offsets)
+    max_angle = box_angle + max(offsets)
+
+    angles = [min_angle, max_angle]
+    for axis in range(-4, 5):
+        axis_angle = axis * math.pi / 2.0
+        if min_angle < axis_angle < max_angle:
+            angles.append(axis_angle)
+
+    xs = []
+    ys = []
+    for angle in angles:
+        for radius in (min_radius, max_radius):
+            xs.append(0.5 + math.cos(angle) * radius)
+            ys.append(0.5 + math.sin(angle) * radius)
+
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _wrap_angle(angle):
+    return (angle + math.pi) % (2.0 * math.pi) - math.pi
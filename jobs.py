@@ -0,0 +1,147 @@
+from typing import Generator, Optional, Tuple
+
+# seconds between steps of modal job
+STEP_INTERVAL = 0.01
+
+# progress yielded by steps, number of finished steps and number of all steps
+Progress = Tuple[int, int]
+
+
+def run_steps(steps: Generator):
+    """
+    Runs all steps of generator at once
+    :returns return value of generator
+    """
+    while True:
+        try:
+            next(steps)
+        except StopIteration as stop:
+            return stop.value
+
+
+class Jobs:
+    """
+    Keeps running modal jobs. Requests of job, which is already running, are merged into one,
+    which is started after running job finishes, so only latest settings are rendered.
+    """
+    __running = set()
+    # maps job to operator properties of latest request
+    __requests = {}
+
+    @classmethod
+    def is_running(cls, job: str) -> bool:
+        return job in cls.__running
+
+    @classmethod
+    def start(cls, job: str):
+        cls.__running.add(job)
+
+    @classmethod
+    def request(cls, job: str, keywords: dict):
+        """
+        Queues job, earlier queued request is replaced
+        """
+        cls.__requests[job] = keywords
+
+    @classmethod
+    def take_request(cls, job: str) -> Optional[dict]:
+        return cls.__requests.pop(job, None)
+
+    @classmethod
+    def finish(cls, job: str):
+        """
+        Marks job as finished, queued request is dropped
+        """
+        cls.__running.discard(job)
+        cls.__requests.pop(job, None)
+
+    @classmethod
+    def clear(cls):
+        cls.__running.clear()
+        cls.__requests.clear()
+
+
+class ModalJob:
+    """
+    Mixin of operators, which run as timer driven modal job, when invoked from UI.
+    Work is done by generator from `steps`, one step runs on every timer event, so UI stays responsive.
+    Esc cancels the job, Blender cancels it on file load or window close. Execute runs all steps at once.
+    """
+    # label shown in status bar
+    job_label = "Lens Flare"
+
+    def steps(self, context) -> Generator[Progress, None, set]:
+        """
+        :yields progress after every step
+        :returns operator result
+        """
+        raise NotImplementedError
+
+    def execute(self, context):
+        return run_steps(self.steps(context))
+
+    def invoke(self, context, event):
+        if Jobs.is_running(self.bl_idname):
+            Jobs.request(self.bl_idname, self.as_keywords())
+            self.report({'INFO'}, f"{self.job_label}: queued, it starts when running job finishes")
+            return {'CANCELLED'}
+
+        Jobs.start(self.bl_idname)
+        self._steps = self.steps(context)
+
+        window_manager = context.window_manager
+        self._timer = window_manager.event_timer_add(STEP_INTERVAL, window=context.window)
+        window_manager.modal_handler_add(self)
+        window_manager.progress_begin(0, 100)
+
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        if event.type == 'ESC' and event.value == 'PRESS':
+            self.finish(context)
+            self.report({'WARNING'}, f"{self.job_label}: cancelled")
+            return {'CANCELLED'}
+
+        if event.type != 'TIMER' or event.timer != self._timer:
+            return {'PASS_THROUGH'}
+
+        try:
+            done, total = next(self._steps)
+        except StopIteration as stop:
+            request = Jobs.take_request(self.bl_idname)
+            if request is None:
+                self.finish(context)
+                return stop.value
+
+            # merged requests are rendered once with current settings
+            for name, value in request.items():
+                setattr(self, name, value)
+            self._steps = self.steps(context)
+            return {'RUNNING_MODAL'}
+        except Exception:
+            self.finish(context)
+            raise
+
+        context.window_manager.progress_update(int(100 * done / max(total, 1)))
+        context.workspace.status_text_set(f"{self.job_label}: {done}/{total}, Esc to cancel")
+
+        return {'RUNNING_MODAL'}
+
+    def cancel(self, context):
+        """
+        Called by Blender instead of `modal`, when it stops running job
+        """
+        self.finish(context)
+
+    def finish(self, context):
+        # closing generator runs its cleanup
+        self._steps.close()
+
+        window_manager = context.window_manager
+        window_manager.event_timer_remove(self._timer)
+        window_manager.progress_end()
+        # workspace is missing, when window is closing
+        if context.workspace is not None:
+            context.workspace.status_text_set(None)
+
+        Jobs.finish(self.bl_idname)
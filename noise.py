@@ -0,0 +1,42 @@
+import functools
+
+import numpy
+
+
+@functools.lru_cache(maxsize=4)
+def generate_noise(size: int, seed: int, kind: str = 'white') -> numpy.ndarray:
+    """
+    Generates square noise texture with uniformly distributed values in <0, 1)
+    :param size width and height of texture
+    :param seed seed of random generator, same seed gives same texture
+    :param kind 'white' or 'blue' noise
+    :returns read-only float32 array with shape (size, size), shared by all callers
+    """
+    rng = numpy.random.default_rng(seed)
+    values = rng.random((size, size))
+
+    if kind == 'blue':
+        values = _blue_noise(values)
+
+    values = values.astype(numpy.float32)
+    values.setflags(write=False)
+
+    return values
+
+
+def _blue_noise(white: numpy.ndarray) -> numpy.ndarray:
+    """
+    Approximates blue noise by high-pass filtering white noise and redistributing values back to uniform range
+    """
+    size = white.shape[0]
+
+    freq = numpy.fft.fftfreq(size)
+    radius = numpy.hypot(freq[:, numpy.newaxis], freq[numpy.newaxis, :])
+
+    filtered = numpy.real(numpy.fft.ifft2(numpy.fft.fft2(white) * radius))
+
+    # ranks keep high frequency structure, but make histogram flat again
+    ranks = numpy.empty(filtered.size)
+    ranks[numpy.argsort(filtered, axis=None)] = numpy.arange(filtered.size)
+
+    return ((ranks + 0.5) / filtered.size).reshape(white.shape)
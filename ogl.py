@@ -1,91 +1,236 @@
+import array
 import math
-import random
-from typing import Any, Dict
+from collections import OrderedDict
+from typing import Any, Dict, Generator, List, NamedTuple, Optional, Tuple
 
 import gpu
 import bgl
+import numpy
 import bpy
-import bpy_extras
 from gpu_extras.batch import batch_for_shader
 from mathutils import Matrix, Vector
 
+from .geometry import ghost_copy_bounds, ghost_position, ghost_sample_count
+from .jobs import Progress, run_steps
+from .noise import generate_noise
 from .shaders import Shaders
+from .spectrum import spectrum_table, table_mean
+from . import profiling
 from .properties import MasterProperties
 
+# has to match MAX_GHOSTS in ghost_batched.frag
+GHOST_BATCH_SIZE = 32
+
+# framebuffer format for every precision setting
+OFFSCREEN_FORMATS = {
+    "8bit": 'RGBA8',
+    "half": 'RGBA16F',
+    "float": 'RGBA32F',
+}
+# bytes of one color pixel of framebuffer format
+FORMAT_BYTES = {
+    'RGBA8': 4,
+    'RGBA16F': 8,
+    'RGBA32F': 16,
+}
+# GL_HALF_FLOAT is missing in some bgl versions
+GL_HALF_FLOAT = 0x140B
+
+
+class RenderSettings(NamedTuple):
+    """
+    Resolution and quality of one render, preview uses lower values than properties
+    """
+    width: int
+    height: int
+    # ghosts are rendered at resolution divided by this value
+    ghost_divisor: int
+    max_samples: int
+    # framebuffer format of all buffers
+    format: str = 'RGBA8'
+
+    @property
+    def ghost_width(self) -> int:
+        return math.ceil(self.width / self.ghost_divisor)
+
+    @property
+    def ghost_height(self) -> int:
+        return math.ceil(self.height / self.ghost_divisor)
 
-def render_debug_cross(context, props: MasterProperties) -> (bgl.Buffer, int):
+
+def render_settings(props: MasterProperties) -> RenderSettings:
+    """
+    :returns settings of final render, format is the one framebuffers are really created with
+    """
+    return RenderSettings(
+        width=props.resolution.resolution_x,
+        height=props.resolution.resolution_y,
+        ghost_divisor=int(props.ghost_resolution),
+        max_samples=props.dispersion_samples,
+        format=supported_format(OFFSCREEN_FORMATS[props.precision]),
+    )
+
+
+def render_debug_cross(context, props: MasterProperties) -> (numpy.ndarray, int):
     """
     Render debug cross
-    :returns buffer with image and draw call count
+    :returns buffer with image and draw call count, buffer is valid until next render
     """
-    shaders = Shaders()
+    debug_shader = Shaders().debug
+    settings = render_settings(props)
 
-    offscreen = gpu.types.GPUOffScreen(props.resolution.resolution_x, props.resolution.resolution_y)
+    offscreen = OffScreenPool.acquire(settings.width, settings.height, settings.format)
     draw_count = 0
 
-    quad_batch = batch_quad(shaders.debug)
-
-    with offscreen.bind():
-        # black background
-        bgl.glClearColor(0.0, 0.0, 0.0, 1.0)
-        bgl.glClear(bgl.GL_COLOR_BUFFER_BIT)
-        bgl.glEnable(bgl.GL_BLEND)
-        bgl.glBlendFunc(bgl.GL_SRC_ALPHA, bgl.GL_ONE)
+    quad_batch = batch_quad(debug_shader)
 
-        shaders.debug.bind()
+    try:
+        with offscreen.bind():
+            # black background
+            bgl.glClearColor(0.0, 0.0, 0.0, 1.0)
+            bgl.glClear(bgl.GL_COLOR_BUFFER_BIT)
+            bgl.glEnable(bgl.GL_BLEND)
+            bgl.glBlendFunc(bgl.GL_SRC_ALPHA, bgl.GL_ONE)
 
-        for position in props.positions:
-            pos = Vector((position.manual_x, position.manual_y))
+            debug_shader.bind()
 
-            # set position from object
-            if position.variant == 'auto' and position.auto_object is not None:
-                world_pos = position.auto_object.matrix_world.to_translation()
-                pos = bpy_extras.object_utils.world_to_camera_view(context.scene, context.scene.camera, world_pos)
+            for position in props.positions:
+                pos = position.screen_position(context.scene)
 
-            uniforms = {
-                "flare_position": pos.xy,
-                "aspect_ratio": props.resolution.resolution_x / props.resolution.resolution_y,
-            }
+                uniforms = {
+                    "flare_position": pos.xy,
+                    "aspect_ratio": settings.width / settings.height,
+                }
 
-            set_float_uniforms(shaders.debug, uniforms)
+                set_float_uniforms(debug_shader, uniforms)
 
-            quad_batch.draw(shaders.debug)
-            draw_count += 1
+                quad_batch.draw(debug_shader)
+                draw_count += 1
 
-        # copy rendered image to RAM
-        buffer = bgl.Buffer(bgl.GL_FLOAT, props.resolution.resolution_x * props.resolution.resolution_y * 4)
-        bgl.glReadBuffer(bgl.GL_BACK)
-        bgl.glReadPixels(0, 0, props.resolution.resolution_x, props.resolution.resolution_y, bgl.GL_RGBA, bgl.GL_FLOAT, buffer)
+            # copy rendered image to RAM
+            buffer = ReadbackBuffer.read(settings.width, settings.height, props.use_half_readback)
+    finally:
+        OffScreenPool.release(offscreen)
 
     return buffer, draw_count
 
 
-def render_lens_flare(context, props: MasterProperties) -> (bgl.Buffer, int):
+def render_lens_flare(context, props: MasterProperties, signatures: List[str] = None) -> (numpy.ndarray, int):
     """
     Renders lens flare effect to buffer
-    :returns buffer with effect
+    :param signatures hash of inputs of every position, when set, layers of unchanged positions
+    from previous render are reused
+    :returns buffer with effect and draw call count, buffer is valid until next render
     """
-    max_x = props.resolution.resolution_x
-    max_y = props.resolution.resolution_y
+    return run_steps(render_lens_flare_steps(context, props, signatures))
+
+
+def render_lens_flare_steps(context, props: MasterProperties, signatures: List[str] = None) \
+        -> Generator[Progress, None, Tuple[numpy.ndarray, int]]:
+    """
+    Same as `render_lens_flare`, but one position is rendered in every step
+    :yields number of rendered and all positions
+    """
+    settings = render_settings(props)
+
+    offscreen = OffScreenPool.acquire(settings.width, settings.height, settings.format)
+    try:
+        if signatures is None:
+            LayerCache.free_all()
+
+        draw_count = yield from render_to_offscreen_steps(context, props, offscreen, settings, signatures)
+
+        with offscreen.bind(), profiling.active().stage('readback'):
+            # copy rendered image to RAM
+            buffer = ReadbackBuffer.read(settings.width, settings.height, props.use_half_readback)
+    finally:
+        OffScreenPool.release(offscreen)
+
+    return buffer, draw_count
 
+
+def render_to_offscreen(context, props: MasterProperties, offscreen: gpu.types.GPUOffScreen, settings: RenderSettings,
+                        signatures: List[str] = None) -> int:
+    """
+    Renders lens flare effect to offscreen with resolution from settings
+    :param signatures hash of inputs of every position, when set, layers of unchanged positions
+    from previous render are reused
+    :returns draw call count
+    """
+    return run_steps(render_to_offscreen_steps(context, props, offscreen, settings, signatures))
+
+
+def render_to_offscreen_steps(context, props: MasterProperties, offscreen: gpu.types.GPUOffScreen,
+                              settings: RenderSettings, signatures: List[str] = None) -> Generator[Progress, None, int]:
+    """
+    Same as `render_to_offscreen`, but one position is rendered in every step
+    :yields number of rendered and all positions
+    """
     # render kinda circles
     blades = props.camera.blades
     if blades == 0:
         blades = 256
 
-    shaders = Shaders()
+    batched = props.ghost_rendering == 'batched'
 
-    offscreen = gpu.types.GPUOffScreen(max_x, max_y)
-    ghost_fb = gpu.types.GPUOffScreen(max_x, max_y)
+    # ghosts can be rendered at reduced resolution and upsampled
+    reduced = settings.ghost_divisor > 1
 
-    ghost_batch = batch_from_blades(blades, shaders.ghost)
-    quad_batch = batch_quad(shaders.flare)
+    shaders = Shaders()
+    renderer = PositionRenderer(
+        props,
+        settings,
+        ghost_shader=shaders.ghost,
+        flare_shader=shaders.flare,
+        copy_shader=shaders.copy,
+        batched_shader=shaders.ghost_batched if batched else None,
+        upsample_shader=shaders.upsample if reduced else None,
+        blades=blades,
+        noise_tex=NoiseTexture.get(props),
+        spectrum_tex=SpectrumTexture.get(props.spectrum_image),
+        # batched ghosts are evaluated directly in final buffer
+        ghost_fb=None if batched else OffScreenPool.acquire(settings.ghost_width, settings.ghost_height,
+                                                            settings.format),
+        ghost_layer=OffScreenPool.acquire(settings.ghost_width, settings.ghost_height,
+                                          settings.format) if reduced else None,
+    )
 
     draw_count = 0
-
-    noise_tex = NoiseTexture()
-
-    # clear framebuffer
+    profiler = profiling.active()
+    count = len(props.positions)
+
+    try:
+        if signatures is None:
+            clear_offscreen(offscreen)
+
+            for index, position in enumerate(props.positions):
+                draw_count += renderer.render(offscreen, position.screen_position(context.scene), index)
+                yield index + 1, count
+        else:
+            LayerCache.resize(settings.width, settings.height, settings.format, count)
+
+            for index, position in enumerate(props.positions):
+                layer = LayerCache.get(index, signatures[index])
+                if layer is None:
+                    layer = LayerCache.layer(index)
+                    clear_offscreen(layer)
+                    draw_count += renderer.render(layer, position.screen_position(context.scene), index)
+                    LayerCache.validate(index, signatures[index])
+                yield index + 1, count
+
+            clear_offscreen(offscreen)
+            with profiler.stage('composite', gpu=True):
+                draw_count += composite_layers(offscreen, shaders.composite, renderer.quad_batch, LayerCache.layers())
+    finally:
+        if renderer.ghost_fb is not None:
+            OffScreenPool.release(renderer.ghost_fb)
+        if renderer.ghost_layer is not None:
+            OffScreenPool.release(renderer.ghost_layer)
+
+    return draw_count
+
+
+def clear_offscreen(offscreen: gpu.types.GPUOffScreen):
     with offscreen.bind():
         # black background
         bgl.glClearColor(0.0, 0.0, 0.0, 1.0)
@@ -93,74 +238,160 @@ def render_lens_flare(context, props: MasterProperties) -> (bgl.Buffer, int):
         bgl.glEnable(bgl.GL_BLEND)
         bgl.glBlendFunc(bgl.GL_SRC_ALPHA, bgl.GL_ONE)
 
-    for position in props.positions:
-        pos = Vector((position.manual_x, position.manual_y))
 
-        # set position from object
-        if position.variant == 'auto' and position.auto_object is not None:
-            world_pos = position.auto_object.matrix_world.to_translation()
-            pos = bpy_extras.object_utils.world_to_camera_view(context.scene, context.scene.camera, world_pos)
+def composite_layers(offscreen: gpu.types.GPUOffScreen, composite_shader, quad_batch, layers) -> int:
+    """
+    Adds layers together into offscreen
+    :returns draw call count
+    """
+    draw_count = 0
 
-        flare_vector = pos.xy - Vector((0.5, 0.5))
-        flare_vector.normalize()
+    with offscreen.bind():
+        bgl.glEnable(bgl.GL_BLEND)
+        bgl.glBlendFunc(bgl.GL_SRC_ALPHA, bgl.GL_ONE)
 
-        # first render ghosts one by one
-        for ghost in props.ghosts:
-            # calculate position
-            ghost_x = ((pos.x - 0.5) * 2.0) * ghost.offset
-            ghost_y = ((pos.y - 0.5) * 2.0) * ghost.offset
-            # add perpendicular offset
-            ghost_x += flare_vector.y * ghost.perpendicular_offset
-            ghost_y += -flare_vector.x * ghost.perpendicular_offset
-
-            with ghost_fb.bind():
-                render_ghost(props, ghost, shaders.ghost, ghost_batch, flare_vector, pos)
-                draw_count += 1
+        composite_shader.bind()
+        set_int_uniforms(composite_shader, {"layer": 0})
+
+        for layer in layers:
+            bgl.glActiveTexture(bgl.GL_TEXTURE0)
+            bgl.glBindTexture(bgl.GL_TEXTURE_2D, layer.color_texture)
 
-            with offscreen.bind():
-                # now copy to final buffer
-                bgl.glActiveTexture(bgl.GL_TEXTURE0)
-                bgl.glBindTexture(bgl.GL_TEXTURE_2D, ghost_fb.color_texture)
+            quad_batch.draw(composite_shader)
+            draw_count += 1
+
+    return draw_count
 
-                # disable wrapping
-                bgl.glTexParameterf(bgl.GL_TEXTURE_2D, bgl.GL_TEXTURE_WRAP_S, bgl.GL_CLAMP_TO_BORDER)
-                bgl.glTexParameterf(bgl.GL_TEXTURE_2D, bgl.GL_TEXTURE_WRAP_T, bgl.GL_CLAMP_TO_BORDER)
 
-                border_color = bgl.Buffer(bgl.GL_FLOAT, 4, [0.0, 0.0, 0.0, 1.0])
+class PositionRenderer:
+    """
+    Renders ghosts and flare of one position, keeps shaders and batches shared by all positions
+    """
+    def __init__(self, props: MasterProperties, settings: RenderSettings, ghost_shader, flare_shader, copy_shader,
+                 batched_shader,
+                 upsample_shader, blades: int, noise_tex: 'NoiseTexture', spectrum_tex: 'SpectrumTexture',
+                 ghost_fb: gpu.types.GPUOffScreen, ghost_layer: gpu.types.GPUOffScreen):
+        """
+        :param ghost_layer reduced resolution buffer for ghosts, None renders ghosts directly at full resolution
+        """
+        self.props = props
+        self.settings = settings
+        self.ghost_shader = ghost_shader
+        self.flare_shader = flare_shader
+        self.copy_shader = copy_shader
+        self.batched_shader = batched_shader
+        self.upsample_shader = upsample_shader
+        self.blades = blades
+        self.noise_tex = noise_tex
+        self.spectrum_tex = spectrum_tex
+        self.ghost_fb = ghost_fb
+        self.ghost_layer = ghost_layer
+
+        self.rotation_matrix = Matrix.Rotation(props.camera.rotation, 4, 'Z')
+
+        self.ghost_batch = batch_from_blades(blades, ghost_shader)
+        self.quad_batch = batch_quad(flare_shader)
+
+    def render(self, offscreen: gpu.types.GPUOffScreen, pos: Vector, index: int) -> int:
+        """
+        Adds effect of position to offscreen
+        :param index index of position, used by profiler
+        :returns draw call count
+        """
+        props = self.props
+        settings = self.settings
+        profiler = profiling.active()
+        max_x = settings.width
+        max_y = settings.height
+
+        draw_count = 0
+
+        # state can be changed by UI drawn between steps of modal render
+        bgl.glDisable(bgl.GL_SCISSOR_TEST)
+        bgl.glEnable(bgl.GL_BLEND)
+        bgl.glBlendFunc(bgl.GL_SRC_ALPHA, bgl.GL_ONE)
+
+        flare_vector = pos.xy - Vector((0.5, 0.5))
+        flare_vector.normalize()
 
-                bgl.glTexParameterfv(bgl.GL_TEXTURE_2D, bgl.GL_TEXTURE_BORDER_COLOR, border_color)
+        ghost_target = offscreen
+        if self.ghost_layer is not None:
+            ghost_target = self.ghost_layer
+            clear_offscreen(ghost_target)
+            max_x = settings.ghost_width
+            max_y = settings.ghost_height
 
+        if self.batched_shader is not None:
+            with ghost_target.bind(), profiler.stage('ghosts_batched', position=index, gpu=True):
                 bgl.glActiveTexture(bgl.GL_TEXTURE2)
-                bgl.glBindTexture(bgl.GL_TEXTURE_2D, props.spectrum_image.bindcode)
+                bgl.glBindTexture(bgl.GL_TEXTURE_2D, self.spectrum_tex.gl_code)
 
                 bgl.glActiveTexture(bgl.GL_TEXTURE1)
-                bgl.glBindTexture(bgl.GL_TEXTURE_2D, noise_tex.gl_code)
+                bgl.glBindTexture(bgl.GL_TEXTURE_2D, self.noise_tex.gl_code)
+
+                draw_count += render_ghosts_batched(props, self.batched_shader, self.quad_batch, flare_vector, pos,
+                                                    self.blades, self.spectrum_tex, settings, self.rotation_matrix)
+        else:
+            # first render ghosts one by one
+            for ghost_index, ghost in enumerate(props.ghosts):
+                ghost_x, ghost_y = ghost_position(ghost, pos, flare_vector)
+
+                # only pixels, which can sample the ghost, are shaded
+                scissor = ghost_copy_bounds(ghost, ghost_x, ghost_y, max_x / max_y, max_x, max_y)
+                if scissor[2] == 0 or scissor[3] == 0:
+                    continue
+
+                with self.ghost_fb.bind(), profiler.stage('ghost', index, ghost_index, gpu=True):
+                    render_ghost(props, ghost, self.ghost_shader, self.ghost_batch, flare_vector, pos,
+                                 self.rotation_matrix)
+                    draw_count += 1
+
+                with ghost_target.bind(), profiler.stage('dispersion_copy', index, ghost_index, gpu=True):
+                    # now copy to final buffer
+                    bgl.glActiveTexture(bgl.GL_TEXTURE0)
+                    bgl.glBindTexture(bgl.GL_TEXTURE_2D, self.ghost_fb.color_texture)
+
+                    # disable wrapping
+                    bgl.glTexParameterf(bgl.GL_TEXTURE_2D, bgl.GL_TEXTURE_WRAP_S, bgl.GL_CLAMP_TO_BORDER)
+                    bgl.glTexParameterf(bgl.GL_TEXTURE_2D, bgl.GL_TEXTURE_WRAP_T, bgl.GL_CLAMP_TO_BORDER)
+
+                    border_color = bgl.Buffer(bgl.GL_FLOAT, 4, [0.0, 0.0, 0.0, 1.0])
 
-                copy_ghost(shaders.copy, quad_batch, ghost, props, Vector((ghost_x, ghost_y)))
+                    bgl.glTexParameterfv(bgl.GL_TEXTURE_2D, bgl.GL_TEXTURE_BORDER_COLOR, border_color)
+
+                    bgl.glActiveTexture(bgl.GL_TEXTURE2)
+                    bgl.glBindTexture(bgl.GL_TEXTURE_2D, self.spectrum_tex.gl_code)
+
+                    bgl.glActiveTexture(bgl.GL_TEXTURE1)
+                    bgl.glBindTexture(bgl.GL_TEXTURE_2D, self.noise_tex.gl_code)
+
+                    bgl.glEnable(bgl.GL_SCISSOR_TEST)
+                    bgl.glScissor(*scissor)
+
+                    samples = ghost_sample_count(props, ghost, ghost_x, ghost_y, max_x, max_y, settings.max_samples)
+                    copy_ghost(self.copy_shader, self.quad_batch, ghost, props, Vector((ghost_x, ghost_y)), samples,
+                               self.spectrum_tex, settings)
+                    draw_count += 1
+
+                    bgl.glDisable(bgl.GL_SCISSOR_TEST)
+
+        if self.ghost_layer is not None:
+            with offscreen.bind(), profiler.stage('upsample', position=index, gpu=True):
+                upsample(self.upsample_shader, self.quad_batch, self.ghost_layer, max_x, max_y)
                 draw_count += 1
 
         # finally render flare on top
-        with offscreen.bind():
+        with offscreen.bind(), profiler.stage('flare', position=index, gpu=True):
             bgl.glActiveTexture(bgl.GL_TEXTURE0)
-            bgl.glBindTexture(bgl.GL_TEXTURE_2D, noise_tex.gl_code)
+            bgl.glBindTexture(bgl.GL_TEXTURE_2D, self.noise_tex.gl_code)
 
-            render_flare(props, pos.xy, shaders.flare, quad_batch)
+            render_flare(props, pos.xy, self.flare_shader, self.quad_batch, settings)
             draw_count += 1
 
-    with offscreen.bind():
-        # copy rendered image to RAM
-        buffer = bgl.Buffer(bgl.GL_FLOAT, max_x * max_y * 4)
-        bgl.glReadBuffer(bgl.GL_BACK)
-        bgl.glReadPixels(0, 0, max_x, max_y, bgl.GL_RGBA, bgl.GL_FLOAT, buffer)
-
-    offscreen.free()
-    ghost_fb.free()
-    noise_tex.free()
-
-    return buffer, draw_count
+        return draw_count
 
 
-def render_flare(props: MasterProperties, position, flare_shader, flare_batch):
+def render_flare(props: MasterProperties, position, flare_shader, flare_batch, settings: RenderSettings):
     """
     Renders flare to active buffer
     """
@@ -184,7 +415,7 @@ def render_flare(props: MasterProperties, position, flare_shader, flare_batch):
         "ray_intensity": props.flare.rays_intensity,
         "rotation": props.camera.rotation,
         "master_intensity": props.master_intensity,
-        "res": [props.resolution.resolution_x / 64, props.resolution.resolution_y / 64],
+        "res": noise_scale(props, settings.width, settings.height),
         "anamorphic": float(props.flare.anamorphic),
     }
 
@@ -199,9 +430,11 @@ def render_flare(props: MasterProperties, position, flare_shader, flare_batch):
     flare_batch.draw(flare_shader)
 
 
-def render_ghost(props: MasterProperties, ghost, ghost_shader, ghost_batch, flare_vector, flare_position):
+def render_ghost(props: MasterProperties, ghost, ghost_shader, ghost_batch, flare_vector, flare_position,
+                 rotation_matrix: Matrix):
     """
     Renders ghost to active buffer
+    :param rotation_matrix rotation of aperture, same for all ghosts
     """
     # black background
     bgl.glClearColor(0.0, 0.0, 0.0, 1.0)
@@ -209,12 +442,7 @@ def render_ghost(props: MasterProperties, ghost, ghost_shader, ghost_batch, flar
     bgl.glEnable(bgl.GL_BLEND)
     bgl.glBlendFunc(bgl.GL_SRC_ALPHA, bgl.GL_ONE)
 
-    # calculate position
-    ghost_x = ((flare_position.x - 0.5) * 2.0) * ghost.offset
-    ghost_y = ((flare_position.y - 0.5) * 2.0) * ghost.offset
-    # add perpendicular offset
-    ghost_x += flare_vector.y * ghost.perpendicular_offset
-    ghost_y += -flare_vector.x * ghost.perpendicular_offset
+    ghost_x, ghost_y = ghost_position(ghost, flare_position, flare_vector)
 
     ratio = props.resolution.resolution_x / props.resolution.resolution_y
 
@@ -227,7 +455,7 @@ def render_ghost(props: MasterProperties, ghost, ghost_shader, ghost_batch, flar
         # move and scale ghosts
         "modelMatrix": model_matrix,
         # rotate ghost
-        "rotationMatrix": Matrix.Rotation(props.camera.rotation, 4, 'Z'),
+        "rotationMatrix": rotation_matrix,
         # set color and intensity
         "color": Vector((ghost.color[0], ghost.color[1], ghost.color[2], 1)),
         # set centers
@@ -243,14 +471,101 @@ def render_ghost(props: MasterProperties, ghost, ghost_shader, ghost_batch, flar
     ghost_batch.draw(ghost_shader)
 
 
-def copy_ghost(copy_shader, quad_batch, ghost, props, ghost_pos):
+def render_ghosts_batched(props: MasterProperties, batched_shader, quad_batch, flare_vector, flare_position, blades,
+                          spectrum_tex: 'SpectrumTexture', settings: RenderSettings, rotation_matrix: Matrix) -> int:
+    """
+    Renders all ghosts of one position to active buffer, dispersion is evaluated analytically,
+    so no intermediate ghost framebuffer is needed
+    :returns draw call count
+    """
+    ghosts = [ghost for ghost in props.ghosts if ghost.size > 0.0]
+
+    batched_shader.bind()
+
+    batched_int_uniforms = {
+        "spectral": 2,
+        "noise": 1,
+    }
+
+    set_int_uniforms(batched_shader, batched_int_uniforms)
+
+    batched_float_uniforms = {
+        "rotationMatrix": rotation_matrix,
+        "aspect_ratio": props.resolution.resolution_x / props.resolution.resolution_y,
+        "blades": float(blades),
+        "master_intensity": props.master_intensity,
+        "res": noise_scale(props, settings.width, settings.height),
+        "use_jitter": float(props.use_jitter),
+        "spectral_mean": spectrum_tex.mean,
+        "spectral_size": float(spectrum_tex.size),
+    }
+
+    set_float_uniforms(batched_shader, batched_float_uniforms)
+
+    draw_count = 0
+
+    for start in range(0, len(ghosts), GHOST_BATCH_SIZE):
+        batch = ghosts[start:start + GHOST_BATCH_SIZE]
+
+        transforms = []
+        colors = []
+        dispersions = []
+        samples = []
+
+        for ghost in batch:
+            ghost_x, ghost_y = ghost_position(ghost, flare_position, flare_vector)
+            transforms.extend([ghost_x, ghost_y, ghost.size / 100, ghost.ratio])
+            colors.extend([ghost.color[0], ghost.color[1], ghost.color[2], ghost.center_transparency])
+            disperse_center = 0.0 if ghost.dispersion_center == 'image' else 1.0
+            dispersions.extend([ghost.dispersion, ghost.distortion, ghost.intensity, disperse_center])
+            samples.append(ghost_sample_count(props, ghost, ghost_x, ghost_y, settings.ghost_width,
+                                              settings.ghost_height, settings.max_samples))
+
+        set_vec4_array_uniforms(batched_shader, {
+            "ghost_transform": transforms,
+            "ghost_color": colors,
+            "ghost_dispersion": dispersions,
+        })
+        set_float_array_uniforms(batched_shader, {"ghost_samples": samples})
+        set_int_uniforms(batched_shader, {"ghost_count": len(batch)})
+
+        quad_batch.draw(batched_shader)
+        draw_count += 1
+
+    return draw_count
+
+
+def upsample(upsample_shader, quad_batch, source: gpu.types.GPUOffScreen, width: int, height: int):
+    """
+    Adds bicubic upsampled source to active buffer
+    :param width width of source in pixels
+    :param height height of source in pixels
+    """
+    bgl.glActiveTexture(bgl.GL_TEXTURE0)
+    bgl.glBindTexture(bgl.GL_TEXTURE_2D, source.color_texture)
+    # bicubic filter is made of bilinear fetches
+    bgl.glTexParameteri(bgl.GL_TEXTURE_2D, bgl.GL_TEXTURE_MIN_FILTER, bgl.GL_LINEAR)
+    bgl.glTexParameteri(bgl.GL_TEXTURE_2D, bgl.GL_TEXTURE_MAG_FILTER, bgl.GL_LINEAR)
+    bgl.glTexParameteri(bgl.GL_TEXTURE_2D, bgl.GL_TEXTURE_WRAP_S, bgl.GL_CLAMP_TO_EDGE)
+    bgl.glTexParameteri(bgl.GL_TEXTURE_2D, bgl.GL_TEXTURE_WRAP_T, bgl.GL_CLAMP_TO_EDGE)
+
+    upsample_shader.bind()
+
+    set_int_uniforms(upsample_shader, {"source": 0})
+    set_float_uniforms(upsample_shader, {"source_size": (float(width), float(height))})
+
+    quad_batch.draw(upsample_shader)
+
+
+def copy_ghost(copy_shader, quad_batch, ghost, props, ghost_pos, samples, spectrum_tex: 'SpectrumTexture',
+               settings: RenderSettings):
     copy_shader.bind()
 
     copy_int_uniforms = {
         "ghost": 0,
         "spectral": 2,
         "noise": 1,
-        "samples": props.dispersion_samples,
+        "samples": samples,
     }
 
     set_int_uniforms(copy_shader, copy_int_uniforms)
@@ -265,10 +580,12 @@ def copy_ghost(copy_shader, quad_batch, ghost, props, ghost_pos):
         "distortion": ghost.distortion,
         "master_intensity": props.master_intensity,
         "intensity": ghost.intensity,
-        "res": [props.resolution.resolution_x / 64, props.resolution.resolution_y / 64],
+        "res": noise_scale(props, settings.width, settings.height),
         "use_jitter": float(props.use_jitter),
         "disperse_from_ghost_center": disperse_center,
-        "ghost_pos": ghost_pos
+        "ghost_pos": ghost_pos,
+        "spectral_mean": spectrum_tex.mean,
+        "spectral_size": float(spectrum_tex.size),
     }
 
     set_float_uniforms(copy_shader, copy_float_uniforms)
@@ -298,14 +615,25 @@ def batch_quad(shader):
     return batch_for_shader(shader, 'TRI_STRIP', {"position": tuple(positions), "uv": tuple(uv)})
 
 
+def noise_scale(props: MasterProperties, width: int, height: int) -> [float, float]:
+    """
+    :param width width of rendered image, it differs from output resolution in preview
+    :param height height of rendered image
+    :returns scale of UV coordinates, which maps one noise texel to one pixel
+    """
+    size = int(props.noise_resolution)
+    return [width / size, height / size]
+
+
 def set_float_uniforms(shader: gpu.types.GPUShader, uniforms: Dict[str, Any]):
     """
     Sets uniforms to shader.
     :param shader shader to set uniforms to
     :param uniforms dictionary of uniforms
     """
+    binder = UniformBinder.get(shader)
     for name, uniform in uniforms.items():
-        shader.uniform_float(name, uniform)
+        binder.set_float(name, uniform)
 
 
 def set_int_uniforms(shader: gpu.types.GPUShader, uniforms: Dict[str, Any]):
@@ -314,36 +642,442 @@ def set_int_uniforms(shader: gpu.types.GPUShader, uniforms: Dict[str, Any]):
     :param shader shader to set uniforms to
     :param uniforms dictionary of uniforms
     """
+    binder = UniformBinder.get(shader)
     for name, uniform in uniforms.items():
-        shader.uniform_int(name, uniform)
+        binder.set_int(name, uniform)
 
 
-class NoiseTexture:
-    __noise_buf = None
+def set_vec4_array_uniforms(shader: gpu.types.GPUShader, uniforms: Dict[str, Any]):
+    """
+    Sets vec4 array uniforms to shader.
+    :param shader shader to set uniforms to
+    :param uniforms dictionary of flat float lists
+    """
+    binder = UniformBinder.get(shader)
+    for name, values in uniforms.items():
+        binder.set_float(name, values, length=4)
+
+
+def set_float_array_uniforms(shader: gpu.types.GPUShader, uniforms: Dict[str, Any]):
+    """
+    Sets float array uniforms to shader.
+    :param shader shader to set uniforms to
+    :param uniforms dictionary of float lists
+    """
+    binder = UniformBinder.get(shader)
+    for name, values in uniforms.items():
+        binder.set_float(name, values, length=1)
+
+
+class UniformBinder:
+    """
+    Sets uniforms of one shader program. Locations are looked up once and last uploaded values are kept,
+    uniforms are program state, so values which didn't change since last upload are skipped.
+    """
+    # maps id of shader to shader and its binder, shader is kept so its id can't be reused
+    __binders = {}
 
     @classmethod
-    def __generate(cls):
-        if cls.__noise_buf is not None:
+    def get(cls, shader: gpu.types.GPUShader) -> 'UniformBinder':
+        entry = cls.__binders.get(id(shader))
+        if entry is None:
+            entry = (shader, UniformBinder(shader))
+            cls.__binders[id(shader)] = entry
+        return entry[1]
+
+    @classmethod
+    def free_all(cls):
+        cls.__binders.clear()
+
+    def __init__(self, shader: gpu.types.GPUShader):
+        self.shader = shader
+        self.locations = {}
+        self.values = {}
+
+    def set_float(self, name: str, value, length: int = None):
+        """
+        :param value number, vector, matrix or flat list of numbers
+        :param length number of floats in one array item, None uploads one item with all values
+        """
+        values = flatten_uniform(value)
+        if self.values.get(name) == values:
+            profiling.active().count('uniforms_skipped')
             return
-        values = []
 
-        for pixel in range(0, 64 * 64):
-            val = random.random()
-            values.extend([val, val, val, 1.0])
+        location = self.location(name)
+        if length is None:
+            length = len(values)
+        self.shader.uniform_vector_float(location, array.array('f', values), length, len(values) // length)
+
+        self.values[name] = values
+        profiling.active().count('uniforms_uploaded')
+
+    def set_int(self, name: str, value):
+        values = (int(value),)
+        if self.values.get(name) == values:
+            profiling.active().count('uniforms_skipped')
+            return
+
+        self.shader.uniform_vector_int(self.location(name), array.array('i', values), 1, 1)
+
+        self.values[name] = values
+        profiling.active().count('uniforms_uploaded')
+
+    def location(self, name: str) -> int:
+        location = self.locations.get(name)
+        if location is None:
+            location = self.shader.uniform_from_name(name)
+            self.locations[name] = location
+        return location
+
+
+def flatten_uniform(value) -> tuple:
+    """
+    :returns floats of uniform value, matrices are flattened in column-major order like OpenGL expects
+    """
+    if isinstance(value, (int, float)):
+        return (float(value),)
+    if isinstance(value, Matrix):
+        return tuple(item for column in value.col for item in column)
+    return tuple(float(item) for item in value)
+
+
+# maps framebuffer format to its support by GPUOffScreen of this Blender version
+_format_support = {'RGBA8': True}
+
+
+def supported_format(format: str) -> str:
+    """
+    Blender versions without format argument of GPUOffScreen only create RGBA8 framebuffers,
+    support is tested on first use, so it needs GPU context
+    :returns given format or RGBA8, when it is not supported
+    """
+    if format not in _format_support:
+        try:
+            gpu.types.GPUOffScreen(1, 1, format=format).free()
+            _format_support[format] = True
+        except TypeError:
+            _format_support[format] = False
+
+    return format if _format_support[format] else 'RGBA8'
+
+
+def create_offscreen(width: int, height: int, format: str) -> gpu.types.GPUOffScreen:
+    """
+    Creates framebuffer with color format from `supported_format`
+    """
+    if format == 'RGBA8':
+        return gpu.types.GPUOffScreen(width, height)
+
+    return gpu.types.GPUOffScreen(width, height, format=format)
+
+
+class OffScreenPool:
+    """
+    Keeps offscreen framebuffers between renders, so they are not reallocated on every frame.
+    Least recently used unused framebuffers are freed when pool is over its memory budget.
+    """
+    # unused framebuffers in order of last use, maps id to (key, offscreen)
+    __unused = OrderedDict()
+    __used = {}
+    __budget = 512 * 1024 * 1024
+    __stats = {
+        "allocations": 0,
+        "hits": 0,
+        "evictions": 0,
+    }
+
+    @classmethod
+    def acquire(cls, width: int, height: int, format: str = 'RGBA8') -> gpu.types.GPUOffScreen:
+        """
+        :param format color format from FORMAT_BYTES
+        :returns framebuffer with given resolution and format, it has to be returned with `release`
+        """
+        # pool keys and memory budget use format of created framebuffer
+        format = supported_format(format)
+        key = (width, height, format)
+
+        for unused_id, (unused_key, offscreen) in reversed(cls.__unused.items()):
+            if unused_key == key:
+                del cls.__unused[unused_id]
+                cls.__used[id(offscreen)] = (key, offscreen)
+                cls.__stats["hits"] += 1
+                return offscreen
+
+        offscreen = create_offscreen(width, height, format)
+        cls.__used[id(offscreen)] = (key, offscreen)
+        cls.__stats["allocations"] += 1
+
+        return offscreen
+
+    @classmethod
+    def release(cls, offscreen: gpu.types.GPUOffScreen):
+        """
+        Returns framebuffer to pool
+        """
+        key, offscreen = cls.__used.pop(id(offscreen))
+        cls.__unused[id(offscreen)] = (key, offscreen)
+        cls.__evict()
+
+    @classmethod
+    def set_budget(cls, megabytes: int):
+        cls.__budget = megabytes * 1024 * 1024
+        cls.__evict()
+
+    @classmethod
+    def stats(cls) -> dict:
+        """
+        :returns allocation, hit and eviction counts and current memory usage in bytes
+        """
+        stats = dict(cls.__stats)
+        stats["memory"] = cls.__memory()
+        return stats
+
+    @classmethod
+    def free_all(cls):
+        for _, offscreen in cls.__unused.values():
+            offscreen.free()
+        for _, offscreen in cls.__used.values():
+            offscreen.free()
+        cls.__unused.clear()
+        cls.__used.clear()
+
+    @classmethod
+    def __memory(cls) -> int:
+        entries = list(cls.__unused.values()) + list(cls.__used.values())
+        return sum(cls.__key_memory(key) for key, _ in entries)
+
+    @staticmethod
+    def __key_memory(key) -> int:
+        width, height, format = key
+        # color and 32 bit depth attachment
+        return width * height * (FORMAT_BYTES[format] + 4)
+
+    @classmethod
+    def __evict(cls):
+        memory = cls.__memory()
+        while memory > cls.__budget and len(cls.__unused) > 0:
+            _, (key, offscreen) = cls.__unused.popitem(last=False)
+            offscreen.free()
+            memory -= cls.__key_memory(key)
+            cls.__stats["evictions"] += 1
+
+
+class ReadbackBuffer:
+    """
+    Float RGBA buffer for reading rendered images back to RAM, kept between renders with the same resolution
+    """
+    __buffer = None
+    __array = None
+    __size = (0, 0, False)
+
+    @classmethod
+    def read(cls, width: int, height: int, half: bool = False) -> numpy.ndarray:
+        """
+        Reads active framebuffer
+        :param half read half floats, it halves transferred data
+        :returns float32 or float16 view of the persistent buffer, it is overwritten by next read
+        """
+        dtype = numpy.float16 if half else numpy.float32
+
+        if cls.__size != (width, height, half):
+            # bgl has no half float buffer, shorts have the same size
+            cls.__buffer = bgl.Buffer(bgl.GL_SHORT if half else bgl.GL_FLOAT, width * height * 4)
+            try:
+                cls.__array = numpy.frombuffer(cls.__buffer, dtype=dtype)
+            except TypeError:
+                # older bgl.Buffer has no buffer protocol, copy is made on every read
+                cls.__array = None
+            cls.__size = (width, height, half)
+
+        pixel_type = getattr(bgl, 'GL_HALF_FLOAT', GL_HALF_FLOAT) if half else bgl.GL_FLOAT
+
+        bgl.glReadBuffer(bgl.GL_BACK)
+        bgl.glReadPixels(0, 0, width, height, bgl.GL_RGBA, pixel_type, cls.__buffer)
+
+        if cls.__array is None:
+            if half:
+                return numpy.array(cls.__buffer.to_list(), dtype=numpy.int16).view(numpy.float16)
+            return numpy.array(cls.__buffer.to_list(), dtype=numpy.float32)
+
+        return cls.__array
+
+    @classmethod
+    def free(cls):
+        cls.__buffer = None
+        cls.__array = None
+        cls.__size = (0, 0, False)
+
+
+class LayerCache:
+    """
+    Keeps rendered layer of every position between renders, so only positions whose inputs changed are re-rendered.
+    Layers are borrowed from OffScreenPool until they are freed.
+    """
+    # list of [signature, offscreen] for every position
+    __layers = []
+    __size = (0, 0, None)
+    __stats = {
+        "rendered": 0,
+        "reused": 0,
+    }
+
+    @classmethod
+    def resize(cls, width: int, height: int, format: str, count: int):
+        """
+        Makes sure there is one layer with given resolution and format for every position
+        """
+        if cls.__size != (width, height, format):
+            cls.free_all()
+            cls.__size = (width, height, format)
+
+        while len(cls.__layers) > count:
+            _, offscreen = cls.__layers.pop()
+            OffScreenPool.release(offscreen)
+
+        while len(cls.__layers) < count:
+            cls.__layers.append([None, OffScreenPool.acquire(width, height, format)])
+
+    @classmethod
+    def get(cls, index: int, signature: str) -> Optional[gpu.types.GPUOffScreen]:
+        """
+        :returns layer rendered with same signature or None, when layer has to be rendered again
+        """
+        stored_signature, offscreen = cls.__layers[index]
+        if stored_signature == signature:
+            cls.__stats["reused"] += 1
+            return offscreen
+
+        cls.__stats["rendered"] += 1
+        return None
+
+    @classmethod
+    def layer(cls, index: int) -> gpu.types.GPUOffScreen:
+        return cls.__layers[index][1]
+
+    @classmethod
+    def layers(cls) -> List[gpu.types.GPUOffScreen]:
+        return [offscreen for _, offscreen in cls.__layers]
 
-        cls.__noise_buf = bgl.Buffer(bgl.GL_FLOAT, 64 * 64 * 4, values)
+    @classmethod
+    def validate(cls, index: int, signature: str):
+        """
+        Marks layer as rendered with given signature
+        """
+        cls.__layers[index][0] = signature
 
-    def __init__(self):
-        self.__generate()
+    @classmethod
+    def stats(cls) -> dict:
+        """
+        :returns number of rendered and reused layers
+        """
+        return dict(cls.__stats)
+
+    @classmethod
+    def free_all(cls):
+        """
+        Returns all layers to OffScreenPool
+        """
+        for _, offscreen in cls.__layers:
+            OffScreenPool.release(offscreen)
+        cls.__layers.clear()
+        cls.__size = (0, 0, None)
+
+
+class NoiseTexture:
+    """
+    Noise texture uploaded to GPU once and kept between renders, until its settings change
+    """
+    __instance = None
+    __key = None
+
+    @classmethod
+    def get(cls, props: MasterProperties) -> 'NoiseTexture':
+        """
+        :returns noise texture matching noise settings in props
+        """
+        key = (int(props.noise_resolution), props.noise_seed, props.noise_type)
+
+        if cls.__key != key:
+            cls.free_all()
+            cls.__instance = cls(*key)
+            cls.__key = key
+
+        return cls.__instance
+
+    @classmethod
+    def free_all(cls):
+        if cls.__instance is not None:
+            cls.__instance.free()
+        cls.__instance = None
+        cls.__key = None
+
+    def __init__(self, size: int, seed: int, kind: str):
+        self.size = size
+        values = generate_noise(size, seed, kind)
+        noise_buf = bgl.Buffer(bgl.GL_FLOAT, size * size, values.ravel().tolist())
 
         self.__buffer = bgl.Buffer(bgl.GL_INT, 1)
+        bgl.glGenTextures(1, self.__buffer)
         self.gl_code = self.__buffer.to_list()[0]
 
+        bgl.glBindTexture(bgl.GL_TEXTURE_2D, self.gl_code)
+        bgl.glTexImage2D(bgl.GL_TEXTURE_2D, 0, bgl.GL_R32F, size, size, 0, bgl.GL_RED, bgl.GL_FLOAT, noise_buf)
+        bgl.glTexParameteri(bgl.GL_TEXTURE_2D, bgl.GL_TEXTURE_MIN_FILTER, bgl.GL_LINEAR)
+        bgl.glTexParameteri(bgl.GL_TEXTURE_2D, bgl.GL_TEXTURE_MAG_FILTER, bgl.GL_LINEAR)
+
+    def free(self):
+        bgl.glDeleteTextures(1, self.__buffer)
+
+
+class SpectrumTexture:
+    """
+    Baked spectrum table uploaded to GPU once and kept between renders, until spectrum image changes
+    """
+    __instance = None
+    # baked table of uploaded texture, table is baked again only when image changes
+    __table = None
+
+    @classmethod
+    def get(cls, image) -> 'SpectrumTexture':
+        """
+        :returns texture with table of given spectrum image
+        """
+        table = spectrum_table(image)
+
+        if cls.__table is not table:
+            cls.free_all()
+            cls.__instance = cls(table)
+            cls.__table = table
+
+        return cls.__instance
+
+    @classmethod
+    def free_all(cls):
+        if cls.__instance is not None:
+            cls.__instance.free()
+        cls.__instance = None
+        cls.__table = None
+
+    def __init__(self, table: numpy.ndarray):
+        # number of texels, texel k holds integral of spectrum up to k / (size - 1)
+        self.size = len(table)
+        self.mean = table_mean(table)
+
+        rgba = numpy.ones((self.size, 4), dtype=numpy.float32)
+        rgba[:, :3] = table
+        table_buf = bgl.Buffer(bgl.GL_FLOAT, self.size * 4, rgba.ravel().tolist())
+
+        self.__buffer = bgl.Buffer(bgl.GL_INT, 1)
         bgl.glGenTextures(1, self.__buffer)
+        self.gl_code = self.__buffer.to_list()[0]
+
         bgl.glBindTexture(bgl.GL_TEXTURE_2D, self.gl_code)
-        bgl.glTexImage2D(bgl.GL_TEXTURE_2D, 0, bgl.GL_RGBA32F, 64, 64, 0, bgl.GL_RGBA, bgl.GL_FLOAT, self.__noise_buf)
+        bgl.glTexImage2D(bgl.GL_TEXTURE_2D, 0, bgl.GL_RGBA32F, self.size, 1, 0, bgl.GL_RGBA, bgl.GL_FLOAT, table_buf)
         bgl.glTexParameteri(bgl.GL_TEXTURE_2D, bgl.GL_TEXTURE_MIN_FILTER, bgl.GL_LINEAR)
         bgl.glTexParameteri(bgl.GL_TEXTURE_2D, bgl.GL_TEXTURE_MAG_FILTER, bgl.GL_LINEAR)
+        bgl.glTexParameteri(bgl.GL_TEXTURE_2D, bgl.GL_TEXTURE_WRAP_S, bgl.GL_CLAMP_TO_EDGE)
+        bgl.glTexParameteri(bgl.GL_TEXTURE_2D, bgl.GL_TEXTURE_WRAP_T, bgl.GL_CLAMP_TO_EDGE)
 
     def free(self):
         bgl.glDeleteTextures(1, self.__buffer)
@@ -1,8 +1,23 @@
 import time
 import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
 
 from .properties import *
 from . import ogl
+from . import cpu
+from . import cache
+from . import shaders
+from . import writers
+from . import farm
+from . import profiling
+from . import tracking
+from . import bulk
+from . import compositing
+from . import jobs
 
 
 class AddGhostOperator(bpy.types.Operator):
@@ -14,6 +29,7 @@ class AddGhostOperator(bpy.types.Operator):
         props: MasterProperties = context.scene.lens_flare_props
 
         props.ghosts.add()
+        tracking.mark_structure('ghosts')
 
         return {'FINISHED'}
 
@@ -46,6 +62,7 @@ class RemoveGhostOperator(bpy.types.Operator):
             props.selected_ghost = props.selected_ghost - 1
 
         props.ghosts.remove(self.remove_id)
+        tracking.mark_structure('ghosts')
 
         return {'FINISHED'}
 
@@ -59,6 +76,7 @@ class AddPositionOperator(bpy.types.Operator):
         props: MasterProperties = context.scene.lens_flare_props
 
         props.positions.add()
+        tracking.mark_structure('positions')
 
         return {'FINISHED'}
 
@@ -91,6 +109,7 @@ class RemovePositionOperator(bpy.types.Operator):
             props.active_object = props.active_object - 1
 
         props.positions.remove(self.remove_id)
+        tracking.mark_structure('positions')
 
         return {'FINISHED'}
 
@@ -118,30 +137,18 @@ class DuplicateGhostOperator(bpy.types.Operator):
             self.report({'ERROR_INVALID_INPUT'}, "Invalid ID of ghost to duplicate")
             return {'CANCELLED'}
 
-        new_ghost: GhostProperties = props.ghosts.add()
-
-        # TODO clean-up
-        # for some reason, this crashes when `props.ghosts[self.duplicate_id]` is in temp variable
-        new_ghost.color = props.ghosts[self.duplicate_id].color
-        new_ghost.intensity = props.ghosts[self.duplicate_id].intensity
-        new_ghost.name = props.ghosts[self.duplicate_id].name
-        new_ghost.offset = props.ghosts[self.duplicate_id].offset
-        new_ghost.perpendicular_offset = props.ghosts[self.duplicate_id].perpendicular_offset
-        new_ghost.size = props.ghosts[self.duplicate_id].size
-        new_ghost.center_transparency = props.ghosts[self.duplicate_id].center_transparency
-        new_ghost.dispersion_center = props.ghosts[self.duplicate_id].dispersion_center
-        new_ghost.dispersion = props.ghosts[self.duplicate_id].dispersion
-        new_ghost.ratio = props.ghosts[self.duplicate_id].ratio
-        new_ghost.distortion = props.ghosts[self.duplicate_id].distortion
+        bulk.duplicate_ghosts(props, [self.duplicate_id])
 
         return {'FINISHED'}
 
 
-class OGLRenderOperator(bpy.types.Operator):
+class OGLRenderOperator(jobs.ModalJob, bpy.types.Operator):
     bl_label = "Render Lens Flare"
     bl_idname = "render.lens_flare_ogl_render"
     bl_description = "Renders lens flare into selected image"
 
+    job_label = "Lens flare render"
+
     @classmethod
     def poll(cls, context):
         props: MasterProperties = context.scene.lens_flare_props
@@ -150,79 +157,325 @@ class OGLRenderOperator(bpy.types.Operator):
         else:
             return props.image is not None and context.scene.camera is not None
 
-    def execute(self, context):
+    def steps(self, context):
+        """
+        Renders one position with GPU backend or one tile with CPU backend in every step
+        """
         props: MasterProperties = context.scene.lens_flare_props
 
         start_time = time.perf_counter()
 
-        # set values from camera
-        if not props.camera.use_override:
-            camera = context.scene.camera
-            camera = bpy.data.cameras[camera.name]
-            props.camera.rotation = camera.dof.aperture_rotation
-            props.camera.blades = camera.dof.aperture_blades
+        profiling.begin_frame(props.use_profiling)
+        profiler = profiling.active()
 
-        # set values from scene
-        if not props.resolution.override_scene_resolution:
-            props.resolution.resolution_x = context.scene.render.resolution_x * context.scene.render.resolution_percentage / 100
-            props.resolution.resolution_y = context.scene.render.resolution_y * context.scene.render.resolution_percentage / 100
+        with profiler.stage('prepare'):
+            prepare_render(context)
 
-        # load default if none is specified
-        if props.spectrum_image is None:
-            bpy.ops.lens_flare.load_default_spectrum_image()
+        precision_format = ogl.OFFSCREEN_FORMATS[props.precision]
+        if props.backend == 'gpu' and ogl.supported_format(precision_format) != precision_format:
+            self.report({'WARNING'}, f"Lens flare: {precision_format} framebuffers are not supported "
+                                     f"by this Blender version, 8 bit precision is used")
 
-        props.spectrum_image.gl_load()
+        try:
+            with profiler.stage('render'):
+                buffer, draw_calls = yield from render_buffer_steps(context)
+        except BaseException:
+            # cancelled or failed render, GPU queries of unfinished frame are deleted
+            profiling.discard_frame()
+            raise
 
-        if props.debug_pos:
-            buffer, draw_calls = ogl.render_debug_cross(context, props)
-        else:
-            buffer, draw_calls = ogl.render_lens_flare(context, props)
+        # scaling reallocates the image, so only do it when needed
+        if tuple(props.image.size) != (props.resolution.resolution_x, props.resolution.resolution_y):
+            with profiler.stage('scale'):
+                props.image.scale(props.resolution.resolution_x, props.resolution.resolution_y)
+        with profiler.stage('foreach_set'):
+            # half float readback is converted only here
+            props.image.pixels.foreach_set(numpy.asarray(buffer, dtype=numpy.float32))
 
-        props.image.scale(props.resolution.resolution_x, props.resolution.resolution_y)
-        props.image.pixels.foreach_set(buffer)
+        report = profiling.end_frame(context.scene.frame_current)
 
         end_time = time.perf_counter()
         self.report({'INFO'}, f"Lens flare total render time: {end_time - start_time}")
         self.report({'INFO'}, f"Lens flare draw calls: {draw_calls}")
-
-        refresh_compositor()
+        shader_stats = shaders.cache_stats()
+        self.report({'INFO'}, f"Lens flare shader compiles: {shader_stats['compiles']}, cache hits: {shader_stats['hits']}")
+        pool_stats = ogl.OffScreenPool.stats()
+        self.report({'INFO'}, f"Lens flare framebuffer allocations: {pool_stats['allocations']}, "
+                              f"reuses: {pool_stats['hits']}, evictions: {pool_stats['evictions']}")
+        if props.use_incremental:
+            layer_stats = ogl.LayerCache.stats()
+            self.report({'INFO'}, f"Lens flare layers rendered: {layer_stats['rendered']}, reused: {layer_stats['reused']}")
+        if props.use_cache:
+            cache_stats = cache.ResultCache.stats()
+            self.report({'INFO'}, f"Lens flare result cache hits: {cache_stats['hits']}, misses: {cache_stats['misses']}")
+        if report is not None:
+            for name, stage in report['stages'].items():
+                self.report({'INFO'}, f"Lens flare stage {name}: CPU {stage['cpu']}, GPU {stage['gpu']}")
+            if props.profile_path:
+                profiling.write_json(bpy.path.abspath(props.profile_path), [report])
+
+        compositing.refresh_image_users(context.scene, props.image)
 
         return {'FINISHED'}
 
 
-class RenderAnimationOperator(bpy.types.Operator):
+class RenderAnimationOperator(jobs.ModalJob, bpy.types.Operator):
     bl_label = "Render Lens Flare Animation"
     bl_idname = "render.lens_flare_anim"
     bl_description = "Renders animation with lens flare"
 
+    job_label = "Lens flare animation"
+
+    frame_start: bpy.props.IntProperty(default=-1, description="First frame to render, -1 uses scene frame range")
+    frame_end: bpy.props.IntProperty(default=-1, description="Last frame to render, -1 uses scene frame range")
+
     @classmethod
     def poll(cls, context):
-        return bpy.ops.render.lens_flare_ogl_render.poll()
+        return animation_poll(context)
 
-    def execute(self, context):
-        start = context.scene.frame_start
-        end = context.scene.frame_end
-        step = context.scene.frame_step
-        bpy.context.scene.frame_set(start)
+    def steps(self, context):
+        """
+        Renders one frame in every step
+        """
+        props: MasterProperties = context.scene.lens_flare_props
+
+        profiling.clear_history()
 
-        current = bpy.context.scene.frame_current
-        filepath_base = bpy.context.scene.render.filepath
-        bpy.context.scene.render.image_settings.file_format = 'PNG'
+        try:
+            if props.animation.mode == 'flare':
+                return (yield from self.render_flare_only(context))
+            if props.animation.mode == 'direct':
+                return (yield from self.render_direct(context))
+        finally:
+            # cancelled render leaves frame unfinished, its GPU queries are deleted
+            profiling.discard_frame()
 
-        while True:
+        scene = context.scene
+        frames = self.frame_range(scene)
+
+        scene.render.image_settings.file_format = 'PNG'
+
+        for index, current in enumerate(frames):
+            scene.frame_set(current)
             bpy.ops.render.lens_flare_ogl_render()
-            bpy.context.scene.render.filepath = f"{filepath_base}{current}.png"
+            # still is written to output path of current frame, same as `frame_path`
             bpy.ops.render.render(write_still=True)
+            report_frame_finished(current)
+            yield index + 1, len(frames)
+
+        self.report_profile(props)
+
+        return {'FINISHED'}
+
+    def frame_range(self, scene) -> range:
+        """
+        :returns frames to render, scene range can be overridden by operator properties
+        """
+        start = scene.frame_start if self.frame_start == -1 else self.frame_start
+        end = scene.frame_end if self.frame_end == -1 else self.frame_end
+        return range(start, end + 1, scene.frame_step)
+
+    def render_flare_only(self, context):
+        """
+        Renders only the effect and writes it directly to files, scene is not rendered.
+        Frame is written in background while next frame renders.
+        """
+        scene = context.scene
+        props: MasterProperties = scene.lens_flare_props
+        file_format = props.animation.file_format
+
+        extension = '.png' if file_format == 'png16' else '.exr'
+
+        start_time = time.perf_counter()
+        frames = self.frame_range(scene)
+
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            pending = None
+            pending_frame = None
+
+            for index, frame in enumerate(frames):
+                scene.frame_set(frame)
+
+                profiling.begin_frame(props.use_profiling)
+                profiler = profiling.active()
+
+                with profiler.stage('prepare'):
+                    prepare_render(context)
+                with profiler.stage('render'):
+                    buffer, _ = render_buffer(context)
+                width = props.resolution.resolution_x
+                height = props.resolution.resolution_y
+
+                # rendered buffer is reused by next render, writer needs its own copy
+                buffer = buffer.copy()
 
-            bpy.context.scene.frame_set(current + step)
-            current = bpy.context.scene.frame_current
-            if current > end:
-                break
+                # keep at most one frame waiting for write
+                if pending is not None:
+                    with profiler.stage('write_wait'):
+                        pending.result()
+                    report_frame_finished(pending_frame)
 
-        bpy.context.scene.render.filepath = filepath_base
+                path = frame_path(scene, frame, extension)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if file_format == 'png16':
+                    pending = writer.submit(writers.write_png16, path, buffer, width, height)
+                else:
+                    pending = writer.submit(writers.write_exr, path, buffer, width, height, file_format == 'exr_half')
+                pending_frame = frame
+
+                profiling.end_frame(frame)
+                yield index + 1, len(frames)
+
+            if pending is not None:
+                pending.result()
+                report_frame_finished(pending_frame)
+
+        end_time = time.perf_counter()
+        self.report({'INFO'}, f"Lens flare animation: {len(frames)} frames rendered in {end_time - start_time}")
+        self.report_profile(props)
 
         return {'FINISHED'}
 
+    def render_direct(self, context):
+        """
+        Renders scene without compositor, effect is added to every frame in render_post handler
+        """
+        scene = context.scene
+        props: MasterProperties = scene.lens_flare_props
+
+        use_compositing = scene.render.use_compositing
+        scene.render.use_compositing = False
+
+        frames = self.frame_range(scene)
+
+        errors = []
+        try:
+            for index, frame in enumerate(frames):
+                scene.frame_set(frame)
+
+                profiling.begin_frame(props.use_profiling)
+                profiler = profiling.active()
+
+                with profiler.stage('prepare'):
+                    prepare_render(context)
+                with profiler.stage('render'):
+                    buffer, _ = render_buffer(context)
+
+                path = frame_path(scene, frame)
+                # rendered buffer is reused by next render, handler needs its own copy
+                compositing.DirectComposite.queue(path, buffer.copy(), props.resolution.resolution_x,
+                                                  props.resolution.resolution_y)
+                with profiler.stage('scene'):
+                    bpy.ops.render.render()
+
+                profiling.end_frame(frame)
+
+                errors.extend(compositing.DirectComposite.take_errors())
+                report_frame_finished(frame)
+                yield index + 1, len(frames)
+        finally:
+            scene.render.use_compositing = use_compositing
+
+        for error in errors:
+            self.report({'WARNING'}, f"Lens flare: {error}")
+        self.report_profile(props)
+
+        return {'FINISHED'}
+
+    def report_profile(self, props: MasterProperties):
+        """
+        Reports frames over budget and writes profiling history of the animation
+        """
+        if not props.use_profiling:
+            return
+
+        reports = profiling.history()
+        slow_frames = profiling.over_budget(reports, props.frame_budget / 1000)
+        if len(slow_frames) > 0:
+            frame_list = ', '.join(str(report['frame']) for report in slow_frames)
+            self.report({'WARNING'}, f"Lens flare frames over budget: {frame_list}")
+
+        if props.profile_path:
+            profiling.write_json(bpy.path.abspath(props.profile_path), reports)
+
+
+class RenderAnimationFarmOperator(jobs.ModalJob, bpy.types.Operator):
+    bl_label = "Render Animation in Background (CPU)"
+    bl_idname = "render.lens_flare_anim_farm"
+    bl_description = "Renders animation with lens flare on CPU in parallel background Blender processes, " \
+                     "background Blender has no GPU context"
+
+    job_label = "Lens flare background animation"
+
+    @classmethod
+    def poll(cls, context):
+        return animation_poll(context)
+
+    def steps(self, context):
+        """
+        Checks workers in every step, closing the generator kills them
+        """
+        scene = context.scene
+        props: AnimationProperties = scene.lens_flare_props.animation
+
+        directory = tempfile.mkdtemp(prefix='lens_flare_farm_')
+        blend_file = os.path.join(directory, 'scene.blend')
+
+        # workers open the copy from different directory, so output path can't be relative
+        filepath = scene.render.filepath
+        scene.render.filepath = bpy.path.abspath(filepath)
+        try:
+            bpy.ops.wm.save_as_mainfile(filepath=blend_file, copy=True)
+        finally:
+            scene.render.filepath = filepath
+
+        frames = range(scene.frame_start, scene.frame_end + 1, scene.frame_step)
+        scheduler = farm.FrameScheduler(bpy.app.binary_path, blend_file, __package__, frames,
+                                        props.farm_chunk_size, props.farm_workers, props.farm_retries)
+
+        start_time = time.perf_counter()
+        try:
+            while not scheduler.update():
+                yield int(scheduler.progress() * len(frames)), len(frames)
+        finally:
+            scheduler.cancel()
+            shutil.rmtree(directory, ignore_errors=True)
+        end_time = time.perf_counter()
+
+        if len(scheduler.failures) > 0:
+            log_path = os.path.join(os.path.dirname(bpy.path.abspath(filepath)), 'lens_flare_farm.log')
+            write_farm_log(log_path, scheduler.failures)
+            for chunk, code, _ in scheduler.failures:
+                self.report({'ERROR'}, f"Lens flare frames {chunk.start}-{chunk.end} failed with exit code {code}")
+            self.report({'ERROR'}, f"Lens flare animation: {len(scheduler.failures)} chunks failed, see {log_path}")
+            return {'CANCELLED'}
+
+        self.report({'INFO'}, f"Lens flare animation: {len(frames)} frames rendered in {end_time - start_time}")
+
+        return {'FINISHED'}
+
+
+def animation_poll(context) -> bool:
+    """
+    Scene mode renders into selected image, other modes only need camera
+    """
+    props: MasterProperties = context.scene.lens_flare_props
+    if props.animation.mode == 'scene':
+        return bpy.ops.render.lens_flare_ogl_render.poll()
+    return props.camera.use_override or context.scene.camera is not None
+
+
+def write_farm_log(path: str, failures: list):
+    """
+    Writes output of failed worker chunks to file
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file:
+        for chunk, code, output in failures:
+            file.write(f"Lens flare frames {chunk.start}-{chunk.end} failed with exit code {code}:\n")
+            file.write("\n".join(output))
+            file.write("\n\n")
+
 
 class LoadDefaultSpectrumImageOperator(bpy.types.Operator):
     bl_label = "Load Default Spectrum Image"
@@ -234,20 +487,113 @@ class LoadDefaultSpectrumImageOperator(bpy.types.Operator):
 
         img_path = os.path.join(os.path.dirname(__file__), 'images/spectral.png')
         spectral_img = bpy.data.images.load(img_path, check_existing=True)
-        spectral_img.gl_load()
         props.spectrum_image = spectral_img
 
         return {'FINISHED'}
 
 
 # Operator helpers
-def refresh_compositor():
+def prepare_render(context):
+    """
+    Copies settings from camera and scene to properties and loads default spectrum image if needed
     """
-    Quick and dirty way to refresh compositor. Adds new node and immediately removes it.
+    props: MasterProperties = context.scene.lens_flare_props
+
+    copy_scene_settings(context)
+
+    # load default if none is specified
+    if props.spectrum_image is None:
+        bpy.ops.lens_flare.load_default_spectrum_image()
+
+    ogl.OffScreenPool.set_budget(props.offscreen_budget)
+
+
+def copy_scene_settings(context):
     """
-    tree = bpy.context.scene.node_tree
-    # if user does not have any nodes, no need to refresh, also,
-    if tree is None:
-        return
-    node = tree.nodes.new(type='CompositorNodeRGB')
-    tree.nodes.remove(node)
+    Copies settings from camera and scene to properties, values are written only when they differ,
+    so unchanged properties are not tagged as updated
+    """
+    props: MasterProperties = context.scene.lens_flare_props
+
+    # set values from camera
+    if not props.camera.use_override and context.scene.camera is not None:
+        camera = context.scene.camera
+        camera = bpy.data.cameras[camera.name]
+        if props.camera.rotation != camera.dof.aperture_rotation:
+            props.camera.rotation = camera.dof.aperture_rotation
+        if props.camera.blades != camera.dof.aperture_blades:
+            props.camera.blades = camera.dof.aperture_blades
+
+    # set values from scene
+    if not props.resolution.override_scene_resolution:
+        resolution_x = int(context.scene.render.resolution_x * context.scene.render.resolution_percentage / 100)
+        resolution_y = int(context.scene.render.resolution_y * context.scene.render.resolution_percentage / 100)
+        if props.resolution.resolution_x != resolution_x:
+            props.resolution.resolution_x = resolution_x
+        if props.resolution.resolution_y != resolution_y:
+            props.resolution.resolution_y = resolution_y
+
+
+def render_buffer(context):
+    """
+    Renders effect with selected backend, cached image is used if nothing changed
+    :returns buffer with effect and draw call count, buffer must not be modified
+    """
+    return jobs.run_steps(render_buffer_steps(context))
+
+
+def render_buffer_steps(context):
+    """
+    Same as `render_buffer`, but GPU backend renders one position and CPU backend one tile in every step
+    :yields number of finished and all steps
+    """
+    props: MasterProperties = context.scene.lens_flare_props
+
+    if props.backend == 'cpu':
+        renderer = cpu
+    else:
+        renderer = ogl
+
+    buffer = None
+    draw_calls = 0
+
+    if props.use_cache:
+        cache.ResultCache.configure(props.cache_memory, props.cache_directory)
+        cache_key = cache.render_key(context, props)
+        buffer = cache.ResultCache.get(cache_key)
+
+    if buffer is None:
+        if props.debug_pos:
+            buffer, draw_calls = renderer.render_debug_cross(context, props)
+        elif renderer is ogl:
+            signatures = cache.position_signatures(context, props) if props.use_incremental else None
+            buffer, draw_calls = yield from ogl.render_lens_flare_steps(context, props, signatures)
+        else:
+            buffer, draw_calls = yield from cpu.render_lens_flare_steps(context, props)
+
+        profiling.active().count('draw_calls', draw_calls)
+
+        if props.use_cache:
+            cache.ResultCache.put(cache_key, buffer)
+
+    return buffer, draw_calls
+
+
+def frame_path(scene, frame: int, extension: str = None) -> str:
+    """
+    Output path of frame, `#` padding and file extension settings of scene apply, like in Blender animation render
+    :param extension replaces extension of scene file format
+    """
+    path = scene.render.frame_path(frame=frame)
+    if extension is not None and scene.render.use_file_extension:
+        path = path[:len(path) - len(scene.render.file_extension)] + extension
+    return path
+
+
+def report_frame_finished(frame: int):
+    """
+    Prints progress line, which is parsed by background render scheduler
+    """
+    print(f"Lens flare frame {frame} finished", flush=True)
+
+
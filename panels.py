@@ -1,8 +1,11 @@
 import bpy.types
 
 from .properties import *
+from . import profiling
 
 previews = {}
+# colors written to ghost icons, keyed by preview name
+icon_colors = {}
 
 
 class MainSettingsPanel(bpy.types.Panel):
@@ -12,9 +15,6 @@ class MainSettingsPanel(bpy.types.Panel):
     bl_region_type = 'UI'
     bl_category = 'Lens Flares'
 
-    def __init__(self):
-        regenerate_ghost_icons()
-
     def draw(self, context):
         layout = self.layout
         layout.use_property_split = True
@@ -27,6 +27,10 @@ class MainSettingsPanel(bpy.types.Panel):
         row = layout.row()
         row.operator('render.lens_flare_anim', icon='RENDER_ANIMATION')
 
+        row = layout.row(align=True)
+        row.prop(props, 'show_preview', text='Live Preview', toggle=True, icon='HIDE_OFF')
+        row.prop(props, 'preview_scale', text='Scale')
+
         row = layout.row()
         row.template_ID(props, 'image', new="image.new", text='Output Image')
 
@@ -111,6 +115,33 @@ class ResolutionPanel(bpy.types.Panel):
         col.prop(props, "resolution_y", text="Y")
 
 
+class AnimationPanel(bpy.types.Panel):
+    bl_label = "Animation"
+    bl_idname = "LF_PT_AnimationSettings"
+    bl_space_type = 'NODE_EDITOR'
+    bl_region_type = 'UI'
+    bl_category = 'Lens Flares'
+    bl_options = {'DEFAULT_CLOSED'}
+
+    def draw(self, context):
+        layout = self.layout
+        layout.use_property_split = True
+
+        props: AnimationProperties = context.scene.lens_flare_props.animation
+
+        layout.prop(props, 'mode', text='Mode', expand=True)
+
+        col = layout.column(align=True)
+        col.enabled = props.mode == 'flare'
+        col.prop(props, 'file_format', text='File Format')
+
+        col = layout.column(align=True)
+        col.prop(props, 'farm_workers', text='Workers')
+        col.prop(props, 'farm_chunk_size', text='Chunk Size')
+        col.prop(props, 'farm_retries', text='Retries')
+        layout.operator('render.lens_flare_anim_farm')
+
+
 class FlareSettingsPanel(bpy.types.Panel):
     bl_label = "Flare"
     bl_idname = "LF_PT_FlareSettings"
@@ -141,7 +172,7 @@ class GhostsUiList(bpy.types.UIList):
     bl_idname = "LF_UL_Ghosts"
 
     def draw_item(self, context, layout, data, item, icon, active_data, active_property, index=0, flt_flag=0):
-        icon = previews['ghosts'][str(index)].icon_id
+        icon = ghost_icon(index, item.color)
         if self.layout_type in {'DEFAULT', 'COMPACT'}:
             layout.label(text=item.name, icon_value=icon)
         else:
@@ -167,6 +198,10 @@ class GhostsPanel(bpy.types.Panel):
 
         layout.use_property_split = False
 
+        # icons of removed ghosts, also after undo or file load
+        if len(previews['ghosts']) > len(props.ghosts):
+            prune_ghost_icons(len(props.ghosts))
+
         row.template_list("LF_UL_Ghosts", "", props, "ghosts", props, "selected_ghost", rows=3)
 
         # ghost adding and removal
@@ -253,12 +288,42 @@ class MiscPanel(bpy.types.Panel):
         layout.use_property_split = True
         props = context.scene.lens_flare_props
 
+        layout.prop(props, 'backend', text='Backend', expand=True)
+
+        if props.backend == 'cpu':
+            col = layout.column(align=True)
+            col.prop(props, 'cpu_tile_size', text='Tile Size')
+            col.prop(props, 'cpu_workers', text='Workers')
+            layout.prop(props, 'cpu_pool', text='Worker Pool', expand=True)
+
         col = layout.column(align=True)
         col.prop(props, 'dispersion_samples', text='Dispersion Samples')
+        col.prop(props, 'use_adaptive_samples', text='Adaptive Samples')
 
         col = layout.column(align=True)
         col.prop(props, 'use_jitter', text='Use Jitter')
 
+        layout.prop(props, 'ghost_rendering', text='Ghost Rendering', expand=True)
+        layout.prop(props, 'ghost_resolution', text='Ghost Resolution', expand=True)
+        layout.prop(props, 'use_incremental', text='Incremental Rendering')
+        layout.prop(props, 'precision', text='Precision', expand=True)
+        layout.prop(props, 'use_half_readback', text='Half Float Readback')
+
+        col = layout.column(align=True)
+        col.prop(props, 'offscreen_budget', text='Framebuffer Budget (MB)')
+
+        col = layout.column(align=True)
+        col.prop(props, 'use_cache', text='Cache Results')
+        sub = col.column(align=True)
+        sub.enabled = props.use_cache
+        sub.prop(props, 'cache_memory', text='Cache Memory (MB)')
+        sub.prop(props, 'cache_directory', text='Cache Directory')
+
+        col = layout.column(align=True)
+        col.prop(props, 'noise_seed', text='Noise Seed')
+        col.prop(props, 'noise_resolution', text='Resolution')
+        col.prop(props, 'noise_type', text='Type')
+
         row = layout.row()
         row.prop(props, 'spectrum_image', text='Spectrum Image')
         row.operator('lens_flare.load_default_spectrum_image', text='', icon='FILE_IMAGE')
@@ -266,14 +331,60 @@ class MiscPanel(bpy.types.Panel):
         col = layout.column(align=True)
         col.prop(props, 'debug_pos', text='Render Debug Cross')
 
+        col = layout.column(align=True)
+        col.prop(props, 'use_profiling', text='Profiling')
+        sub = col.column(align=True)
+        sub.enabled = props.use_profiling
+        sub.prop(props, 'profile_path', text='Report')
+        sub.prop(props, 'frame_budget', text='Frame Budget (ms)')
+
+        report = profiling.last_report()
+        if props.use_profiling and report is not None:
+            box = layout.box()
+            box.label(text=f"Total: {report['total'] * 1000:.2f} ms")
+            for name, stage in report['stages'].items():
+                gpu_time = '-' if stage['gpu'] is None else f"{stage['gpu'] * 1000:.2f}"
+                box.label(text=f"{name} ({stage['count']}x): CPU {stage['cpu'] * 1000:.2f} ms, GPU {gpu_time} ms")
+            for name, value in report['counters'].items():
+                box.label(text=f"{name}: {value}")
+
+
+def ghost_icon(index: int, color) -> int:
+    """
+    Creates icon of ghost on first use, pixels are written only when color changed
+    :returns icon id
+    """
+    name = str(index)
+    color = tuple(color)
+
+    if name in previews['ghosts']:
+        icon: bpy.types.ImagePreview = previews['ghosts'][name]
+    else:
+        icon: bpy.types.ImagePreview = previews['ghosts'].new(name)
+        icon.icon_size = [2, 2]
 
-def regenerate_ghost_icons():
-    props = bpy.context.scene.lens_flare_props
+    if icon_colors.get(name) != color:
+        icon.icon_pixels_float = [*color, 1.0] * 4
+        icon_colors[name] = color
 
-    for i, ghost in enumerate(props.ghosts):
-        if str(i) in previews['ghosts']:
-            icon: bpy.types.ImagePreview = previews['ghosts'][str(i)]
-        else:
-            icon: bpy.types.ImagePreview = previews['ghosts'].new(str(i))
-        icon.icon_size = [2, 2]
-        icon.icon_pixels_float = [ghost.color.r, ghost.color.g, ghost.color.b, 1.0] * 4
+    return icon.icon_id
+
+
+def prune_ghost_icons(count: int):
+    """
+    Removes icons of deleted ghosts
+    :param count number of ghosts
+    """
+    for name in [name for name in previews['ghosts'] if int(name) >= count]:
+        del previews['ghosts'][name]
+        icon_colors.pop(name, None)
+
+
+def tag_redraw(context):
+    """
+    Redraws all node editors, add-on UI and preview live there
+    """
+    for window in context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == 'NODE_EDITOR':
+                area.tag_redraw()
@@ -0,0 +1,230 @@
+import time
+
+import bgl
+import bpy
+import gpu
+from bpy.app.handlers import persistent
+from gpu_extras.batch import batch_for_shader
+
+from . import cache
+from . import ogl
+from . import tracking
+from .operators import copy_scene_settings
+from .panels import tag_redraw
+
+# seconds between checks of changed properties
+POLL_INTERVAL = 0.1
+# seconds without change before fast preview is rendered
+DEBOUNCE_DELAY = 0.15
+# seconds without change before preview is refined to full quality
+REFINE_DELAY = 0.75
+# limits of fast preview
+FAST_GHOST_DIVISOR = 4
+FAST_MAX_SAMPLES = 8
+# gap between preview and region border in pixels
+MARGIN = 20
+
+
+class Preview:
+    """
+    Live preview of the effect in compositor node editor.
+    Properties are polled by timer, after a change fast preview is rendered, when user stops editing,
+    it is refined to full quality. Preview is rendered and drawn on GPU, so no pixels are read back.
+    """
+    __handler = None
+    __offscreen = None
+    __size = (0, 0)
+    __format = None
+    # render key of last seen properties and time of its change
+    __key = None
+    __changed_at = 0.0
+    # tracking generation and frame, for which render key was computed
+    __seen = (None, None)
+    # undo, redo and file load change properties without update callbacks, so tracking generation stays the same
+    __handlers = (bpy.app.handlers.load_post, bpy.app.handlers.undo_post, bpy.app.handlers.redo_post)
+    # render key and quality of preview in offscreen
+    __rendered = (None, None)
+    # quality requested from draw callback
+    __requested = None
+
+    @classmethod
+    def register(cls):
+        cls.__handler = bpy.types.SpaceNodeEditor.draw_handler_add(cls.draw, (), 'WINDOW', 'POST_PIXEL')
+        bpy.app.timers.register(cls.poll, first_interval=POLL_INTERVAL, persistent=True)
+        for handlers in cls.__handlers:
+            if cls.forget not in handlers:
+                handlers.append(cls.forget)
+
+    @classmethod
+    def unregister(cls):
+        for handlers in cls.__handlers:
+            if cls.forget in handlers:
+                handlers.remove(cls.forget)
+        if bpy.app.timers.is_registered(cls.poll):
+            bpy.app.timers.unregister(cls.poll)
+        if cls.__handler is not None:
+            bpy.types.SpaceNodeEditor.draw_handler_remove(cls.__handler, 'WINDOW')
+            cls.__handler = None
+        cls.free()
+
+    @classmethod
+    def free(cls):
+        if cls.__offscreen is not None:
+            ogl.OffScreenPool.release(cls.__offscreen)
+        cls.__offscreen = None
+        cls.__size = (0, 0)
+        cls.__format = None
+        cls.__rendered = (None, None)
+        cls.__requested = None
+
+    @staticmethod
+    @persistent
+    def forget(*args):
+        """
+        Handler of undo, redo and file load, render key is computed again on next poll
+        """
+        Preview.__seen = (None, None)
+
+    @classmethod
+    def poll(cls) -> float:
+        """
+        Timer callback, decides when preview has to be rendered
+        :returns seconds to next call
+        """
+        context = bpy.context
+        scene = context.scene
+        if scene is None or not hasattr(scene, 'lens_flare_props'):
+            return POLL_INTERVAL
+
+        props = scene.lens_flare_props
+        if not props.show_preview or props.spectrum_image is None:
+            return POLL_INTERVAL
+
+        copy_scene_settings(context)
+
+        now = time.perf_counter()
+        key = cls.__key
+        # hashing of all properties is skipped, when nothing was edited,
+        # animation and moving objects can change image without edit
+        seen = (tracking.generation(), scene.frame_current)
+        if key is None or seen != cls.__seen or uses_objects(props):
+            key = cache.render_key(context, props) + str(props.preview_scale)
+            cls.__seen = seen
+
+        if key != cls.__key:
+            cls.__key = key
+            cls.__changed_at = now
+
+        rendered_key, rendered_quality = cls.__rendered
+        idle = now - cls.__changed_at
+
+        requested = None
+        if rendered_key != key or rendered_quality != 'full':
+            if idle >= REFINE_DELAY:
+                requested = 'full'
+            elif rendered_key != key and idle >= DEBOUNCE_DELAY:
+                requested = 'fast'
+
+        if requested is not None and requested != cls.__requested:
+            cls.__requested = requested
+            tag_redraw(context)
+
+        return POLL_INTERVAL
+
+    @classmethod
+    def draw(cls):
+        """
+        Draw callback of node editor, renders requested preview and draws it into region
+        """
+        context = bpy.context
+        space = context.space_data
+        if space is None or space.tree_type != 'CompositorNodeTree':
+            return
+
+        props = context.scene.lens_flare_props
+        if not props.show_preview or props.spectrum_image is None:
+            cls.free()
+            return
+
+        if cls.__requested is not None:
+            cls.render(context, props, cls.__requested)
+            cls.__rendered = (cls.__key, cls.__requested)
+            cls.__requested = None
+
+        if cls.__offscreen is not None:
+            draw_texture(context.region, cls.__offscreen.color_texture, *cls.__size)
+
+    @classmethod
+    def render(cls, context, props, quality: str):
+        settings = preview_settings(props, quality)
+        size = (settings.width, settings.height)
+
+        if cls.__size != size or cls.__format != settings.format:
+            cls.free()
+            cls.__offscreen = ogl.OffScreenPool.acquire(settings.width, settings.height, settings.format)
+            cls.__size = size
+            cls.__format = settings.format
+
+        # region drawing can leave scissor test enabled, it would clip offscreen rendering
+        scissor = bgl.glIsEnabled(bgl.GL_SCISSOR_TEST)
+        bgl.glDisable(bgl.GL_SCISSOR_TEST)
+
+        ogl.render_to_offscreen(context, props, cls.__offscreen, settings)
+
+        bgl.glDisable(bgl.GL_BLEND)
+        if scissor:
+            bgl.glEnable(bgl.GL_SCISSOR_TEST)
+
+
+def preview_settings(props, quality: str) -> ogl.RenderSettings:
+    """
+    :param quality 'fast' or 'full'
+    :returns reduced resolution settings of preview
+    """
+    scale = props.preview_scale / 100
+    settings = ogl.render_settings(props)
+
+    width = max(int(settings.width * scale), 1)
+    height = max(int(settings.height * scale), 1)
+
+    if quality == 'fast':
+        return settings._replace(
+            width=width,
+            height=height,
+            ghost_divisor=max(settings.ghost_divisor, FAST_GHOST_DIVISOR),
+            max_samples=min(settings.max_samples, FAST_MAX_SAMPLES),
+        )
+
+    return settings._replace(width=width, height=height)
+
+
+def draw_texture(region, texture: int, width: int, height: int):
+    """
+    Draws texture into bottom left corner of region, it is scaled down to fit
+    """
+    fit = min((region.width - 2 * MARGIN) / width, (region.height - 2 * MARGIN) / height, 1.0)
+    if fit <= 0.0:
+        return
+
+    x0, y0 = MARGIN, MARGIN
+    x1, y1 = MARGIN + width * fit, MARGIN + height * fit
+
+    shader = gpu.shader.from_builtin('2D_IMAGE')
+    batch = batch_for_shader(shader, 'TRI_FAN', {
+        "pos": ((x0, y0), (x1, y0), (x1, y1), (x0, y1)),
+        "texCoord": ((0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 1.0)),
+    })
+
+    bgl.glActiveTexture(bgl.GL_TEXTURE0)
+    bgl.glBindTexture(bgl.GL_TEXTURE_2D, texture)
+
+    shader.bind()
+    shader.uniform_int("image", 0)
+    batch.draw(shader)
+
+
+def uses_objects(props) -> bool:
+    """
+    :returns True, when any position is set from object
+    """
+    return any(position.variant == 'auto' and position.auto_object is not None for position in props.positions)
@@ -0,0 +1,251 @@
+import json
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import List, Optional
+
+# GL_TIME_ELAPSED is missing in some bgl versions
+GL_TIME_ELAPSED = 0x88BF
+
+# number of frames kept in history
+HISTORY_LENGTH = 1000
+
+
+class Profiler:
+    """
+    Measures CPU and GPU time of render stages.
+    GPU time is measured with timer queries, which can't be nested, so only outermost GPU stage gets GPU time.
+    """
+    def __init__(self, use_gpu: bool = True):
+        self.records = []
+        self.counters = {}
+        self.__use_gpu = use_gpu and _timer_queries_supported()
+        self.__gpu_active = False
+        self.__start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str, position: int = None, ghost: int = None, gpu: bool = False):
+        """
+        Measures time of code in `with` block
+        :param position index of position, the stage belongs to
+        :param ghost index of ghost, the stage belongs to
+        :param gpu measure also GPU time
+        """
+        record = {
+            "stage": name,
+            "position": position,
+            "ghost": ghost,
+            "cpu": 0.0,
+            "gpu": None,
+        }
+
+        query = None
+        if gpu and self.__use_gpu and not self.__gpu_active:
+            query = _begin_query()
+            self.__gpu_active = True
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record["cpu"] = time.perf_counter() - start
+
+            if query is not None:
+                _end_query()
+                self.__gpu_active = False
+                # result is read at the end of frame, so GPU is not stalled
+                record["gpu"] = query
+
+            self.records.append(record)
+
+    def count(self, name: str, value: int = 1):
+        """
+        Adds value to named counter
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self) -> dict:
+        """
+        Reads GPU results and aggregates records by stage, position and ghost
+        :returns report with times in seconds
+        """
+        for record in self.records:
+            query = record["gpu"]
+            if query is not None and not isinstance(query, float):
+                record["gpu"] = _query_result(query)
+
+        report = {
+            "total": time.perf_counter() - self.__start,
+            "stages": _aggregate(self.records, "stage"),
+            "positions": _aggregate([record for record in self.records if record["position"] is not None], "position"),
+            "ghosts": _aggregate([record for record in self.records if record["ghost"] is not None], "ghost"),
+            "counters": dict(self.counters),
+        }
+
+        return report
+
+    def discard(self):
+        """
+        Deletes GPU queries, which were not read by `report`
+        """
+        for record in self.records:
+            query = record["gpu"]
+            if query is not None and not isinstance(query, float):
+                _delete_query(query)
+                record["gpu"] = None
+
+
+class NullProfiler:
+    """
+    Profiler used when profiling is disabled, does nothing
+    """
+    records = []
+    counters = {}
+
+    @contextmanager
+    def stage(self, name: str, position: int = None, ghost: int = None, gpu: bool = False):
+        yield
+
+    def count(self, name: str, value: int = 1):
+        pass
+
+    def report(self) -> Optional[dict]:
+        return None
+
+    def discard(self):
+        pass
+
+
+_null_profiler = NullProfiler()
+_profiler = _null_profiler
+_history = deque(maxlen=HISTORY_LENGTH)
+
+
+def begin_frame(enabled: bool, use_gpu: bool = True):
+    """
+    Starts profiling of new frame, stages are recorded by profiler returned from `active`
+    """
+    global _profiler
+    # frame, which was not finished, is dropped
+    _profiler.discard()
+    _profiler = Profiler(use_gpu) if enabled else _null_profiler
+
+
+def end_frame(frame: int = None) -> Optional[dict]:
+    """
+    Finishes profiling of frame and adds its report to history
+    :returns report or None, when profiling is disabled
+    """
+    global _profiler
+    report = _profiler.report()
+    _profiler = _null_profiler
+
+    if report is not None:
+        report["frame"] = frame
+        _history.append(report)
+
+    return report
+
+
+def discard_frame():
+    """
+    Drops unfinished frame without report, used when render is cancelled
+    """
+    global _profiler
+    _profiler.discard()
+    _profiler = _null_profiler
+
+
+def active():
+    """
+    :returns profiler of current frame
+    """
+    return _profiler
+
+
+def last_report() -> Optional[dict]:
+    if len(_history) == 0:
+        return None
+    return _history[-1]
+
+
+def history() -> List[dict]:
+    return list(_history)
+
+
+def clear_history():
+    _history.clear()
+
+
+def over_budget(reports: List[dict], budget: float) -> List[dict]:
+    """
+    :param budget time in seconds
+    :returns reports of frames, which took longer than budget
+    """
+    return [report for report in reports if report["total"] > budget]
+
+
+def write_json(path: str, reports: List[dict]):
+    with open(path, 'w') as file:
+        json.dump(reports, file, indent=2)
+
+
+def _aggregate(records: List[dict], key: str) -> dict:
+    """
+    Sums times of records grouped by key
+    """
+    groups = {}
+
+    for record in records:
+        group = groups.setdefault(str(record[key]), {"count": 0, "cpu": 0.0, "gpu": None})
+        group["count"] += 1
+        group["cpu"] += record["cpu"]
+        if record["gpu"] is not None:
+            group["gpu"] = (group["gpu"] or 0.0) + record["gpu"]
+
+    return groups
+
+
+def _timer_queries_supported() -> bool:
+    try:
+        import bgl
+    except ImportError:
+        return False
+    return hasattr(bgl, 'glBeginQuery') and hasattr(bgl, 'glGetQueryObjectuiv')
+
+
+def _begin_query():
+    import bgl
+
+    query = bgl.Buffer(bgl.GL_INT, 1)
+    bgl.glGenQueries(1, query)
+    bgl.glBeginQuery(getattr(bgl, 'GL_TIME_ELAPSED', GL_TIME_ELAPSED), query[0])
+
+    return query
+
+
+def _end_query():
+    import bgl
+
+    bgl.glEndQuery(getattr(bgl, 'GL_TIME_ELAPSED', GL_TIME_ELAPSED))
+
+
+def _query_result(query) -> float:
+    """
+    Waits for query result and deletes query
+    :returns time in seconds
+    """
+    import bgl
+
+    result = bgl.Buffer(bgl.GL_INT, 1)
+    bgl.glGetQueryObjectuiv(query[0], bgl.GL_QUERY_RESULT, result)
+    _delete_query(query)
+
+    # nanoseconds are stored as unsigned value
+    return (result[0] & 0xffffffff) / 1e9
+
+
+def _delete_query(query):
+    import bgl
+
+    bgl.glDeleteQueries(1, query)
@@ -1,4 +1,5 @@
 import bpy
+import bpy_extras
 from bpy.props import \
     FloatProperty,\
     FloatVectorProperty,\
@@ -8,18 +9,14 @@ from bpy.props import \
     IntProperty,\
     CollectionProperty,\
     EnumProperty
-from .panels import regenerate_ghost_icons
+from mathutils import Vector
+from . import tracking
 
-
-def get_ghost_color(self):
-    if 'color' not in self:
-        self['color'] = [0.9, 0.9, 0.9]
-    return self['color']
-
-
-def set_ghost_color(self, value):
-    self['color'] = value
-    regenerate_ghost_icons()
+update_master = tracking.updater('master')
+update_ghost = tracking.updater('ghosts')
+update_flare = tracking.updater('flare')
+update_camera = tracking.updater('camera')
+update_position = tracking.updater('positions')
 
 
 class GhostProperties(bpy.types.PropertyGroup):
@@ -29,6 +26,7 @@ class GhostProperties(bpy.types.PropertyGroup):
         default=0.0,
         soft_min=-1.0,
         soft_max=1.0,
+        update=update_ghost,
     )
     perpendicular_offset: FloatProperty(
         name="Offset",
@@ -36,6 +34,7 @@ class GhostProperties(bpy.types.PropertyGroup):
         default=0.0,
         soft_min=-1.0,
         soft_max=1.0,
+        update=update_ghost,
     )
     color: FloatVectorProperty(
         name="Color",
@@ -45,14 +44,15 @@ class GhostProperties(bpy.types.PropertyGroup):
         size=3,
         min=0.0,
         soft_max=1.0,
-        get=get_ghost_color,
-        set=set_ghost_color,
+        # no getter and setter, so bulk access stays in C, icons are updated by ghost list on redraw
+        update=update_ghost,
     )
     size: FloatProperty(
         name="Size",
         description="Ghost Size",
         default=5.0,
         min=0.0,
+        update=update_ghost,
     )
     name: StringProperty(
         name="Name",
@@ -65,12 +65,14 @@ class GhostProperties(bpy.types.PropertyGroup):
         default=0.0,
         min=0.0,
         max=18.0,
+        update=update_ghost,
     )
     intensity: FloatProperty(
         name="Ghost Intensity",
         description="Intensity of the ghost artifact",
         default=1.0,
         min=0.0,
+        update=update_ghost,
     )
     dispersion: FloatProperty(
         name="Ghost dispersion",
@@ -78,6 +80,7 @@ class GhostProperties(bpy.types.PropertyGroup):
         default=0.0,
         min=-1.0,
         max=1.0,
+        update=update_ghost,
     )
     dispersion_center: EnumProperty(
         items=[("image", "Image", "Ghost will be dispersed from image center"),
@@ -85,6 +88,7 @@ class GhostProperties(bpy.types.PropertyGroup):
         name="Dispersion Center",
         description="Sets center of dispersion effect",
         default="image",
+        update=update_ghost,
     )
     ratio: FloatProperty(
         name="Aspect Ratio",
@@ -94,6 +98,7 @@ class GhostProperties(bpy.types.PropertyGroup):
         max=100000000,
         soft_min=0.5,
         soft_max=2.0,
+        update=update_ghost,
     )
     distortion: FloatProperty(
         name="Ghost distortion",
@@ -101,6 +106,7 @@ class GhostProperties(bpy.types.PropertyGroup):
         default=0.0,
         min=0.0,
         max=1.0,
+        update=update_ghost,
     )
 
 
@@ -113,30 +119,35 @@ class FlareProperties(bpy.types.PropertyGroup):
         size=3,
         min=0.0,
         soft_max=1.0,
+        update=update_flare,
     )
     size: FloatProperty(
         name="Flare Size",
         description="Flare size relative to image size",
         default=10.0,
         min=0.0,
+        update=update_flare,
     )
     intensity: FloatProperty(
         name="Flare Intensity",
         description="Intensity of flare effect",
         default=1.0,
         min=0.0,
+        update=update_flare,
     )
     rays_intensity: FloatProperty(
         name="Rays Intensity",
         description="Intensity of ray effect",
         default=1.0,
         min=0.0,
+        update=update_flare,
     )
     # alternative style
     anamorphic: BoolProperty(
         name="Anamorphic Flare",
         description="Use anamorphic style of flare",
         default=False,
+        update=update_flare,
     )
 
 
@@ -162,11 +173,13 @@ class CameraProperties(bpy.types.PropertyGroup):
         name="Anamorphic Lens",
         description="Use anamorphic rays and flare",
         default=False,
+        update=update_camera,
     )
     use_override: bpy.props.BoolProperty(
         name="Camera Override",
         description="Use custom camera properties",
         default=False,
+        update=update_camera,
     )
     blades: bpy.props.IntProperty(
         name="Aperture Blades",
@@ -176,6 +189,7 @@ class CameraProperties(bpy.types.PropertyGroup):
         max=16,
         get=get_blades,
         set=set_blades,
+        update=update_camera,
     )
     rotation: bpy.props.FloatProperty(
         name="Aperture Rotation",
@@ -185,6 +199,7 @@ class CameraProperties(bpy.types.PropertyGroup):
         unit='ROTATION',
         min=-3.14159,
         max=3.14159,
+        update=update_camera,
     )
 
 
@@ -193,6 +208,7 @@ class ResolutionProperties(bpy.types.PropertyGroup):
         name="Resolution override",
         description="Use custom resolution for effect",
         default=False,
+        update=update_master,
     )
     resolution_x: IntProperty(
         name="Resolution X",
@@ -200,6 +216,7 @@ class ResolutionProperties(bpy.types.PropertyGroup):
         default=1280,
         min=0,
         subtype='PIXEL',
+        update=update_master,
     )
     resolution_y: IntProperty(
         name="Resolution Y",
@@ -207,6 +224,7 @@ class ResolutionProperties(bpy.types.PropertyGroup):
         default=720,
         min=0,
         subtype='PIXEL',
+        update=update_master,
     )
 
 
@@ -222,6 +240,7 @@ class PositionProperties(bpy.types.PropertyGroup):
         name="Position Variant",
         description="Sets center of flare effect",
         default="auto",
+        update=update_position,
     )
     manual_x: FloatProperty(
         name="X",
@@ -229,6 +248,7 @@ class PositionProperties(bpy.types.PropertyGroup):
         default=0.5,
         soft_min=0.0,
         soft_max=1.0,
+        update=update_position,
     )
     manual_y: FloatProperty(
         name="Y",
@@ -236,11 +256,65 @@ class PositionProperties(bpy.types.PropertyGroup):
         default=0.5,
         soft_min=0.0,
         soft_max=1.0,
+        update=update_position,
     )
     auto_object: PointerProperty(
         name="Position Object",
         description="Use this object as position",
         type=bpy.types.Object,
+        update=update_position,
+    )
+
+    def screen_position(self, scene):
+        """
+        :returns position of effect in normalized image coordinates
+        """
+        pos = Vector((self.manual_x, self.manual_y, 0.0))
+
+        # set position from object
+        if self.variant == 'auto' and self.auto_object is not None:
+            world_pos = self.auto_object.matrix_world.to_translation()
+            pos = bpy_extras.object_utils.world_to_camera_view(scene, scene.camera, world_pos)
+
+        return pos
+
+
+class AnimationProperties(bpy.types.PropertyGroup):
+    mode: EnumProperty(
+        items=[("scene", "Scene", "Renders whole scene with effect in compositor for every frame"),
+            ("flare", "Flare Only", "Renders only the effect and writes it directly to files"),
+            ("direct", "Direct", "Renders scene without compositor and adds effect directly to every rendered frame")],
+        name="Animation Mode",
+        description="Sets what is rendered in animation",
+        default="scene",
+    )
+    file_format: EnumProperty(
+        items=[("exr_half", "OpenEXR Half", "Multilayer OpenEXR with half float channels"),
+            ("exr_float", "OpenEXR Float", "Multilayer OpenEXR with full float channels"),
+            ("png16", "PNG 16 bit", "16 bit RGBA PNG in sRGB color space")],
+        name="File Format",
+        description="File format of effect-only animation",
+        default="exr_half",
+    )
+    farm_workers: IntProperty(
+        name="Workers",
+        description="Number of background Blender processes rendering animation in parallel with CPU backend",
+        default=2,
+        min=1,
+        max=64,
+    )
+    farm_chunk_size: IntProperty(
+        name="Chunk Size",
+        description="Number of frames rendered by one background process",
+        default=10,
+        min=1,
+    )
+    farm_retries: IntProperty(
+        name="Retries",
+        description="How many times are frames of failed process rendered again",
+        default=2,
+        min=0,
+        max=10,
     )
 
 
@@ -264,6 +338,7 @@ class MasterProperties(bpy.types.PropertyGroup):
         description="Scales total effect intensity",
         default=1.0,
         min=0.0,
+        update=update_master,
     )
     # quality control
     dispersion_samples: IntProperty(
@@ -272,6 +347,145 @@ class MasterProperties(bpy.types.PropertyGroup):
         default=16,
         min=1,
         max=1024,
+        update=update_master,
+    )
+    use_adaptive_samples: BoolProperty(
+        name="Adaptive Dispersion Samples",
+        description="Chooses dispersion sample count of every ghost from its dispersion and size, "
+                    "dispersion samples setting is the upper limit",
+        default=False,
+        update=update_master,
+    )
+    offscreen_budget: IntProperty(
+        name="Framebuffer Memory Budget",
+        description="Memory in megabytes kept for reusing framebuffers between renders",
+        default=512,
+        min=0,
+        subtype='UNSIGNED',
+    )
+    # result cache
+    use_cache: BoolProperty(
+        name="Cache Results",
+        description="Reuse rendered images when no setting or position changed",
+        default=False,
+    )
+    cache_memory: IntProperty(
+        name="Cache Memory",
+        description="Memory in megabytes used for cached images",
+        default=256,
+        min=0,
+        subtype='UNSIGNED',
+    )
+    cache_directory: StringProperty(
+        name="Cache Directory",
+        description="Also store cached images in this directory, leave empty to keep them only in memory",
+        default="",
+        subtype='DIR_PATH',
+    )
+    ghost_rendering: EnumProperty(
+        items=[("separate", "Separate", "Every ghost is rendered to its own framebuffer and then dispersed"),
+            ("batched", "Batched", "All ghosts of one position are dispersed in one pass, faster with many ghosts")],
+        name="Ghost Rendering",
+        description="Sets how ghosts are rendered",
+        default="separate",
+        update=update_master,
+    )
+    ghost_resolution: EnumProperty(
+        items=[("1", "Full", "Ghosts are rendered at full resolution"),
+            ("2", "1/2", "Ghosts are rendered at half resolution and upsampled"),
+            ("4", "1/4", "Ghosts are rendered at quarter resolution and upsampled"),
+            ("8", "1/8", "Ghosts are rendered at eighth of resolution and upsampled")],
+        name="Ghost Resolution",
+        description="Resolution of ghosts relative to output, flare is always rendered at full resolution. "
+                    "Only used by GPU backend",
+        default="1",
+        update=update_master,
+    )
+    precision: EnumProperty(
+        items=[("8bit", "8 Bit", "Framebuffers store 8 bits per channel, values above 1.0 are clipped"),
+            ("half", "Half Float", "Framebuffers store half floats, uses half of memory of full floats"),
+            ("float", "Float", "Framebuffers store full floats")],
+        name="Precision",
+        description="Precision of framebuffers used for rendering. Only used by GPU backend",
+        default="8bit",
+        update=update_master,
+    )
+    use_half_readback: BoolProperty(
+        name="Half Float Readback",
+        description="Reads rendered image from GPU as half floats, halves transferred data. "
+                    "Only used by GPU backend",
+        default=False,
+        update=update_master,
+    )
+    use_incremental: BoolProperty(
+        name="Incremental Rendering",
+        description="Keeps layer of every position between renders and re-renders only positions which changed, "
+                    "uses more GPU memory. Only used by GPU backend",
+        default=False,
+    )
+    # preview
+    show_preview: BoolProperty(
+        name="Live Preview",
+        description="Shows preview of the effect in compositor, it is updated when settings change",
+        default=False,
+    )
+    preview_scale: IntProperty(
+        name="Preview Scale",
+        description="Resolution of preview relative to output resolution",
+        default=25,
+        min=5,
+        max=100,
+        subtype='PERCENTAGE',
+        update=update_master,
+    )
+    # profiling
+    use_profiling: BoolProperty(
+        name="Profiling",
+        description="Measures time of every render stage, GPU time is measured with timer queries",
+        default=False,
+    )
+    profile_path: StringProperty(
+        name="Profile Report",
+        description="JSON file to write profiling report to, nothing is written when empty",
+        default="",
+        subtype='FILE_PATH',
+    )
+    frame_budget: FloatProperty(
+        name="Frame Budget",
+        description="Time in milliseconds, frames rendered longer are reported after animation",
+        default=40.0,
+        min=0.0,
+    )
+    # backend
+    backend: EnumProperty(
+        items=[("gpu", "GPU", "Render with OpenGL, needs GPU"),
+            ("cpu", "CPU", "Render with NumPy, works without GPU, but is much slower")],
+        name="Backend",
+        description="Sets device used for rendering",
+        default="gpu",
+        update=update_master,
+    )
+    cpu_tile_size: IntProperty(
+        name="Tile Size",
+        description="Size of image tiles rendered on CPU, smaller tiles use less memory",
+        default=256,
+        min=16,
+        max=4096,
+        subtype='PIXEL',
+    )
+    cpu_workers: IntProperty(
+        name="Workers",
+        description="Number of tiles rendered in parallel on CPU (0 uses all cores)",
+        default=0,
+        min=0,
+        max=256,
+    )
+    cpu_pool: EnumProperty(
+        items=[("thread", "Threads", "Render tiles in threads of Blender process"),
+            ("process", "Processes", "Render tiles in forked processes, scales better on many cores (Linux and macOS only)")],
+        name="Worker Pool",
+        description="Sets how tiles are rendered in parallel",
+        default="thread",
     )
     # prop groups
     flare: PointerProperty(
@@ -286,6 +500,10 @@ class MasterProperties(bpy.types.PropertyGroup):
         name="Resolution",
         type=ResolutionProperties,
     )
+    animation: PointerProperty(
+        name="Animation",
+        type=AnimationProperties,
+    )
     # ghost props
     ghosts: CollectionProperty(
         name="Ghosts",
@@ -299,15 +517,43 @@ class MasterProperties(bpy.types.PropertyGroup):
         name="Spectrum Image",
         description="Image of spectrum dispersion",
         type=bpy.types.Image,
+        update=update_master,
     )
     # debug props
     debug_pos: BoolProperty(
         name="Debug Cross",
         description="Render only cross with position",
         default=False,
+        update=update_master,
     )
     use_jitter: BoolProperty(
         name="Use Jitter",
         description="Use jittered ghost rendering (smoother, but noisier)",
         default=True,
+        update=update_master,
+    )
+    # noise props
+    noise_seed: IntProperty(
+        name="Noise Seed",
+        description="Seed of noise used for jitter and flare rays, same seed gives same result on every machine",
+        default=0,
+        min=0,
+        update=update_master,
+    )
+    noise_resolution: EnumProperty(
+        items=[("64", "64", "64x64 noise texture"),
+            ("256", "256", "256x256 noise texture"),
+            ("1024", "1024", "1024x1024 noise texture")],
+        name="Noise Resolution",
+        description="Resolution of noise texture, larger texture repeats less visibly",
+        default="64",
+        update=update_master,
+    )
+    noise_type: EnumProperty(
+        items=[("white", "White", "Uniform white noise"),
+            ("blue", "Blue", "Blue noise, jitter is less visible")],
+        name="Noise Type",
+        description="Sets distribution of noise",
+        default="white",
+        update=update_master,
     )
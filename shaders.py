@@ -1,27 +1,110 @@
-class Shaders:
-    @classmethod
-    def __read_shader(cls, path: str) -> str:
-        import os
+import hashlib
+import os
+
+# compiled programs, shared by every render in this Blender session
+_programs = {}
+# shader sources, read from disk only once
+_sources = {}
+_stats = {
+    "compiles": 0,
+    "hits": 0,
+}
+
 
+def read_shader(path: str) -> str:
+    """
+    Reads shader source relative to add-on directory
+    """
+    if path not in _sources:
         abs_path = os.path.join(os.path.dirname(__file__), path)
 
         with open(abs_path, 'r') as file:
-            return file.read()
+            _sources[path] = file.read()
+
+    return _sources[path]
+
+
+def sources_hash() -> str:
+    """
+    :returns hash of all shader sources of add-on
+    """
+    directory = os.path.join(os.path.dirname(__file__), 'shaders')
+    hasher = hashlib.sha1()
+    for name in sorted(os.listdir(directory)):
+        hasher.update(read_shader(f'./shaders/{name}').encode())
+    return hasher.hexdigest()
+
+
+def get_program(vertex_path: str, fragment_path: str, lib_path: str = './shaders/common.shader'):
+    """
+    Returns compiled shader program, compiles it on first use
+    :returns GPUShader
+    """
+    import gpu
+
+    vertex = read_shader(vertex_path)
+    fragment = read_shader(fragment_path)
+    libcode = read_shader(lib_path)
+
+    # programs are keyed by their sources, so edited shader files get recompiled after reload
+    key = hashlib.sha1('\0'.join((vertex, fragment, libcode)).encode()).hexdigest()
+
+    if key in _programs:
+        _stats["hits"] += 1
+        return _programs[key]
+
+    program = gpu.types.GPUShader(vertex, fragment, libcode=libcode)
+    _programs[key] = program
+    _stats["compiles"] += 1
+
+    return program
+
+
+def clear_cache():
+    """
+    Drops all compiled programs and sources, next render will recompile them
+    """
+    _programs.clear()
+    _sources.clear()
+    _stats["compiles"] = 0
+    _stats["hits"] = 0
+
+
+def cache_stats() -> dict:
+    """
+    :returns number of compiled programs and number of cache hits
+    """
+    return dict(_stats)
+
+
+class Shaders:
+    """
+    Lazy accessor for all shader programs used by renderer
+    """
+    @property
+    def ghost(self):
+        return get_program('./shaders/ghost.vert', './shaders/ghost.frag')
+
+    @property
+    def flare(self):
+        return get_program('./shaders/quad.vert', './shaders/flare.frag')
 
-    def __init__(self):
-        import gpu
+    @property
+    def copy(self):
+        return get_program('./shaders/quad.vert', './shaders/dispersion_copy.frag')
 
-        ghost_vs = Shaders.__read_shader('./shaders/ghost.vert')
-        quad_vs = Shaders.__read_shader('./shaders/quad.vert')
+    @property
+    def ghost_batched(self):
+        return get_program('./shaders/quad.vert', './shaders/ghost_batched.frag')
 
-        ghost_fs = Shaders.__read_shader('./shaders/ghost.frag')
-        flare_fs = Shaders.__read_shader('./shaders/flare.frag')
-        copy_fs = Shaders.__read_shader('./shaders/dispersion_copy.frag')
-        debug_fs = Shaders.__read_shader('./shaders/debug.frag')
+    @property
+    def composite(self):
+        return get_program('./shaders/quad.vert', './shaders/composite.frag')
 
-        common = Shaders.__read_shader('./shaders/common.shader')
+    @property
+    def upsample(self):
+        return get_program('./shaders/quad.vert', './shaders/upsample.frag')
 
-        self.ghost = gpu.types.GPUShader(ghost_vs, ghost_fs, libcode=common)
-        self.flare = gpu.types.GPUShader(quad_vs, flare_fs, libcode=common)
-        self.copy = gpu.types.GPUShader(quad_vs, copy_fs, libcode=common)
-        self.debug = gpu.types.GPUShader(quad_vs, debug_fs, libcode=common)
+    @property
+    def debug(self):
+        return get_program('./shaders/quad.vert', './shaders/debug.frag')
@@ -15,4 +15,8 @@ vec2 euler_to_polar(vec2 euler) {
     }
 
     return vec2(dist, angle);
-}
\ No newline at end of file
+}
+// integral of spectrum from 0 to x, texel k of baked table holds integral up to k / (size - 1)
+vec3 spectrum_integral(sampler2D table, float size, float x) {
+    return texture(table, vec2((x * (size - 1.0) + 0.5) / size, 0.5)).rgb;
+}
@@ -0,0 +1,10 @@
+uniform sampler2D layer;
+
+in vec2 uvInterp;
+
+out vec4 FragColor;
+
+void main() {
+    // layers have same resolution as target, so texels are copied exactly
+    FragColor = vec4(texelFetch(layer, ivec2(gl_FragCoord.xy), 0).rgb, 1.0);
+}
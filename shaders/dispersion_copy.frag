@@ -1,5 +1,7 @@
 uniform sampler2D ghost;
+// spectrum integrated along dispersion, see spectrum.bake_table
 uniform sampler2D spectral;
+uniform float spectral_size;
 uniform sampler2D noise;
 uniform float dispersion;
 uniform float distortion;
@@ -10,6 +12,7 @@ uniform vec2 res;
 uniform float use_jitter;
 uniform float disperse_from_ghost_center;
 uniform vec2 ghost_pos;
+uniform vec3 spectral_mean;
 
 in vec2 uvInterp;
 
@@ -33,19 +36,29 @@ vec2 distortion_vector() {
 }
 
 void main() {
+    if (samples == 1 && dispersion == 0.0) {
+        // dispersion is not visible, so all samples would fetch the same texel
+        vec4 ghost_color = texture(ghost, uvInterp + distortion_vector());
+        FragColor = vec4(ghost_color.rgb * spectral_mean * intensity * master_intensity, 1.0);
+        return;
+    }
+
     vec3 color = vec3(0.0);
+    vec3 integral_start = vec3(0.0);
     for (int i = 0; i < samples; ++i) {
         float x = (float(i) + texture(noise, uvInterp * res).r * use_jitter) / float(samples);
-        vec4 spectral_tex = texture(spectral, vec2(x, x));
+
+        // weight is spectrum integrated over interval of this sample, so weights sum to mean spectrum
+        vec3 integral_end = spectrum_integral(spectral, spectral_size, float(i + 1) / float(samples));
+        vec3 weight = integral_end - integral_start;
+        integral_start = integral_end;
 
         float sample_dispersion = (x - 0.5) * 2.0 * (dispersion) + 1.0;
 
         vec4 ghost_color = texture(ghost, uv_scaled(uvInterp + distortion_vector(), sample_dispersion));
 
-        color += ghost_color.rgb * spectral_tex.rgb;
+        color += ghost_color.rgb * weight;
     }
 
-    color /= float(samples);
-
     FragColor = vec4(color * intensity * master_intensity, 1.0);
 }
\ No newline at end of file
@@ -14,5 +14,6 @@ void main() {
     } else {
         edge = (1.0 - pow(colorInterp.x, 40.0) - (gauss(pow(center, empty), 0.0, 0.3)));
     }
-    FragColor = vec4(color.xyz, edge);
+    // negative values would darken float buffers
+    FragColor = vec4(color.xyz, clamp(edge, 0.0, 1.0));
 }
\ No newline at end of file
@@ -0,0 +1,105 @@
+#define MAX_GHOSTS 32
+
+// xy - ghost position, z - ghost scale, w - aspect ratio of ghost
+uniform vec4 ghost_transform[MAX_GHOSTS];
+// xyz - ghost color, w - center transparency
+uniform vec4 ghost_color[MAX_GHOSTS];
+// x - dispersion, y - distortion, z - intensity, w - disperse from ghost center
+uniform vec4 ghost_dispersion[MAX_GHOSTS];
+// number of dispersion samples of ghost
+uniform float ghost_samples[MAX_GHOSTS];
+uniform int ghost_count;
+
+uniform mat4 rotationMatrix;
+uniform float aspect_ratio;
+uniform float blades;
+
+// spectrum integrated along dispersion, see spectrum.bake_table
+uniform sampler2D spectral;
+uniform float spectral_size;
+uniform sampler2D noise;
+uniform vec3 spectral_mean;
+uniform float master_intensity;
+uniform vec2 res;
+uniform float use_jitter;
+
+in vec2 uvInterp;
+
+out vec4 FragColor;
+
+// same value as ghost.frag would write to ghost framebuffer at given position
+vec3 ghost_value(vec2 uv, int index) {
+    if (uv.x < 0.0 || uv.x > 1.0 || uv.y < 0.0 || uv.y > 1.0) {
+        return vec3(0.0);
+    }
+
+    // inverse of ghost.vert transformation
+    vec4 transform = ghost_transform[index];
+    vec2 local = (uv * 2.0 - 1.0 - transform.xy) / transform.z * vec2(transform.w, 1.0 / aspect_ratio);
+    vec2 pos = (rotationMatrix * vec4(local, 0.0, 1.0)).xy;
+
+    // interpolated vertex color of triangle fan is distance to polygon edge
+    float center = length(pos);
+    float angle = atan(pos.y, pos.x);
+    float sector = 2.0 * PI / blades;
+    float sector_center = (floor(angle / sector) + 0.5) * sector;
+    float edge_distance = center * cos(angle - sector_center) / cos(sector / 2.0);
+
+    if (edge_distance >= 1.0) {
+        return vec3(0.0);
+    }
+
+    float empty = ghost_color[index].w;
+    float edge;
+    if (empty < 1.0) {
+        edge = (1.0 - pow(edge_distance, 40.0) - (gauss(center, 0.0, 0.3)) * empty);
+    } else {
+        edge = (1.0 - pow(edge_distance, 40.0) - (gauss(pow(center, empty), 0.0, 0.3)));
+    }
+
+    return ghost_color[index].xyz * clamp(edge, 0.0, 1.0);
+}
+
+void main() {
+    float jitter = texture(noise, uvInterp * res).r * use_jitter;
+    vec2 moved = uvInterp - 0.5;
+    float moved_length = pow(moved.x, 2.0) + pow(moved.y, 2.0);
+
+    vec3 color = vec3(0.0);
+    for (int g = 0; g < ghost_count; ++g) {
+        vec4 dispersion = ghost_dispersion[g];
+
+        vec2 distorted = uvInterp + moved_length * moved * -dispersion.y;
+        vec2 disperse_center = vec2(0.5);
+        if (dispersion.w > 0.5) {
+            disperse_center = ghost_transform[g].xy / 2.0 + 0.5;
+        }
+
+        int samples = int(ghost_samples[g]);
+        if (samples == 1 && dispersion.x == 0.0) {
+            // dispersion is not visible, so all samples would give the same value
+            color += ghost_value(distorted, g) * spectral_mean * dispersion.z;
+            continue;
+        }
+
+        vec3 ghost_sum = vec3(0.0);
+        vec3 integral_start = vec3(0.0);
+        for (int i = 0; i < samples; ++i) {
+            float x = (float(i) + jitter) / float(samples);
+
+            // weight is spectrum integrated over interval of this sample, so weights sum to mean spectrum
+            vec3 integral_end = spectrum_integral(spectral, spectral_size, float(i + 1) / float(samples));
+            vec3 weight = integral_end - integral_start;
+            integral_start = integral_end;
+
+            float sample_dispersion = (x - 0.5) * 2.0 * dispersion.x + 1.0;
+            vec2 sample_uv = (distorted - disperse_center) * sample_dispersion + disperse_center;
+
+            ghost_sum += ghost_value(sample_uv, g) * weight;
+        }
+
+        color += ghost_sum * dispersion.z;
+    }
+
+    FragColor = vec4(color * master_intensity, 1.0);
+}
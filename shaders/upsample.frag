@@ -0,0 +1,45 @@
+uniform sampler2D source;
+uniform vec2 source_size;
+
+in vec2 uvInterp;
+
+out vec4 FragColor;
+
+// cubic B-spline weights
+vec4 cubic(float v) {
+    vec4 n = vec4(1.0, 2.0, 3.0, 4.0) - v;
+    vec4 s = n * n * n;
+    float x = s.x;
+    float y = s.y - 4.0 * s.x;
+    float z = s.z - 4.0 * s.y + 6.0 * s.x;
+    float w = 6.0 - x - y - z;
+    return vec4(x, y, z, w) * (1.0 / 6.0);
+}
+
+// bicubic filter evaluated with four bilinear fetches
+vec3 texture_bicubic(vec2 uv) {
+    vec2 texel = uv * source_size - 0.5;
+    vec2 fxy = fract(texel);
+    texel -= fxy;
+
+    vec4 xcubic = cubic(fxy.x);
+    vec4 ycubic = cubic(fxy.y);
+
+    vec4 c = texel.xxyy + vec2(-0.5, 1.5).xyxy;
+    vec4 s = vec4(xcubic.xz + xcubic.yw, ycubic.xz + ycubic.yw);
+    vec4 offset = (c + vec4(xcubic.yw, ycubic.yw) / s) / source_size.xxyy;
+
+    vec3 sample0 = texture(source, offset.xz).rgb;
+    vec3 sample1 = texture(source, offset.yz).rgb;
+    vec3 sample2 = texture(source, offset.xw).rgb;
+    vec3 sample3 = texture(source, offset.yw).rgb;
+
+    float sx = s.x / (s.x + s.y);
+    float sy = s.z / (s.z + s.w);
+
+    return mix(mix(sample3, sample2, sx), mix(sample1, sample0, sx), sy);
+}
+
+void main() {
+    FragColor = vec4(texture_bicubic(uvInterp), 1.0);
+}
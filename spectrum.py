@@ -0,0 +1,158 @@
+import hashlib
+import os
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import numpy
+
+# number of spectrum intervals in baked table, has to be at least maximal dispersion sample count
+TABLE_RESOLUTION = 1024
+# number of baked tables kept in memory
+MAX_TABLES = 4
+
+# maps image key to baked table and its hash
+_tables = OrderedDict()
+# maps image name to number of its updates, which don't change any other part of image key
+_image_versions = {}
+
+
+def spectrum_table(image) -> numpy.ndarray:
+    """
+    Bakes spectrum image on first use, table is rebaked only when image changes
+    :returns read-only table from `bake_table`
+    """
+    return _baked(image)[0]
+
+
+def table_hash(image) -> str:
+    """
+    :returns hash of baked table of image, it is computed only when table is baked
+    """
+    return _baked(image)[1]
+
+
+def _baked(image) -> Tuple[numpy.ndarray, str]:
+    key = image_key(image)
+
+    if key in _tables:
+        _tables.move_to_end(key)
+        return _tables[key]
+
+    table = bake_table(to_linear(image, read_pixels(image)))
+    _tables[key] = (table, hashlib.sha1(table.tobytes()).hexdigest())
+
+    while len(_tables) > MAX_TABLES:
+        _tables.popitem(last=False)
+
+    return _tables[key]
+
+
+def image_key(image) -> tuple:
+    """
+    Pixels are not read, edits are detected by update counter from `tag_image`, dirty flag and file time
+    :returns identity of image, it changes when different file or color space is used or image is edited
+    """
+    if image.packed_file is not None:
+        source = image.packed_file.size
+    else:
+        source = _file_time(image.filepath_from_user())
+
+    return (
+        image.name_full,
+        image.filepath,
+        tuple(image.size),
+        image.is_float,
+        image.colorspace_settings.name,
+        image.is_dirty,
+        source,
+        _image_versions.get(image.name_full, 0),
+    )
+
+
+def tag_image(name: str):
+    """
+    Marks image as updated, for painting, reloads and Python edits reported by depsgraph
+    """
+    _image_versions[name] = _image_versions.get(name, 0) + 1
+
+
+def clear_cache():
+    _tables.clear()
+    _image_versions.clear()
+
+
+def _file_time(path: str) -> Optional[float]:
+    try:
+        return os.path.getmtime(path)
+    except (OSError, ValueError):
+        return None
+
+
+def read_pixels(image) -> numpy.ndarray:
+    """
+    :returns flat float array of image pixels as stored by Blender
+    """
+    width, height = image.size
+    pixels = numpy.empty(width * height * image.channels, dtype=numpy.float32)
+    image.pixels.foreach_get(pixels)
+    return pixels
+
+
+def to_linear(image, pixels: numpy.ndarray) -> numpy.ndarray:
+    """
+    Converts pixels from `read_pixels` to float RGBA array with shape (height, width, 4) in linear color space
+    """
+    width, height = image.size
+    channels = image.channels
+    pixels = pixels.reshape((height, width, channels))
+
+    rgba = numpy.ones((height, width, 4), dtype=numpy.float32)
+    rgba[..., :min(channels, 4)] = pixels[..., :4]
+
+    # byte images are stored in display space, GPU converts them on texture fetch
+    if not image.is_float and image.colorspace_settings.name == 'sRGB':
+        rgb = rgba[..., :3]
+        rgba[..., :3] = numpy.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+
+    return rgba
+
+
+def bake_table(spectrum: numpy.ndarray, resolution: int = TABLE_RESOLUTION) -> numpy.ndarray:
+    """
+    Integrates spectrum along diagonal, which is sampled by dispersion.
+    Value at index k is average spectrum color over <0, k / resolution> multiplied by k / resolution,
+    so weight of any interval is difference of two values.
+    :param spectrum RGBA spectrum image with shape (height, width, 4)
+    :returns read-only float32 array with shape (resolution + 1, 3)
+    """
+    # avoid circular import, CPU renderer uses baked tables too
+    from .cpu import sample_texture
+
+    x = (numpy.arange(resolution) + 0.5) / resolution
+    values = sample_texture(spectrum, x, x)[:, :3]
+
+    table = numpy.zeros((resolution + 1, 3), dtype=numpy.float32)
+    table[1:] = numpy.cumsum(values, axis=0) / resolution
+    table.setflags(write=False)
+
+    return table
+
+
+def sample_weights(table: numpy.ndarray, samples: int) -> numpy.ndarray:
+    """
+    Splits spectrum into equal intervals, weight of sample is integral of spectrum over its interval
+    :returns float array with shape (samples, 3), weights sum to mean spectrum color
+    """
+    grid = numpy.linspace(0.0, 1.0, len(table))
+    bounds = numpy.linspace(0.0, 1.0, samples + 1)
+
+    integral = numpy.stack([numpy.interp(bounds, grid, table[:, channel]) for channel in range(3)], axis=-1)
+
+    return numpy.diff(integral, axis=0)
+
+
+def table_mean(table: numpy.ndarray) -> Tuple[float, float, float]:
+    """
+    :returns mean color of spectrum
+    """
+    return tuple(float(value) for value in table[-1])
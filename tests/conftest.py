@@ -0,0 +1,19 @@
+"""
+Tests of modules, which don't need Blender. Add-on is imported as package `lens_flare` without its `__init__`,
+because it imports bpy, same as pure Python mode of benchmark.py.
+"""
+import os
+import sys
+import types
+
+ADDON_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if 'lens_flare' not in sys.modules:
+    package = types.ModuleType('lens_flare')
+    package.__path__ = [ADDON_DIRECTORY]
+    sys.modules['lens_flare'] = package
+    # pytest imports `__init__` of add-on directory by directory name, it gets the package without bpy too
+    sys.modules.setdefault(os.path.basename(ADDON_DIRECTORY), package)
+
+# benchmark settings and synthetic spectrum are shared with tests
+sys.path.insert(0, ADDON_DIRECTORY)
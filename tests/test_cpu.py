@@ -0,0 +1,86 @@
+import types
+
+import numpy
+import pytest
+
+from benchmark import ghost_settings, position_settings, synthetic_spectrum
+from lens_flare import cpu, jobs, spectrum
+
+
+def flare_params(width=96, height=64, ghosts=6, positions=2, samples=8):
+    ns = types.SimpleNamespace
+    props = ns(
+        resolution=ns(resolution_x=width, resolution_y=height),
+        camera=ns(blades=6, rotation=0.3),
+        flare=ns(color=(0.9, 0.8, 0.7), size=10.0, intensity=1.0, rays_intensity=1.0, anamorphic=False),
+        ghosts=[ns(color=(0.9, 0.9, 0.9), **settings) for settings in ghost_settings(ghosts)],
+        master_intensity=1.0,
+        dispersion_samples=samples,
+        use_adaptive_samples=False,
+        use_jitter=True,
+        noise_resolution='64',
+        noise_seed=3,
+        noise_type='white',
+    )
+    return cpu.collect_params(props, position_settings(positions), spectrum.bake_table(synthetic_spectrum()))
+
+
+@pytest.fixture(scope='module')
+def params():
+    return flare_params()
+
+
+@pytest.fixture(scope='module')
+def reference(params):
+    return cpu.render(params, tile_size=256, workers=1)
+
+
+def test_render_layout(params, reference):
+    assert reference.dtype == numpy.float32
+    assert reference.shape == (params.width * params.height * 4,)
+    assert numpy.all(numpy.isfinite(reference))
+    # flare and ghosts are visible
+    assert reference.reshape((-1, 4))[:, :3].max() > 0.1
+
+
+@pytest.mark.parametrize('tile_size', [7, 16, 33, 64])
+def test_render_independent_of_tile_size(params, reference, tile_size):
+    numpy.testing.assert_array_equal(cpu.render(params, tile_size=tile_size, workers=1), reference)
+
+
+@pytest.mark.parametrize('workers', [2, 4, 0])
+def test_render_independent_of_worker_count(params, reference, workers):
+    numpy.testing.assert_array_equal(cpu.render(params, tile_size=16, workers=workers), reference)
+
+
+def test_render_in_processes(params, reference):
+    numpy.testing.assert_array_equal(cpu.render(params, tile_size=32, workers=2, use_processes=True), reference)
+
+
+def test_render_steps_yield_every_tile(params, reference):
+    steps = cpu.render_steps(params, tile_size=32, workers=2)
+    tile_count = len(cpu.tiles(params.width, params.height, 32))
+
+    progress = []
+    while True:
+        try:
+            progress.append(next(steps))
+        except StopIteration as stop:
+            buffer = stop.value
+            break
+
+    assert progress == [(index + 1, tile_count) for index in range(tile_count)]
+    numpy.testing.assert_array_equal(buffer, reference)
+
+
+def test_closed_render_steps_stop(params):
+    steps = cpu.render_steps(params, tile_size=8, workers=2)
+    next(steps)
+    steps.close()
+
+    with pytest.raises(StopIteration):
+        next(steps)
+
+
+def test_render_matches_run_steps(params, reference):
+    numpy.testing.assert_array_equal(jobs.run_steps(cpu.render_steps(params, tile_size=256)), reference)
@@ -0,0 +1,51 @@
+import types
+
+import numpy
+import pytest
+
+from benchmark import ghost_settings
+from lens_flare import cpu, geometry
+from test_cpu import flare_params
+
+
+def visible_pixels(params, ghost) -> numpy.ndarray:
+    """
+    :returns mask of pixels, where ghost evaluated over whole image is not black
+    """
+    u, v = cpu._uv_grid(params.width, params.height, 0, 0, params.width, params.height)
+    noise = numpy.full(u.shape, 0.5)
+    with numpy.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        color = cpu.copy_ghost(params, ghost, u, v, noise)
+    return numpy.any(color > 0.0, axis=-1)
+
+
+@pytest.mark.parametrize('positions', [1, 3])
+def test_copy_bounds_cover_ghost(positions):
+    params = flare_params(width=120, height=80, ghosts=12, positions=positions)
+    ghosts = [ghost for position in params.positions for ghost in position.ghosts]
+    assert len(ghosts) > 0
+
+    for ghost in ghosts:
+        x, y, width, height = ghost.bounds
+        inside = numpy.zeros((params.height, params.width), dtype=bool)
+        inside[y:y + height, x:x + width] = True
+
+        visible = visible_pixels(params, ghost)
+        assert not numpy.any(visible & ~inside), ghost
+
+
+def test_copy_bounds_are_tight_for_plain_ghost():
+    ghost = types.SimpleNamespace(**dict(ghost_settings(1)[0], size=10.0, dispersion=0.0, distortion=0.0))
+    x, y, width, height = geometry.ghost_copy_bounds(ghost, 0.0, 0.0, 1.0, 200, 200)
+
+    # ghost covers 10 % of image and margin on every side
+    assert width <= 20 + 2 * geometry.BOUNDS_MARGIN + 2
+    assert height <= 20 + 2 * geometry.BOUNDS_MARGIN + 2
+    # centered ghost gives centered rectangle
+    assert abs(x - (200 - width) / 2) <= 1
+    assert abs(y - (200 - height) / 2) <= 1
+
+
+def test_ghost_outside_image_has_empty_bounds():
+    ghost = types.SimpleNamespace(**dict(ghost_settings(1)[0], size=5.0, dispersion=0.0, distortion=0.0))
+    assert geometry.ghost_copy_bounds(ghost, 5.0, 5.0, 1.0, 100, 100)[2:] == (0, 0)
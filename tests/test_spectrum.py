@@ -0,0 +1,87 @@
+import types
+
+import numpy
+import pytest
+
+from benchmark import synthetic_spectrum
+from lens_flare import spectrum
+
+
+@pytest.fixture(scope='module')
+def table():
+    return spectrum.bake_table(synthetic_spectrum())
+
+
+def test_table_layout(table):
+    assert table.shape == (spectrum.TABLE_RESOLUTION + 1, 3)
+    assert not table.flags.writeable
+    numpy.testing.assert_array_equal(table[0], 0.0)
+    # integral of non-negative spectrum never decreases
+    assert numpy.all(numpy.diff(table, axis=0) >= 0.0)
+
+
+@pytest.mark.parametrize('samples', [1, 2, 3, 16, 100, 1024])
+def test_sample_weights_sum_to_mean(table, samples):
+    weights = spectrum.sample_weights(table, samples)
+
+    assert weights.shape == (samples, 3)
+    numpy.testing.assert_allclose(weights.sum(axis=0), spectrum.table_mean(table), rtol=1e-5, atol=1e-6)
+
+
+def test_constant_spectrum_has_equal_weights():
+    table = spectrum.bake_table(numpy.full((4, 4, 4), 0.5, dtype=numpy.float32))
+    numpy.testing.assert_allclose(spectrum.sample_weights(table, 8), 0.5 / 8, rtol=1e-5)
+    numpy.testing.assert_allclose(spectrum.table_mean(table), (0.5, 0.5, 0.5), rtol=1e-5)
+
+
+class FakePixels:
+    def __init__(self, values):
+        self.values = values
+
+    def foreach_get(self, target):
+        target[:] = self.values
+
+
+def fake_image(name='Spectrum'):
+    ns = types.SimpleNamespace
+    values = numpy.random.default_rng(0).random(8 * 2 * 4).astype(numpy.float32)
+    return ns(
+        name_full=name,
+        filepath='',
+        filepath_from_user=lambda: '',
+        packed_file=None,
+        size=(8, 2),
+        channels=4,
+        is_float=True,
+        is_dirty=False,
+        colorspace_settings=ns(name='Linear'),
+        pixels=FakePixels(values),
+    )
+
+
+def test_spectrum_table_is_cached_until_image_is_tagged():
+    spectrum.clear_cache()
+    image = fake_image()
+
+    table = spectrum.spectrum_table(image)
+    table_hash = spectrum.table_hash(image)
+    assert spectrum.spectrum_table(image) is table
+
+    # pixels are not read again until image is tagged
+    image.pixels.values = image.pixels.values * 0.5
+    assert spectrum.spectrum_table(image) is table
+
+    spectrum.tag_image(image.name_full)
+    assert spectrum.spectrum_table(image) is not table
+    assert spectrum.table_hash(image) != table_hash
+
+
+def test_spectrum_table_follows_dirty_flag():
+    spectrum.clear_cache()
+    image = fake_image()
+
+    table = spectrum.spectrum_table(image)
+    image.pixels.values = image.pixels.values * 0.5
+    image.is_dirty = True
+
+    assert spectrum.spectrum_table(image) is not table
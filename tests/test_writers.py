@@ -0,0 +1,155 @@
+import struct
+import zlib
+
+import numpy
+import pytest
+
+from lens_flare import writers
+
+WIDTH = 13
+HEIGHT = 37
+
+
+@pytest.fixture(params=['noise', 'gradient'])
+def pixels(request):
+    """
+    Noise is stored uncompressed, smooth gradient is ZIP compressed
+    """
+    if request.param == 'noise':
+        rng = numpy.random.default_rng(1)
+        return (rng.random(WIDTH * HEIGHT * 4) * 2.0).astype(numpy.float32)
+
+    return numpy.linspace(0.0, 1.0, WIDTH * HEIGHT * 4, dtype=numpy.float32)
+
+
+def read_exr(path: str):
+    """
+    Minimal reader of files from `write_exr`
+    :returns header attributes and float RGBA pixels with rows from bottom to top
+    """
+    with open(path, 'rb') as file:
+        data = file.read()
+
+    magic, version = struct.unpack_from('<ii', data, 0)
+    assert magic == 20000630
+    assert version & 0xff == 2
+
+    offset = 8
+    attributes = {}
+    while data[offset] != 0:
+        name_end = data.index(b'\0', offset)
+        type_end = data.index(b'\0', name_end + 1)
+        size, = struct.unpack_from('<i', data, type_end + 1)
+        value_start = type_end + 5
+        attributes[data[offset:name_end].decode()] = (data[name_end + 1:type_end].decode(),
+                                                      data[value_start:value_start + size])
+        offset = value_start + size
+    offset += 1
+
+    min_x, min_y, max_x, max_y = struct.unpack('<iiii', attributes['dataWindow'][1])
+    width, height = max_x - min_x + 1, max_y - min_y + 1
+
+    channels = []
+    chlist = attributes['channels'][1]
+    position = 0
+    while chlist[position] != 0:
+        name_end = chlist.index(b'\0', position)
+        pixel_type, = struct.unpack_from('<i', chlist, name_end + 1)
+        channels.append((chlist[position:name_end].decode(), pixel_type))
+        position = name_end + 17
+
+    dtype = numpy.dtype('<f2') if channels[0][1] == writers.EXR_HALF else numpy.dtype('<f4')
+    chunk_count = -(-height // writers.EXR_ZIP_LINES)
+    offsets = struct.unpack_from(f'<{chunk_count}Q', data, offset)
+
+    lines = []
+    for chunk_offset in offsets:
+        start, size = struct.unpack_from('<ii', data, chunk_offset)
+        raw = data[chunk_offset + 8:chunk_offset + 8 + size]
+        line_count = min(writers.EXR_ZIP_LINES, height - start)
+        expected = line_count * width * len(channels) * dtype.itemsize
+        if size < expected:
+            raw = unzip_exr(raw)
+        lines.append(numpy.frombuffer(raw, dtype=dtype).reshape((line_count, len(channels), width)))
+
+    planar = numpy.concatenate(lines)
+    image = numpy.empty((height, width, 4), dtype=numpy.float32)
+    for index, (name, _) in enumerate(channels):
+        image[..., "RGBA".index(name[-1])] = planar[:, index]
+
+    return attributes, channels, image[::-1]
+
+
+def unzip_exr(data: bytes) -> bytes:
+    """
+    Inverse of `writers._exr_zip`
+    """
+    predicted = numpy.frombuffer(zlib.decompress(data), dtype=numpy.uint8).astype(numpy.int64)
+    predicted[1:] -= 128
+    reordered = (numpy.cumsum(predicted) & 0xff).astype(numpy.uint8)
+
+    half = (len(reordered) + 1) // 2
+    raw = numpy.empty(len(reordered), dtype=numpy.uint8)
+    raw[0::2] = reordered[:half]
+    raw[1::2] = reordered[half:]
+    return raw.tobytes()
+
+
+@pytest.mark.parametrize('half', [True, False])
+def test_exr_round_trip(tmp_path, pixels, half):
+    path = str(tmp_path / 'flare.exr')
+    writers.write_exr(path, pixels, WIDTH, HEIGHT, half)
+
+    attributes, channels, image = read_exr(path)
+
+    assert attributes['compression'] == ('compression', bytes([writers.EXR_ZIP_COMPRESSION]))
+    assert struct.unpack('<iiii', attributes['displayWindow'][1]) == (0, 0, WIDTH - 1, HEIGHT - 1)
+    assert [name for name, _ in channels] == [f"LensFlare.Combined.{name}" for name in "ABGR"]
+    assert {pixel_type for _, pixel_type in channels} == {writers.EXR_HALF if half else writers.EXR_FLOAT}
+
+    expected = pixels.reshape((HEIGHT, WIDTH, 4))
+    if half:
+        expected = expected.astype(numpy.float16).astype(numpy.float32)
+    numpy.testing.assert_array_equal(image, expected)
+
+
+def test_exr_long_layer_name_flag(tmp_path, pixels):
+    path = str(tmp_path / 'flare.exr')
+    writers.write_exr(path, pixels, WIDTH, HEIGHT, layer='VeryLongLayerNameOfLensFlare')
+
+    with open(path, 'rb') as file:
+        _, version = struct.unpack('<ii', file.read(8))
+    assert version & 0x400
+
+
+def test_png16_round_trip(tmp_path, pixels):
+    path = str(tmp_path / 'flare.png')
+    writers.write_png16(path, pixels, WIDTH, HEIGHT)
+
+    with open(path, 'rb') as file:
+        data = file.read()
+
+    assert data[:8] == b'\x89PNG\r\n\x1a\n'
+
+    chunks = {}
+    offset = 8
+    while offset < len(data):
+        size, = struct.unpack_from('>I', data, offset)
+        chunk_type = data[offset + 4:offset + 8]
+        content = data[offset + 8:offset + 8 + size]
+        crc, = struct.unpack_from('>I', data, offset + 8 + size)
+        assert crc == zlib.crc32(chunk_type + content)
+        chunks[chunk_type] = content
+        offset += size + 12
+
+    assert struct.unpack('>IIBBBBB', chunks[b'IHDR']) == (WIDTH, HEIGHT, 16, 6, 0, 0, 0)
+    assert chunks[b'IEND'] == b''
+
+    lines = numpy.frombuffer(zlib.decompress(chunks[b'IDAT']), dtype=numpy.uint8).reshape((HEIGHT, WIDTH * 8 + 1))
+    assert numpy.all(lines[:, 0] == 0)
+    values = lines[:, 1:].copy().view('>u2').reshape((HEIGHT, WIDTH, 4)) / 65535.0
+
+    expected = numpy.clip(pixels.reshape((HEIGHT, WIDTH, 4))[::-1], 0.0, 1.0).astype(numpy.float64)
+    rgb = expected[..., :3]
+    expected[..., :3] = numpy.where(rgb <= 0.0031308, rgb * 12.92, 1.055 * rgb ** (1.0 / 2.4) - 0.055)
+    numpy.testing.assert_allclose(values, expected, atol=1.0 / 65535.0)
@@ -0,0 +1,151 @@
+import re
+from contextlib import contextmanager
+from typing import Callable, Optional, Set
+
+# tracked property groups
+GROUPS = ('master', 'ghosts', 'flare', 'camera', 'positions')
+
+# extracts collection index from path like `lens_flare_props.ghosts[3]`
+_INDEX_PATTERN = re.compile(r"\[(\d+)\]$")
+
+# generation of last change, it only grows
+_generation = 0
+# generation of last change of every group
+_groups = {group: 0 for group in GROUPS}
+# generation of last change of collection items, keyed by group and index
+_items = {}
+# generation of last added, removed or reordered item of collection
+_structure = {group: 0 for group in GROUPS}
+
+# changes collected in batch, they are committed as one generation
+_batch_depth = 0
+_pending = set()
+_pending_structure = set()
+
+# functions called with new generation after every commit
+_listeners = []
+
+
+def generation() -> int:
+    """
+    :returns generation of last change, compare it with stored value to find out whether anything changed
+    """
+    return _generation
+
+
+def mark(group: str, index: int = None):
+    """
+    Records change of property group, inside `batch` the change is committed when batch ends
+    :param index index of changed collection item, None marks whole group
+    """
+    _pending.add((group, index))
+
+    if _batch_depth == 0:
+        _commit()
+
+
+def mark_structure(group: str):
+    """
+    Records added, removed or reordered items of collection, indices of all items are invalidated
+    """
+    _pending_structure.add(group)
+    mark(group)
+
+
+def changed_since(gen: int, group: str = None) -> bool:
+    """
+    :param gen generation returned from `generation` earlier
+    :param group tracked group, None checks all groups
+    """
+    if group is None:
+        return _generation > gen
+    return _groups[group] > gen
+
+
+def changes_since(gen: int) -> Set[str]:
+    """
+    :returns names of groups changed after generation
+    """
+    return {group for group in GROUPS if _groups[group] > gen}
+
+
+def item_changed_since(gen: int, group: str, index: int) -> bool:
+    """
+    Item is changed also when collection changed structure, because its index could point to other item
+    """
+    if _structure[group] > gen:
+        return True
+    return _items.get((group, index), 0) > gen
+
+
+@contextmanager
+def batch():
+    """
+    Collects all changes in `with` block into one generation, listeners are called once after it ends.
+    Scripts editing many properties should use it, so only one render is triggered:
+
+    with tracking.batch():
+        for ghost in props.ghosts:
+            ghost.size *= 2.0
+    """
+    global _batch_depth
+    _batch_depth += 1
+    try:
+        yield
+    finally:
+        _batch_depth -= 1
+        if _batch_depth == 0 and len(_pending) != 0:
+            _commit()
+
+
+def in_batch() -> bool:
+    return _batch_depth > 0
+
+
+def add_listener(listener: Callable[[int], None]):
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def remove_listener(listener: Callable[[int], None]):
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def updater(group: str) -> Callable:
+    """
+    Creates update callback for properties of group, collection items are marked with their index
+    """
+    def update(self, context):
+        mark(group, item_index(self))
+
+    return update
+
+
+def item_index(group) -> Optional[int]:
+    """
+    :returns index of property group in its collection or None, when it isn't collection item
+    """
+    match = _INDEX_PATTERN.search(group.path_from_id())
+    if match is None:
+        return None
+    return int(match.group(1))
+
+
+def _commit():
+    global _generation
+    _generation += 1
+
+    for group, index in _pending:
+        _groups[group] = _generation
+        if index is not None:
+            _items[(group, index)] = _generation
+
+    for group in _pending_structure:
+        _structure[group] = _generation
+
+    _pending.clear()
+    _pending_structure.clear()
+
+    for listener in list(_listeners):
+        listener(_generation)
@@ -0,0 +1,128 @@
+import struct
+import zlib
+
+import numpy
+
+# OpenEXR compression types
+EXR_NO_COMPRESSION = 0
+EXR_ZIP_COMPRESSION = 3
+# OpenEXR pixel types
+EXR_HALF = 1
+EXR_FLOAT = 2
+
+# scanlines in one ZIP compressed block
+EXR_ZIP_LINES = 16
+
+
+def write_exr(path: str, pixels: numpy.ndarray, width: int, height: int, half: bool = True, layer: str = 'LensFlare'):
+    """
+    Writes RGBA pixels to multilayer OpenEXR file with single layer
+    :param pixels float RGBA pixels with rows from bottom to top, same layout as Image.pixels
+    :param half store channels as half floats instead of full floats
+    :param layer name of layer, channels are named `<layer>.Combined.<channel>`
+    """
+    image = numpy.asarray(pixels, dtype=numpy.float32).reshape((height, width, 4))
+    # OpenEXR stores lines from top to bottom
+    image = image[::-1]
+
+    pixel_type = EXR_HALF if half else EXR_FLOAT
+    dtype = numpy.dtype('<f2') if half else numpy.dtype('<f4')
+
+    # channels have to be sorted alphabetically
+    channels = sorted(zip("RGBA", range(4)), key=lambda channel: channel[0])
+
+    chlist = b''
+    for name, _ in channels:
+        chlist += f"{layer}.Combined.{name}".encode() + b'\0'
+        chlist += struct.pack('<iB3xii', pixel_type, 0, 1, 1)
+    chlist += b'\0'
+
+    header = b''
+    header += _exr_attribute('channels', 'chlist', chlist)
+    header += _exr_attribute('compression', 'compression', struct.pack('<B', EXR_ZIP_COMPRESSION))
+    header += _exr_attribute('dataWindow', 'box2i', struct.pack('<iiii', 0, 0, width - 1, height - 1))
+    header += _exr_attribute('displayWindow', 'box2i', struct.pack('<iiii', 0, 0, width - 1, height - 1))
+    header += _exr_attribute('lineOrder', 'lineOrder', struct.pack('<B', 0))
+    header += _exr_attribute('pixelAspectRatio', 'float', struct.pack('<f', 1.0))
+    header += _exr_attribute('screenWindowCenter', 'v2f', struct.pack('<ff', 0.0, 0.0))
+    header += _exr_attribute('screenWindowWidth', 'float', struct.pack('<f', 1.0))
+    header += b'\0'
+
+    # every line is stored as all values of first channel, then second channel and so on
+    planar = numpy.stack([image[..., index] for _, index in channels], axis=1).astype(dtype)
+
+    chunks = []
+    for start in range(0, height, EXR_ZIP_LINES):
+        raw = planar[start:start + EXR_ZIP_LINES].tobytes()
+        data = _exr_zip(raw)
+        # reader decides by size, whether block is compressed
+        if len(data) >= len(raw):
+            data = raw
+        chunks.append(struct.pack('<ii', start, len(data)) + data)
+
+    version = 2
+    if len(layer) + len('.Combined.R') > 31:
+        # long attribute and channel names flag
+        version |= 0x400
+
+    magic = struct.pack('<ii', 20000630, version)
+    offset = len(magic) + len(header) + 8 * len(chunks)
+
+    offsets = b''
+    for chunk in chunks:
+        offsets += struct.pack('<Q', offset)
+        offset += len(chunk)
+
+    with open(path, 'wb') as file:
+        file.write(magic)
+        file.write(header)
+        file.write(offsets)
+        for chunk in chunks:
+            file.write(chunk)
+
+
+def write_png16(path: str, pixels: numpy.ndarray, width: int, height: int):
+    """
+    Writes RGBA pixels to 16 bit PNG file, color is converted from linear to sRGB
+    :param pixels float RGBA pixels with rows from bottom to top, same layout as Image.pixels
+    """
+    image = numpy.asarray(pixels, dtype=numpy.float32).reshape((height, width, 4))
+    # PNG stores lines from top to bottom
+    image = numpy.clip(image[::-1], 0.0, 1.0)
+
+    rgb = image[..., :3]
+    image[..., :3] = numpy.where(rgb <= 0.0031308, rgb * 12.92, 1.055 * rgb ** (1.0 / 2.4) - 0.055)
+
+    values = numpy.round(image * 65535.0).astype('>u2').reshape((height, width * 4))
+
+    # every line starts with filter type, zero is no filter
+    lines = numpy.zeros((height, width * 8 + 1), dtype=numpy.uint8)
+    lines[:, 1:] = values.view(numpy.uint8)
+
+    with open(path, 'wb') as file:
+        file.write(b'\x89PNG\r\n\x1a\n')
+        file.write(_png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 16, 6, 0, 0, 0)))
+        file.write(_png_chunk(b'IDAT', zlib.compress(lines.tobytes(), 6)))
+        file.write(_png_chunk(b'IEND', b''))
+
+
+def _exr_attribute(name: str, attribute_type: str, value: bytes) -> bytes:
+    return name.encode() + b'\0' + attribute_type.encode() + b'\0' + struct.pack('<i', len(value)) + value
+
+
+def _exr_zip(raw: bytes) -> bytes:
+    """
+    OpenEXR ZIP compression, bytes are split to odd and even halves and delta encoded before deflate
+    """
+    data = numpy.frombuffer(raw, dtype=numpy.uint8)
+    reordered = numpy.concatenate((data[0::2], data[1::2])).astype(numpy.int16)
+
+    predicted = numpy.empty(reordered.shape, dtype=numpy.uint8)
+    predicted[0] = reordered[0]
+    predicted[1:] = (reordered[1:] - reordered[:-1] + 128 + 256) & 0xff
+
+    return zlib.compress(predicted.tobytes())
+
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))